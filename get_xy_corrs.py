@@ -1,26 +1,307 @@
 # general packages
-import ROOT
+import sys
 import json
 import logging
+from functools import partial
 
-# correction steps
-from python.correction.snapshot_maker import make_snapshot
-from python.correction.histograms import check_snapshots, make_hists
-from python.correction.correction_extractor import get_corrections
-from python.correction.convert2json import make_correction_with_formula
-from python.correction.validate import validate_json, make_validation_plots
+# correction steps are imported on first use (timed_import), so that
+# light steps do not load ROOT or compile any C++ code
 
 # python inputs
 from inputs.config.paths import get_paths
 from inputs.config.binning import get_bins
 from inputs.config.labels import get_labels
+from inputs.config.snapshot import get_snapshot_config
 
 # tools
 from python.tools.parsers import parse_arguments
 from python.tools.logger_setup import setup_logger
-from python.tools.das_query import get_files_from_das
+from python.tools.resources import get_resources, get_tune_file
+from python.tools.profiling import (
+    setup_profiling, profile_stage, timed_import, write_report
+)
+from python.tools.stage_cache import fingerprint, is_up_to_date, write_stamp
+from python.tools.backends import setup_backend
+from python.tools.telemetry import setup_telemetry, monitor
+from python.tools.resolver import setup_resolver
+from python.tools.workers import setup_workers
+from python.tools.das_query import get_nevents_path
+from python.tools.preview import write_sample, report_precision
 
-ROOT.gROOT.SetBatch(1)
+
+def get_stage_inputs(stage, args, path_dict, hbins, mets, pileups, datamc):
+    """
+    Inputs and outputs of a step for the fingerprint of the stage cache.
+
+    Returns:
+        dict: 'files' hashed by content, 'listings' (glob patterns of large
+            outputs of earlier steps) hashed by metadata, 'configs', 'code'
+            and 'outputs' (glob patterns).
+    """
+    snap = [f"{path_dict['snap_dir']}{dtmc}/file_*.root" for dtmc in datamc]
+    manifests = [
+        f"{path_dict['snap_dir']}{dtmc}/manifest.json" for dtmc in datamc
+    ]
+    arrow = [f"{path_dict['snap_dir']}{dtmc}/arrow/*" for dtmc in datamc]
+    friends = [
+        f"{path_dict['snap_dir']}{dtmc}/friends/*.root" for dtmc in datamc
+    ]
+    hists = [f"{path_dict['hist_dir']}{dtmc}.root" for dtmc in datamc]
+    if args.estimator != 'mean':
+        hists += [
+            f"{path_dict['hist_dir']}{dtmc}_sketches.root" for dtmc in datamc
+        ]
+    corrs = [f"{path_dict['corr_dir']}{dtmc}.json" for dtmc in datamc]
+    schema = path_dict['corr_dir'].replace(
+        f'{args.year}/', f'schemaV2_{args.year}.json'
+    )
+    options = {
+        'year': args.year, 'mets': mets, 'pileups': pileups, 'datamc': datamc
+    }
+    # format, staging and clustering of the snapshots
+    snapshot_config = get_snapshot_config()
+
+    # shared code of the steps that write or read snapshots
+    snapshot_code = [
+        'python/tools/snapshot_io.py',
+        'python/tools/backends.py',
+        'inputs/config/snapshot.py',
+    ]
+    production_code = snapshot_code + [
+        'python/tools/staging.py',
+        'python/tools/resolver.py',
+        'python/correction/dedup.py',
+    ]
+
+    inputs = {
+        'prep': {
+            'files': [path_dict['datasets']],
+            'configs': {'year': args.year, 'redirector': path_dict['redirector']},
+            'code': ['python/tools/das_query.py'],
+            'outputs': [
+                path_dict['nanoAODs_full'],
+                get_nevents_path(path_dict['nanoAODs_full'])
+            ],
+        },
+        'snapshot': {
+            'files': [
+                path_dict['nanoAODs'], path_dict['golden_json'],
+                path_dict['pu_json']
+            ],
+            'configs': {**options, 'snapshot': snapshot_config},
+            'code': [
+                'python/correction/snapshot_maker.py',
+                'python/tools/filters.py'
+            ] + production_code,
+            'outputs': snap,
+        },
+        'stream': {
+            'files': [
+                path_dict['nanoAODs'], path_dict['golden_json'],
+                path_dict['pu_json']
+            ],
+            'configs': {
+                **options, 'hbins': hbins, 'side_snapshots': args.snapshot,
+                'estimator': args.estimator, 'snapshot': snapshot_config
+            },
+            'code': [
+                'python/correction/streaming.py',
+                'python/correction/snapshot_maker.py',
+                'python/correction/histograms.py',
+                'python/correction/sketches.py',
+                'python/correction/cpp/QuantileSketch.h',
+                'python/tools/filters.py'
+            ] + production_code,
+            'outputs': hists + (snap if args.snapshot else []),
+        },
+        'dedup': {
+            'listings': snap,
+            'configs': {**options, 'snapshot': snapshot_config},
+            'code': ['python/correction/dedup.py'] + snapshot_code,
+            'outputs': [
+                f"{path_dict['snap_dir']}DATA/index/dedup_report.json"
+            ],
+        },
+        'compact': {
+            'listings': snap,
+            'configs': {
+                **options, 'compact_size': args.compact_size,
+                'snapshot': snapshot_config
+            },
+            'code': ['python/correction/compaction.py'] + snapshot_code,
+            'outputs': manifests,
+        },
+        'augment': {
+            'files': [path_dict['nanoAODs']] + manifests,
+            'listings': snap,
+            'configs': {**options, 'snapshot': snapshot_config},
+            'code': [
+                'python/correction/augment.py',
+                'python/correction/snapshot_maker.py',
+                'python/tools/resolver.py'
+            ] + snapshot_code,
+            'outputs': friends,
+        },
+        'export': {
+            'files': manifests,
+            'listings': snap,
+            'configs': {**options, 'format': args.export_snapshots},
+            'code': ['python/tools/arrow_io.py'] + snapshot_code,
+            'outputs': arrow,
+        },
+        'hists': {
+            'files': manifests,
+            'listings': snap + friends
+                + (arrow if args.hist_engine == 'numpy' else []),
+            'configs': {
+                **options, 'hbins': hbins, 'engine': args.hist_engine,
+                'estimator': args.estimator
+            },
+            'code': [
+                'python/correction/histograms.py',
+                'python/correction/numpy_hists.py',
+                'python/correction/boost_hists.py',
+                'python/correction/mapreduce.py',
+                'python/correction/sketches.py',
+                'python/correction/cpp/QuantileSketch.h'
+            ] + snapshot_code,
+            'outputs': hists,
+        },
+        'corr': {
+            'files': hists,
+            'configs': {
+                **options, 'hbins': hbins, 'labels': get_labels(args.year),
+                'estimator': args.estimator
+            },
+            'code': [
+                'python/correction/correction_extractor.py',
+                'python/correction/sketches.py',
+                'python/tools/plot.py'
+            ],
+            'outputs': corrs,
+        },
+        'closure': {
+            'files': hists + corrs,
+            'configs': {**options, 'nsigma': args.closure_sigma},
+            'code': ['python/correction/closure.py'],
+            'outputs': [f"{path_dict['corr_dir']}closure_report.json"],
+        },
+        'convert': {
+            'files': corrs,
+            'configs': options,
+            'code': [
+                'python/correction/convert2json.py',
+                'python/correction/evaluator.py'
+            ],
+            'outputs': [schema],
+        },
+        'validate': {
+            'files': [schema] + manifests,
+            'listings': snap + friends,
+            'configs': {
+                **options, 'hbins': hbins, 'labels': get_labels(args.year)
+            },
+            'code': [
+                'python/correction/validate.py',
+                'python/correction/mapreduce.py',
+                'python/correction/xy_functor.py',
+                'python/correction/cpp/XYCorrection.h',
+                'python/correction/evaluator.py',
+                'python/tools/plot.py'
+            ] + snapshot_code,
+            'outputs': [
+                f"{path_dict['hist_dir']}validation_{dtmc}.root"
+                for dtmc in datamc
+            ],
+        },
+    }
+
+    return inputs[stage]
+
+
+def check_stage(stage, inputs, stamp_dir, force):
+    """
+    Check whether a step needs to be run.
+
+    Returns:
+        str: fingerprint of the inputs if the step needs to run, None if
+            its outputs are up to date.
+    """
+    logger = logging.getLogger(__name__)
+
+    fprint = fingerprint(
+        inputs.get('files', []),
+        inputs.get('listings', []),
+        inputs.get('configs'),
+        inputs.get('code', [])
+    )
+
+    if not force and is_up_to_date(
+        f'{stamp_dir}{stage}.json', fprint, inputs['outputs']
+    ):
+        logger.info(
+            f"Skipping step {stage}, outputs are up to date. "
+            "Use --force to rerun."
+        )
+        return None
+
+    return fprint
+
+
+def run_mapreduce(
+    stage, process, threads_kw, stage_args, args, path_dict, res, datamc
+):
+    """
+    Run a step as map jobs over slices of the snapshots and a tree of
+    merge jobs, either as a condor DAG (-j 0) or with the local executor.
+    Condor jobs run a single map (--condor) or merge job (--merge_job).
+
+    Args:
+        stage (str): 'hists' or 'validate'.
+        process (functools.partial): function filling the outputs of a
+            slice, see mapreduce.run_map.
+        threads_kw (str): keyword of the number of threads of process.
+        stage_args (str): options of the condor jobs selecting the step.
+
+    Returns:
+        bool: whether the merged outputs have been produced.
+    """
+    mapreduce = timed_import('python.correction.mapreduce')
+    hist_dir = path_dict['hist_dir']
+
+    if args.merge_job >= 0:
+        plan = mapreduce.read_plan(hist_dir, stage)
+        mapreduce.run_merge(plan['merges'][args.merge_job])
+        return False
+
+    if args.condor >= 0:
+        plan = mapreduce.read_plan(hist_dir, stage)
+        process = partial(process, **{threads_kw: res[stage]['threads']})
+        mapreduce.run_map(plan, args.condor, hist_dir, process)
+        return False
+
+    plan = mapreduce.make_plan(
+        stage, path_dict['snap_dir'], hist_dir, datamc,
+        args.mapreduce, args.fanin
+    )
+
+    if args.jobs == 0:
+        condor = timed_import('python.tools.condor_configurizer')
+        condor.setup_dag(
+            path_dict['condor_dir'], stage, plan, stage_args, args.year,
+            datamc, path_dict['proxy_path'], max(args.threads, 1),
+            f"--version {args.version} --met {args.met} "
+            f"--pileup {args.pileup} --heartbeat {args.heartbeat} "
+            f"--preview {args.preview}"
+        )
+        return False
+
+    # one thread per map job, the jobs run in parallel
+    mapreduce.run_local(
+        plan, hist_dir, partial(process, **{threads_kw: 1}), args.jobs
+    )
+
+    return True
 
 
 def main():
@@ -38,99 +319,362 @@ def main():
     setup_logger('main.log', args.debug)
     logger = logging.getLogger(__name__)
 
+    # processes and threads per step
+    res = get_resources(args.jobs, args.threads, args.condor)
+
+    # profiling of the steps, condor jobs only write partial reports
+    condor_job = (args.condor >= 0 or args.merge_job >= 0)
+    setup_profiling(path_dict['report_dir'])
+
+    # local execution or distributed RDataFrame
+    if not condor_job:
+        setup_backend(
+            args.backend, args.scheduler, args.jobs, args.npartitions
+        )
+
+    # follow a running production from the heartbeats of its workers
+    if args.monitor:
+        with open(path_dict['nanoAODs'], 'r') as f:
+            nanoAODs = json.load(f)
+        monitor(
+            path_dict['telemetry_dir'],
+            sum(len(nanoAODs[dtmc]) for dtmc in datamc),
+            args.heartbeat
+        )
+        return
+
+    # heartbeats of the workers and condor jobs, a new production starts
+    # with an empty sink
+    production = (args.snapshot or args.stream) and args.condor < 0
+    setup_telemetry(
+        path_dict['telemetry_dir'], args.heartbeat, clear=production
+    )
+
+    # redirectors of the input files
+    setup_resolver(
+        path_dict['redirectors'], args.open_budget, path_dict['latency_file']
+    )
+
+    # recycling of long-lived snapshot and streaming workers
+    setup_workers(args.max_tasks, args.max_rss)
+
     logger.info(
         "Main script started for "
         f"{args.year}, {args.met}, and {args.processes}."
     )
 
+    # steps are skipped if their inputs did not change since the last run
+    fprints = {}
+
+    def needs_run(stage):
+        if condor_job:
+            return True
+        fprints[stage] = check_stage(
+            stage,
+            get_stage_inputs(
+                stage, args, path_dict, hbins, mets, pileups, datamc
+            ),
+            path_dict['stamp_dir'],
+            args.force
+        )
+        return fprints[stage] is not None
+
+    def save_stamp(stage):
+        write_stamp(
+            f"{path_dict['stamp_dir']}{stage}.json",
+            fprints[stage],
+            get_stage_inputs(
+                stage, args, path_dict, hbins, mets, pileups, datamc
+            )['outputs']
+        )
+
     # Preparation: getting files from DAS
-    if args.prep:
-        get_files_from_das(
-            path_dict['datasets'],
-            path_dict['nanoAODs'],
-            path_dict['redirector'],
-            args.year
+    if args.prep and needs_run('prep'):
+        with profile_stage('prep'):
+            das_query = timed_import('python.tools.das_query')
+            das_query.get_files_from_das(
+                path_dict['datasets'],
+                path_dict['nanoAODs_full'],
+                path_dict['redirector'],
+                args.year
+            )
+        save_stamp('prep')
+
+    # reproducible sample of the input files for a quick preview
+    if args.preview and not condor_job:
+        write_sample(
+            path_dict['nanoAODs_full'], path_dict['nanoAODs'], args.preview
         )
 
     # step 1: make flat ntuples with necessary information
-    if args.snapshot:
-        make_snapshot(
-            path_dict['nanoAODs'],
-            path_dict['golden_json'], 
-            path_dict['pu_json'],
-            mets, 
-            pileups,
-            path_dict['snap_dir'],
-            args.jobs,
-            args.condor, path_dict['condor_dir'],
-            datamc,
-            args.year,
-            path_dict['proxy_path']
-        )
+    if args.snapshot and not args.stream and needs_run('snapshot'):
+        with profile_stage('snapshot', partial=condor_job):
+            snapshot_maker = timed_import('python.correction.snapshot_maker')
+            snapshot_maker.make_snapshot(
+                path_dict['nanoAODs'],
+                path_dict['golden_json'], 
+                path_dict['pu_json'],
+                mets, 
+                pileups,
+                path_dict['snap_dir'],
+                res['snapshot']['workers'],
+                args.condor, path_dict['condor_dir'],
+                datamc,
+                args.year,
+                path_dict['proxy_path'],
+                res['snapshot']['threads'],
+                get_tune_file(path_dict['tune_dir'], 'snapshot')
+                if args.autotune else None,
+                f"--version {args.version} --heartbeat {args.heartbeat} "
+                f"--preview {args.preview}"
+            )
+
+        # condor jobs only produce single files, stamp only local runs
+        local = res['snapshot']['workers'] > 0 or args.backend != 'local'
+        if local and not condor_job:
+            save_stamp('snapshot')
+
+    # remove DATA events contained in several datasets
+    if args.dedup and 'DATA' in datamc and needs_run('dedup'):
+        with profile_stage('dedup'):
+            dedup = timed_import('python.correction.dedup')
+            dedup.deduplicate(
+                path_dict['snap_dir'],
+                res['compact']['workers']
+            )
+        save_stamp('dedup')
+
+    # merge the small snapshots into few large files
+    if args.compact and needs_run('compact'):
+        with profile_stage('compact'):
+            compaction = timed_import('python.correction.compaction')
+            compaction.compact_snapshots(
+                path_dict['snap_dir'],
+                datamc,
+                res['compact']['workers'],
+                args.compact_size
+            )
+        save_stamp('compact')
+
+    # new met types from the selected NanoAOD entries, as friend trees
+    if args.augment and needs_run('augment'):
+        with profile_stage('augment'):
+            augment = timed_import('python.correction.augment')
+            augment.augment_snapshots(
+                path_dict['nanoAODs'],
+                path_dict['snap_dir'],
+                mets,
+                datamc,
+                res['compact']['workers']
+            )
+        save_stamp('augment')
+
+    # snapshots readable without ROOT
+    if args.export_snapshots and needs_run('export'):
+        with profile_stage('export'):
+            arrow_io = timed_import('python.tools.arrow_io')
+            arrow_io.export_snapshots(
+                path_dict['snap_dir'],
+                datamc,
+                args.export_snapshots,
+                res['compact']['workers']
+            )
+        save_stamp('export')
 
     # step 2: make 2d histograms met xy vs pileup
-    if args.hists:
-        # first check whether files are fine
-        if not args.skip_check:
-            check_snapshots(path_dict['snap_dir'], datamc)
-
-        # then produce histograms
-        make_hists(
-            path_dict['snap_dir'],
-            path_dict['hist_dir'],
-            hbins,
-            args.jobs,
-            mets,
-            pileups,
-            datamc
-        )
+    if args.hists and not args.stream and needs_run('hists'):
+        with profile_stage('hists', partial=condor_job):
+            if args.hist_engine != 'rdf' and args.estimator != 'mean':
+                raise ValueError(
+                    "Quantile sketches are only filled by the 'rdf' "
+                    "engine, please use --estimator mean."
+                )
+
+            if args.hist_engine == 'numpy':
+                # from the exported snapshots, without ROOT
+                numpy_hists = timed_import('python.correction.numpy_hists')
+                numpy_hists.make_hists_numpy(
+                    path_dict['snap_dir'],
+                    path_dict['hist_dir'],
+                    hbins,
+                    mets,
+                    pileups,
+                    datamc
+                )
+
+            else:
+                if args.hist_engine == 'boost':
+                    # from the ROOT snapshots with uproot, without ROOT
+                    boost_hists = timed_import('python.correction.boost_hists')
+                    fill = boost_hists.make_hists_boost
+                else:
+                    histograms = timed_import('python.correction.histograms')
+
+                    # first check whether files are fine
+                    if not args.skip_check and not condor_job:
+                        histograms.check_snapshots(
+                            path_dict['snap_dir'], datamc
+                        )
+                    fill = partial(
+                        histograms.make_hists, estimator=args.estimator
+                    )
+
+                # then produce histograms
+                if args.mapreduce:
+                    done = run_mapreduce(
+                        'hists',
+                        partial(
+                            fill, path_dict['snap_dir'],
+                            hbins=hbins, mets=mets, pileups=pileups
+                        ),
+                        'jobs',
+                        f"-H --mapreduce {args.mapreduce} --skip_check "
+                        f"--estimator {args.estimator} "
+                        f"--hist_engine {args.hist_engine}",
+                        args, path_dict, res, datamc
+                    )
+                else:
+                    fill(
+                        path_dict['snap_dir'],
+                        path_dict['hist_dir'],
+                        hbins,
+                        res['hists']['threads'],
+                        mets,
+                        pileups,
+                        datamc
+                    )
+                    done = True
+
+        if not condor_job and (args.hist_engine == 'numpy' or done):
+            save_stamp('hists')
+
+    # steps 1 and 2 in one go: 2d histograms directly from NanoAOD
+    if args.stream and needs_run('stream'):
+        with profile_stage('stream'):
+            streaming = timed_import('python.correction.streaming')
+            streaming.make_hists_streaming(
+                path_dict['nanoAODs'],
+                path_dict['golden_json'],
+                path_dict['pu_json'],
+                mets,
+                pileups,
+                hbins,
+                path_dict['hist_dir'],
+                res['snapshot']['workers'],
+                res['snapshot']['threads'],
+                datamc,
+                path_dict['snap_dir'] if args.snapshot else None,
+                args.estimator
+            )
+        save_stamp('stream')
 
     # step 3: fit linear functions to 2d histograms
-    if args.corr:
-        get_corrections(
-            path_dict['hist_dir'],
-            hbins,
-            path_dict['corr_dir'],
-            path_dict['plot_dir'],
-            mets,
-            pileups,
-            lumilabels,
-            axislabels,
-            datamc
-        )
+    if args.corr and needs_run('corr'):
+        with profile_stage('corr'):
+            extractor = timed_import('python.correction.correction_extractor')
+            extractor.get_corrections(
+                path_dict['hist_dir'],
+                hbins,
+                path_dict['corr_dir'],
+                path_dict['plot_dir'],
+                mets,
+                pileups,
+                lumilabels,
+                axislabels,
+                datamc,
+                args.estimator
+            )
+
+            # expected precision of a full run
+            if args.preview:
+                report_precision(
+                    path_dict['corr_dir'], datamc,
+                    path_dict['nanoAODs_full'], path_dict['nanoAODs']
+                )
+        save_stamp('corr')
+
+    # closure from the histograms and fit results, without the snapshots
+    closure_passed = True
+    if args.closure and needs_run('closure'):
+        with profile_stage('closure'):
+            closure = timed_import('python.correction.closure')
+            closure_passed = closure.check_closure(
+                path_dict['hist_dir'],
+                path_dict['corr_dir'],
+                datamc,
+                args.closure_sigma
+            )
+        if closure_passed:
+            save_stamp('closure')
 
     # make correction lib schema v2
-    if args.convert:
-        make_correction_with_formula(
-            path_dict['corr_dir'],
-            args.year,
-            datamc,
-            mets
-        )
+    if args.convert and needs_run('convert'):
+        with profile_stage('convert'):
+            convert2json = timed_import('python.correction.convert2json')
+            convert2json.make_correction_with_formula(
+                path_dict['corr_dir'],
+                args.year,
+                datamc,
+                mets
+            )
+        save_stamp('convert')
 
     # closure
-    if args.validate:
-        validate_json(
-            path_dict['snap_dir'],
-            path_dict['corr_dir'],
-            path_dict['hist_dir'],
-            datamc,
-            args.year,
-            hbins,
-            mets
-        )
-        make_validation_plots(
-            path_dict['hist_dir'],
-            path_dict['plot_dir'],
-            path_dict['corr_dir'],
-            hbins,
-            axislabels,
-            lumilabels,
-            dsetlabel,
-            datamc,
-            args.year,
-            mets
-        )
+    if args.validate and (args.plots_only or needs_run('validate')):
+        with profile_stage('validate', partial=condor_job):
+            validate = timed_import('python.correction.validate')
+
+            if args.plots_only:
+                done = False
+            elif args.mapreduce:
+                done = run_mapreduce(
+                    'validate',
+                    partial(
+                        validate.validate_json, path_dict['snap_dir'],
+                        path_dict['corr_dir'], year=args.year,
+                        bin_dict=hbins, mets=mets
+                    ),
+                    'nthreads',
+                    f"--validate --mapreduce {args.mapreduce}",
+                    args, path_dict, res, datamc
+                )
+            else:
+                validate.validate_json(
+                    path_dict['snap_dir'],
+                    path_dict['corr_dir'],
+                    path_dict['hist_dir'],
+                    datamc,
+                    args.year,
+                    hbins,
+                    mets,
+                    res['validate']['threads']
+                )
+                done = True
+
+            if done or args.plots_only:
+                validate.make_validation_plots(
+                    path_dict['hist_dir'],
+                    path_dict['plot_dir'],
+                    path_dict['corr_dir'],
+                    hbins,
+                    axislabels,
+                    lumilabels,
+                    dsetlabel,
+                    datamc,
+                    args.year,
+                    mets
+                )
+
+        if done and not condor_job:
+            save_stamp('validate')
+
+    # summary of the profiles of all steps, incl. workers and condor jobs
+    if not condor_job:
+        write_report()
+
+    if not closure_passed:
+        sys.exit(1)
+
 
 if __name__=='__main__':
     main()
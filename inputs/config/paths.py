@@ -1,24 +1,45 @@
 import os
 import sys
 
+from inputs.config.snapshot import get_snapshot_config
+
 def get_paths(args):
 
-    add_path = f'{args.version}/{args.year}'
+    # previews on a sample of the inputs are kept apart from full runs
+    version = args.version
+    if getattr(args, 'preview', 0):
+        version += f'_preview{args.preview:g}'
+    add_path = f'{version}/{args.year}'
 
     home_path = os.path.expanduser("~")
     eos_path = home_path.replace('afs/cern.ch', 'eos')
     uid = os.getuid()
+    snap_base = get_snapshot_config()['destination']\
+        or f"{eos_path}/CMS_xycorr"
 
     paths = {
         'datasets':f'inputs/config/datasets.json',
         'redirector': 'root://cms-xrd-global.cern.ch//',
+        # tried in this order until their latencies are known, may also
+        # contain local replica directories
+        'redirectors': [
+            'root://cms-xrd-global.cern.ch//',
+            'root://xrootd-cms.infn.it//',
+            'root://cmsxrootd.fnal.gov//',
+        ],
+        'latency_file': "results/autotune/site_latency.json",
         'nanoAODs': f'inputs/nanoAODs/{args.year}.json',
+        'nanoAODs_full': f'inputs/nanoAODs/{args.year}.json',
         'plot_dir': f"results/plots/{add_path}/",
         'corr_dir': f"results/corrections/{add_path}/",
         'hist_dir': f"results/hists/{add_path}/",
         'condor_dir': f"results/condor/{add_path}/",
+        'tune_dir': "results/autotune/",
+        'report_dir': f"results/reports/{add_path}/",
+        'stamp_dir': f"results/stamps/{add_path}/",
+        'telemetry_dir': f"results/telemetry/{add_path}/",
         'pu_json': f'inputs/jsonpog/POG/LUM/{args.year}/puWeights.json.gz',
-        'snap_dir': f"{eos_path}/CMS_xycorr/snapshots/{add_path}/",
+        'snap_dir': f"{snap_base}/snapshots/{add_path}/",
         'proxy_path': f'{home_path}/proxy/x509up_u{uid}'
     }
 
@@ -52,6 +73,10 @@ def get_paths(args):
 
     paths['golden_json'] = golden_jsons[args.year]
 
+    if getattr(args, 'preview', 0):
+        paths['nanoAODs'] = \
+            f'inputs/nanoAODs/{args.year}_preview{args.preview:g}.json'
+
     os.makedirs(paths['nanoAODs'].replace(paths['nanoAODs'].split('/')[-1], ''), exist_ok=True)
 
     return paths
@@ -0,0 +1,19 @@
+# format and staging of the snapshots
+def get_snapshot_config():
+
+    snapshot = {
+        # 'TTree' or 'RNTuple' (needs ROOT >= 6.34)
+        'format': 'TTree',
+        # write snapshots to node-local scratch first and move them to the
+        # snapshot directory once they are verified
+        'staging': True,
+        # scratch directory, default is the condor scratch, $TMPDIR or /tmp
+        'scratch_dir': None,
+        # snapshot directory, default is the EOS userspace (see paths.py)
+        'destination': None,
+        # size of the clusters of the compacted TTree snapshots in MB, each
+        # is read in one go by the following steps
+        'cluster_mb': 64,
+    }
+
+    return snapshot
@@ -0,0 +1,113 @@
+import time
+import logging
+import numpy as np
+from argparse import ArgumentParser
+
+from python.correction.evaluator import (
+    load_xy_corrections, apply_xy_correction, check_against_correctionlib
+)
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def random_events(nevents, seed=1):
+    rng = np.random.default_rng(seed)
+    met_pt = rng.exponential(30, nevents)
+    met_phi = rng.uniform(-np.pi, np.pi, nevents)
+    npv = rng.integers(0, 100, nevents).astype(np.float64)
+
+    return met_pt, met_phi, npv
+
+
+def bench_evaluator(path, met, dtmc, nevents, repeat=3):
+    '''
+    Throughput of the batch evaluator and of correctionlib for all
+    variations of one met type.
+
+    Args:
+    path (str): path to schemaV2_{year}.json.
+    met (str): met type.
+    dtmc (str): 'DATA' or 'MC'.
+    nevents (int): number of events per batch.
+    repeat (int): number of repetitions, the fastest one is used.
+
+    Returns:
+    dict: events per second for the different evaluation methods.
+    '''
+    import correctionlib
+
+    met_pt, met_phi, npv = random_events(nevents)
+
+    # loading is done once and not part of the timing
+    cset = load_xy_corrections(path)
+    ceval = correctionlib.CorrectionSet.from_file(path)['met_xy_corrections']
+    keys = list(apply_xy_correction(
+        cset, met_pt[:1], met_phi[:1], npv[:1], met, dtmc
+    ))
+
+    def best_of(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    rates = {}
+
+    wall = best_of(
+        lambda: apply_xy_correction(cset, met_pt, met_phi, npv, met, dtmc)
+    )
+    rates['batch evaluator'] = nevents / wall
+
+    wall = best_of(
+        lambda: [
+            ceval.evaluate(k, met, dtmc, met_pt, met_phi, npv) for k in keys
+        ]
+    )
+    rates['correctionlib vectorised'] = nevents / wall
+
+    # event by event evaluation is slow, only use a subset
+    nloop = min(nevents, 10000)
+    wall = best_of(
+        lambda: [
+            ceval.evaluate(k, met, dtmc, met_pt[i], met_phi[i], npv[i])
+            for i in range(nloop) for k in keys
+        ]
+    )
+    rates['correctionlib per event'] = nloop / wall
+
+    return rates
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark of the batch evaluator of the xy corrections."
+    )
+    parser.add_argument("json", help="Path to schemaV2_{year}.json")
+    parser.add_argument("--met", default='PuppiMET')
+    parser.add_argument("--dtmc", default='MC')
+    parser.add_argument(
+        "--nevents",
+        help="Comma-separated list of batch sizes",
+        default='1000,100000,1000000'
+    )
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    check_against_correctionlib(args.json)
+
+    for nevents in [int(n) for n in args.nevents.split(',')]:
+        rates = bench_evaluator(args.json, args.met, args.dtmc, nevents)
+        for method, rate in rates.items():
+            logger.info(
+                f"{nevents:>9} events, {method:>25}: {rate:.3e} events/s"
+            )
+
+    return
+
+
+if __name__ == '__main__':
+    main()
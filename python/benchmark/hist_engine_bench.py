@@ -0,0 +1,110 @@
+import os
+import time
+import logging
+import importlib
+from argparse import ArgumentParser
+
+import numpy as np
+
+from inputs.config.binning import get_bins
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def compare_hists(path, reference, rtol=1e-9):
+    '''
+    Compare all histograms of two files bin by bin, including under- and
+    overflow, with uproot.
+
+    Returns:
+    list: descriptions of the differences.
+    '''
+    import uproot
+
+    diffs = []
+    with uproot.open(path) as f, uproot.open(reference) as ref:
+        names = {k.split(';')[0] for k in ref.keys()}
+        missing = names - {k.split(';')[0] for k in f.keys()}
+        if missing:
+            diffs.append(f"Missing histograms {sorted(missing)} in {path}.")
+
+        for name in sorted(names - missing):
+            h, r = f[name], ref[name]
+            for what, a, b in [
+                ('contents', h.values(flow=True), r.values(flow=True)),
+                ('sumw2', h.variances(flow=True), r.variances(flow=True)),
+                ('entries', h.member('fEntries'), r.member('fEntries')),
+            ]:
+                if not np.allclose(a, b, rtol=rtol, atol=rtol):
+                    diffs.append(
+                        f"{name}: {what} differ, largest deviation "
+                        f"{np.max(np.abs(np.asarray(a) - b)):.3e}."
+                    )
+
+    return diffs
+
+
+def main():
+    parser = ArgumentParser(
+        description="Equivalence and throughput of the boost-histogram "
+        "engine compared with RDataFrame on existing snapshots."
+    )
+    parser.add_argument("snap_dir", help="Directory of the snapshots")
+    parser.add_argument("--out_dir", default='results/benchmarks/hist_engine/')
+    parser.add_argument("--dtmc", default='MC')
+    parser.add_argument("--met", default='PuppiMET,MET')
+    parser.add_argument("--pileup", default='PV_npvsGood')
+    parser.add_argument("-j", "--jobs", default=4, type=int)
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    snap_dir = os.path.join(args.snap_dir, '')
+    hbins = get_bins()
+    mets = args.met.split(',')
+    pileups = args.pileup.split(',')
+
+    import uproot
+    from python.tools.snapshot_io import get_snapshot_files
+
+    nevents = sum(
+        uproot.open(f)['Events'].num_entries
+        for f in get_snapshot_files(snap_dir, args.dtmc)
+    )
+
+    # boost first, the rdf engine loads ROOT and starts implicit MT
+    engines = {
+        'boost': ('python.correction.boost_hists', 'make_hists_boost'),
+        'rdf': ('python.correction.histograms', 'make_hists'),
+    }
+
+    for engine, (module, func) in engines.items():
+        fill = getattr(importlib.import_module(module), func)
+        hist_dir = f'{args.out_dir}{engine}/'
+        os.makedirs(hist_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        fill(
+            snap_dir, hist_dir, hbins, args.jobs, mets, pileups, [args.dtmc]
+        )
+        wall = time.perf_counter() - start
+        logger.info(
+            f"{engine:>6}: {wall:.2f} s for {nevents} events with "
+            f"{args.jobs} threads, {nevents / wall:.3e} events/s"
+        )
+
+    diffs = compare_hists(
+        f'{args.out_dir}boost/{args.dtmc}.root',
+        f'{args.out_dir}rdf/{args.dtmc}.root'
+    )
+    for d in diffs:
+        logger.warning(d)
+    if not diffs:
+        logger.info("The histograms of both engines are identical.")
+
+    return
+
+
+if __name__ == '__main__':
+    main()
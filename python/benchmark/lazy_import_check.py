@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import subprocess
+from argparse import ArgumentParser
+
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+repo_dir = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+def write_fixture(corr_dir, mets, datamc):
+    '''
+    Fit results of the correction step with fixed parameters, as input of
+    the conversion step.
+    '''
+    os.makedirs(corr_dir, exist_ok=True)
+
+    params = {
+        'm': 0.1, 'm_stat': 0.01, 'c': -0.5, 'c_stat': 0.05,
+        'correlation': -0.8
+    }
+    for dtmc in datamc:
+        variations = ['nom'] if dtmc == 'DATA' else ['nom', 'pu_dn', 'pu_up']
+        corrs = {
+            met: {'PV_npvsGood': {
+                xy: {var: params for var in variations} for xy in ['_x', '_y']
+            }}
+            for met in mets
+        }
+        with open(f'{corr_dir}{dtmc}.json', 'w') as f:
+            json.dump(corrs, f, indent=4)
+
+    return
+
+
+def check_convert(year='2022_Summer22', version='lazy_import_check',
+                  mets=('PuppiMET', 'MET')):
+    '''
+    Run the conversion step of the main script in a fresh process on fixed
+    fit results, incl. the comparison of the evaluator with correctionlib,
+    and check that ROOT was not loaded when the process exits.
+
+    Returns:
+    list: descriptions of the failures.
+    '''
+    datamc = ['DATA', 'MC']
+    corr_dir = f'results/corrections/{version}/{year}/'
+    write_fixture(os.path.join(repo_dir, corr_dir), mets, datamc)
+
+    argv = [
+        'get_xy_corrs.py', '-Y', year, '-V', version, '--convert', '--force',
+        '--met', ','.join(mets), '--processes', ','.join(datamc)
+    ]
+    code = (
+        "import sys, runpy; "
+        f"sys.argv = {argv!r}; "
+        "runpy.run_path('get_xy_corrs.py', run_name='__main__'); "
+        "print('ROOT loaded:', 'ROOT' in sys.modules)"
+    )
+    # the main script asks to continue without grid proxy
+    proc = subprocess.run(
+        [sys.executable, '-c', code], cwd=repo_dir, input='y\n',
+        capture_output=True, text=True
+    )
+
+    failures = []
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines \
+            or not lines[-1].startswith('ROOT loaded:'):
+        failures.append(
+            f"The conversion step failed:\n{proc.stderr.strip()}"
+        )
+    elif lines[-1] != 'ROOT loaded: False':
+        failures.append("The conversion step loads ROOT.")
+
+    for d in ['corrections', 'reports', 'stamps', 'telemetry', 'plots',
+              'hists', 'condor']:
+        shutil.rmtree(
+            os.path.join(repo_dir, f'results/{d}/{version}/'),
+            ignore_errors=True
+        )
+
+    return failures
+
+
+def main():
+    parser = ArgumentParser(
+        description="Check that the conversion step of the main script "
+        "runs without loading ROOT."
+    )
+    parser.add_argument("-Y", "--year", default='2022_Summer22')
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    failures = check_convert(args.year)
+    for f in failures:
+        logger.warning(f)
+    if failures:
+        sys.exit(1)
+
+    logger.info("The conversion step runs without ROOT.")
+
+    return
+
+
+if __name__ == '__main__':
+    main()
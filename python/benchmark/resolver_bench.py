@@ -0,0 +1,96 @@
+import os
+import time
+import shutil
+import logging
+from argparse import ArgumentParser
+
+import python.tools.resolver as resolver
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def delayed_opener(delays):
+    '''
+    Stand-in for remote opens: opens via a prefix take the given delay and
+    succeed if the file exists below the prefix. Prefixes with a negative
+    delay never answer.
+
+    Args:
+    delays (dict): delay in seconds per prefix.
+
+    Returns:
+    tuple: start, poll and cancel functions for resolver.resolve.
+    '''
+    def start(url):
+        prefix = next(p for p in delays if url.startswith(p))
+        return url, delays[prefix], time.monotonic()
+
+    def poll(handle):
+        url, delay, t0 = handle
+        if delay < 0 or time.monotonic() - t0 < delay:
+            return None
+        return os.path.exists(url)
+
+    def cancel(handle):
+        return
+
+    return start, poll, cancel
+
+
+def main():
+    parser = ArgumentParser(
+        description="Check hedged opens and failover of the input resolver "
+        "with local replica directories and artificial delays."
+    )
+    parser.add_argument("--out_dir", default='results/benchmarks/resolver/')
+    parser.add_argument("--budget", default=0.2, type=float)
+    parser.add_argument("--nfiles", default=20, type=int)
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    # three replicas: one hanging, one slow, one fast but missing half of
+    # the files
+    prefixes = [f'{args.out_dir}site_{i}/' for i in range(3)]
+    delays = dict(zip(prefixes, [-1, 0.5, 0.05]))
+    shutil.rmtree(args.out_dir, ignore_errors=True)
+
+    lfns = [f'/store/file_{i}.root' for i in range(args.nfiles)]
+    for i, lfn in enumerate(lfns):
+        for j, p in enumerate(prefixes):
+            if j == 2 and i % 2:
+                continue
+            os.makedirs(os.path.dirname(p + lfn[1:]), exist_ok=True)
+            open(p + lfn[1:], 'w').close()
+
+    resolver.setup_resolver(
+        prefixes, args.budget, timeout=2., retries=2, backoff=0.1
+    )
+    start, poll, cancel = delayed_opener(delays)
+
+    t0 = time.monotonic()
+    sources = {}
+    for lfn in lfns:
+        url = resolver.resolve(
+            prefixes[0] + lfn[1:], start, poll, cancel
+        )
+        source = next(p for p in prefixes if url.startswith(p))
+        sources[source] = sources.get(source, 0) + 1
+    elapsed = time.monotonic() - t0
+
+    logger.info(
+        f"Resolved {len(lfns)} files in {elapsed:.2f} s "
+        f"({elapsed / len(lfns):.2f} s per file)."
+    )
+    for p in prefixes:
+        logger.info(
+            f"{p}: {sources.get(p, 0)} files, smoothed latency "
+            f"{resolver._latency.get(p, float('nan')):.2f} s"
+        )
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import logging
+import subprocess
+from argparse import ArgumentParser
+
+from python.tools.logger_setup import setup_logger
+from python.benchmark.lazy_import_check import check_convert
+
+logger = logging.getLogger(__name__)
+
+stages = [
+    'snapshot', 'filter_lumi', 'filter_zmm', 'make_hists', 'fits', 'convert',
+    'validate_json'
+]
+
+
+def run_stages(work_dir, data, nthreads, backend='local'):
+    '''
+    Run and time all steps of the correction on a synthetic dataset.
+    Implicit MT can only be set once per process, so this is run in a
+    separate process per thread count.
+
+    Args:
+    work_dir (str): working directory for outputs.
+    data (dict): paths of the synthetic dataset (see synthetic.make_dataset).
+    nthreads (int): number of processes (snapshot) and threads (others),
+        or number of workers of the local dask cluster.
+    backend (str): 'local' or 'dask' (see python.tools.backends).
+
+    Returns:
+    dict: per step wall time, number of input events and events per second.
+    '''
+    import ROOT
+    import python.tools.filters as filters
+    import python.tools.resources as resources
+    import python.tools.backends as backends
+    from python.correction.snapshot_maker import make_snapshot
+    from python.correction.histograms import make_hists
+    from python.correction.correction_extractor import get_corrections
+    from python.correction.convert2json import make_correction_with_formula
+    from python.correction.validate import validate_json
+    from python.benchmark.synthetic import mets
+    from inputs.config.binning import get_bins
+    from inputs.config.labels import get_labels
+
+    ROOT.gROOT.SetBatch(1)
+    backends.setup_backend(backend, nworkers=nthreads)
+
+    year = 'synthetic'
+    datamc = ['DATA', 'MC']
+    pileups = ['PV_npvsGood']
+    hbins = get_bins()
+    lumilabels, axislabels, _ = get_labels('2022_Summer22')
+
+    dirs = {}
+    for d in ['snap', 'hist', 'corr', 'plot', 'condor']:
+        dirs[d] = f'{work_dir}/{d}/{year}/'
+        os.makedirs(dirs[d], exist_ok=True)
+
+    with open(data['nanoAODs']) as f:
+        files = json.load(f)
+
+    def count(paths):
+        return ROOT.RDataFrame("Events", paths).Count().GetValue()
+
+    timings = {}
+
+    def timed(stage, func, nevents):
+        start = time.perf_counter()
+        result = func()
+        wall = time.perf_counter() - start
+        timings[stage] = {
+            'wall': wall,
+            'events': nevents,
+            'rate': nevents / wall if wall > 0 else 0.,
+        }
+        logger.info(f"{stage:>14}: {wall:7.2f} s, {nevents / wall:.3e} events/s")
+        return result
+
+    nano_events = count(files['DATA'] + files['MC'])
+
+    # multiprocessing first, before implicit MT is started in this process
+    timed('snapshot', lambda: make_snapshot(
+        data['nanoAODs'], data['golden_json'], data['pu_json'], mets,
+        list(pileups), dirs['snap'], nthreads, -1, dirs['condor'], datamc,
+        year, None
+    ), nano_events)
+
+    resources.enable_threads(nthreads)
+
+    timed('filter_lumi', lambda: filters.filter_lumi(
+        ROOT.RDataFrame("Events", files['DATA']), data['golden_json']
+    ).Count().GetValue(), count(files['DATA']))
+
+    timed('filter_zmm', lambda: filters.filter_zmm(
+        ROOT.RDataFrame("Events", files['DATA'] + files['MC'])
+    ).Count().GetValue(), nano_events)
+
+    snap_events = count(f"{dirs['snap']}*/file_*.root")
+
+    timed('make_hists', lambda: make_hists(
+        dirs['snap'], dirs['hist'], hbins, nthreads, mets, pileups, datamc
+    ), snap_events)
+
+    timed('fits', lambda: get_corrections(
+        dirs['hist'], hbins, dirs['corr'], dirs['plot'], mets, pileups,
+        lumilabels, axislabels, datamc
+    ), snap_events)
+
+    timed('convert', lambda: make_correction_with_formula(
+        dirs['corr'], year, datamc, mets
+    ), snap_events)
+
+    loops = timed('validate_json', lambda: validate_json(
+        dirs['snap'], dirs['corr'], dirs['hist'], datamc, year, hbins, mets,
+        nthreads
+    ), snap_events)
+    timings['validate_json']['event_loops'] = max(loops.values())
+
+    return timings
+
+
+def find_regressions(results, baseline, tolerance):
+    '''
+    Compare wall times with a baseline.
+
+    Args:
+    results (dict): {size: {threads: {stage: timing}}}.
+    baseline (dict): same structure for the baseline version.
+    tolerance (float): allowed relative slow down.
+
+    Returns:
+    list: descriptions of the regressions.
+    '''
+    regressions = []
+    for size in results:
+        for threads in results[size]:
+            for stage, timing in results[size][threads].items():
+
+                if timing.get('event_loops', 1) > 1:
+                    regressions.append(
+                        f"{stage} ({size} events, {threads} threads) needed "
+                        f"{timing['event_loops']} event loops instead of one."
+                    )
+
+                try:
+                    ref = baseline[size][threads][stage]['wall']
+                except KeyError:
+                    continue
+
+                if timing['wall'] > ref * (1 + tolerance):
+                    regressions.append(
+                        f"{stage} ({size} events, {threads} threads): "
+                        f"{timing['wall']:.2f} s vs {ref:.2f} s in baseline."
+                    )
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(
+        description="Offline benchmark of all correction steps on synthetic "
+        "NanoAOD files."
+    )
+    parser.add_argument(
+        "-V", "--version", default='v0',
+        help="Version string under which the results are stored"
+    )
+    parser.add_argument(
+        "--sizes", default='10000,100000',
+        help="Comma-separated list of events per file"
+    )
+    parser.add_argument(
+        "--threads", default='1,4',
+        help="Comma-separated list of thread counts"
+    )
+    parser.add_argument("--nfiles", default=4, type=int)
+    parser.add_argument(
+        "--baseline", default=None,
+        help="Version of the baseline to compare with"
+    )
+    parser.add_argument(
+        "--tolerance", default=0.25, type=float,
+        help="Allowed relative slow down with respect to the baseline"
+    )
+    parser.add_argument(
+        "--out_dir", default='results/benchmarks/',
+        help="Directory of benchmark results and synthetic data"
+    )
+    parser.add_argument(
+        "--backend", default='local', choices=['local', 'dask'],
+        help="Run the steps locally or on a local dask cluster"
+    )
+    parser.add_argument(
+        "--worker", default=None,
+        help="Internal: run a single configuration given as json"
+    )
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    if args.worker:
+        # single configuration in a fresh process
+        config = json.loads(args.worker)
+        timings = run_stages(
+            config['work_dir'], config['data'], config['threads'],
+            config['backend']
+        )
+        with open(config['output'], 'w') as f:
+            json.dump(timings, f, indent=4)
+        return
+
+    from python.benchmark.synthetic import make_dataset
+
+    out_dir = f'{args.out_dir}{args.version}/'
+    os.makedirs(out_dir, exist_ok=True)
+
+    results = {}
+    for size in args.sizes.split(','):
+        data_dir = f'{args.out_dir}data/{args.nfiles}x{size}/'
+        if os.path.exists(f'{data_dir}nanoAODs.json'):
+            data = {
+                'nanoAODs': f'{data_dir}nanoAODs.json',
+                'golden_json': f'{data_dir}golden.json',
+                'pu_json': f'{data_dir}puWeights.json',
+            }
+        else:
+            data = make_dataset(
+                data_dir, args.nfiles, int(size), [0.3, -1.0, -0.2, 0.5]
+            )
+
+        results[size] = {}
+        for threads in args.threads.split(','):
+            logger.info(f"Benchmark with {size} events per file and {threads} threads.")
+            config = {
+                'work_dir': f'{out_dir}work/{size}_{threads}',
+                'data': data,
+                'threads': int(threads),
+                'backend': args.backend,
+                'output': f'{out_dir}timing_{size}_{threads}.json',
+            }
+            subprocess.run(
+                [sys.executable, '-m', 'python.benchmark.run_benchmarks',
+                 '--worker', json.dumps(config)],
+                check=True
+            )
+            with open(config['output']) as f:
+                results[size][threads] = json.load(f)
+
+    with open(f'{out_dir}results.json', 'w') as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Benchmark results saved in {out_dir}results.json")
+
+    baseline = {}
+    if args.baseline:
+        with open(f'{args.out_dir}{args.baseline}/results.json') as f:
+            baseline = json.load(f)
+
+    regressions = find_regressions(results, baseline, args.tolerance)
+    regressions += check_convert()
+    for r in regressions:
+        logger.warning(f"Regression: {r}")
+    if regressions:
+        sys.exit(1)
+
+    logger.info("No regressions found.")
+
+    return
+
+
+if __name__ == '__main__':
+    main()
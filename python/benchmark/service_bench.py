@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import logging
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+from python.benchmark.evaluator_bench import random_events
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def start_service(path, socket_path, timeout=30.):
+    '''
+    Start the evaluation service in a separate process and wait until it
+    accepts connections.
+    '''
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    proc = subprocess.Popen([
+        sys.executable, '-m', 'python.correction.service', path,
+        '--socket', socket_path
+    ])
+
+    start = time.monotonic()
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.monotonic() - start > timeout:
+            proc.kill()
+            raise RuntimeError("The evaluation service did not start.")
+        time.sleep(0.05)
+
+    return proc
+
+
+def median_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def bench_service(path, socket_path, met, dtmc, nevents, repeat):
+    '''
+    Latency of one batch with all variations of one met type via the
+    service and with correctionlib in this process.
+
+    Returns:
+    dict: median seconds per batch for the evaluation methods.
+    '''
+    import correctionlib
+    import python.correction.service as service
+
+    met_pt, met_phi, npv = random_events(nevents)
+    ceval = correctionlib.CorrectionSet.from_file(path)['met_xy_corrections']
+    keys = list(service.apply_xy_correction(
+        path, met_pt[:1], met_phi[:1], npv[:1], met, dtmc,
+        socket_path=socket_path
+    ))
+
+    return {
+        'service': median_time(lambda: service.apply_xy_correction(
+            path, met_pt, met_phi, npv, met, dtmc, socket_path=socket_path
+        ), repeat),
+        'correctionlib': median_time(lambda: [
+            ceval.evaluate(k, met, dtmc, met_pt, met_phi, npv) for k in keys
+        ], repeat),
+    }
+
+
+def bench_startup(path, socket_path, met, dtmc):
+    '''
+    Cost of the first evaluation in a fresh process: loading the file with
+    correctionlib versus connecting to the service.
+
+    Returns:
+    dict: seconds until the first batch of one event is evaluated.
+    '''
+    code = {
+        'correctionlib': (
+            "import correctionlib, numpy as np; "
+            f"c = correctionlib.CorrectionSet.from_file('{path}')"
+            "['met_xy_corrections']; "
+            f"c.evaluate('pt', '{met}', '{dtmc}', np.ones(1), np.ones(1), "
+            "np.ones(1))"
+        ),
+        'service': (
+            "import numpy as np; "
+            "from python.correction.service import apply_xy_correction; "
+            f"apply_xy_correction('{path}', np.ones(1), np.ones(1), "
+            f"np.ones(1), '{met}', '{dtmc}', ['nom'], '{socket_path}')"
+        ),
+    }
+
+    startup = {}
+    for method, c in code.items():
+        # timed inside the process, without the interpreter startup
+        out = subprocess.run(
+            [sys.executable, '-c', "import time; t = time.perf_counter(); "
+             f"{c}; print(time.perf_counter() - t)"],
+            check=True, capture_output=True, text=True
+        ).stdout.split()[-1]
+        startup[method] = float(out)
+
+    return startup
+
+
+def main():
+    parser = ArgumentParser(
+        description="Latency and throughput of the evaluation service of "
+        "the xy corrections compared with correctionlib in process."
+    )
+    parser.add_argument("json", help="Path to schemaV2_{year}.json")
+    parser.add_argument("--met", default='PuppiMET')
+    parser.add_argument("--dtmc", default='MC')
+    parser.add_argument(
+        "--nevents",
+        help="Comma-separated list of batch sizes",
+        default='1,100,10000,1000000'
+    )
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument(
+        "--socket", default='/tmp/xycorr_bench.sock',
+        help="Socket of the service started for the benchmark"
+    )
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    path = os.path.abspath(args.json)
+    proc = start_service(path, args.socket)
+    try:
+        startup = bench_startup(path, args.socket, args.met, args.dtmc)
+        for method, wall in startup.items():
+            logger.info(f"First evaluation, {method:>13}: {wall * 1e3:8.1f} ms")
+
+        for nevents in [int(n) for n in args.nevents.split(',')]:
+            times = bench_service(
+                path, args.socket, args.met, args.dtmc, nevents, args.repeat
+            )
+            for method, wall in times.items():
+                logger.info(
+                    f"{nevents:>9} events, {method:>13}: "
+                    f"{wall * 1e3:8.3f} ms per batch, "
+                    f"{nevents / wall:.3e} events/s"
+                )
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+import ROOT
+from argparse import ArgumentParser
+
+from python.benchmark.synthetic import mets
+from python.correction.snapshot_maker import snapshot_columns
+from python.correction.histograms import book_hists
+from python.tools.snapshot_io import snapshot_options
+from python.tools.logger_setup import setup_logger
+from inputs.config.binning import get_bins
+import python.tools.resources as resources
+
+logger = logging.getLogger(__name__)
+
+ROOT.gROOT.SetBatch(1)
+
+
+def make_flat_snapshot(path, nevents, seed=1):
+    '''
+    Write a TTree with the columns and typical values of the snapshots.
+    '''
+    ROOT.gRandom.SetSeed(seed)
+
+    rdf = ROOT.RDataFrame(nevents)
+    rdf = rdf.Define("PV_npvsGood", "static_cast<int>(gRandom->Poisson(30))")
+    rdf = rdf.Define("puWeight", "static_cast<double>(gRandom->Gaus(1, 0.2))")
+    rdf = rdf.Define("puWeightUp", "puWeight * 1.05")
+    rdf = rdf.Define("puWeightDn", "puWeight * 0.95")
+    rdf = rdf.Define("mass_Z", "static_cast<float>(gRandom->BreitWigner(91.2, 2.5))")
+    rdf = rdf.Define("run", "1u")
+    rdf = rdf.Define("luminosityBlock", "static_cast<unsigned int>(rdfentry_ / 1000 + 1)")
+    rdf = rdf.Define("event", "static_cast<ULong64_t>(rdfentry_)")
+    rdf = rdf.Define("source_idx", "0")
+    rdf = rdf.Define("source_entry", "static_cast<Long64_t>(rdfentry_)")
+    for met in mets:
+        rdf = rdf.Define(
+            f"{met}_x", "static_cast<float>(gRandom->Gaus(0.3 * PV_npvsGood, 20))"
+        )
+        rdf = rdf.Define(
+            f"{met}_y", "static_cast<float>(gRandom->Gaus(-0.2 * PV_npvsGood, 20))"
+        )
+
+    rdf.Snapshot(
+        "Events", path, snapshot_columns(['PV_npvsGood'], mets),
+        snapshot_options(fmt='TTree')
+    )
+
+    return
+
+
+def bench_format(source, out_path, fmt, hbins):
+    '''
+    Time writing a snapshot in the given format and reading it back by
+    filling the histograms of the histogram step.
+
+    Returns:
+    dict: file size, write and read rates.
+    '''
+    rdf = ROOT.RDataFrame("Events", source)
+    nevents = rdf.Count().GetValue()
+
+    start = time.perf_counter()
+    rdf.Snapshot("Events", out_path, "", snapshot_options(fmt=fmt))
+    write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rdf = ROOT.RDataFrame("Events", out_path)
+    hists = book_hists(rdf, hbins, mets, ['PV_npvsGood'])
+    ROOT.RDF.RunGraphs(list(hists.values()))
+    read = time.perf_counter() - start
+
+    return {
+        'size_mb': os.path.getsize(out_path) / 1024**2,
+        'write_rate': nevents / write,
+        'read_rate': nevents / read,
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark of file size, write and read rate of "
+        "snapshots as TTree and RNTuple."
+    )
+    parser.add_argument("--out_dir", default='results/benchmarks/formats/')
+    parser.add_argument("--nevents", default=1000000, type=int)
+    parser.add_argument("-j", "--jobs", default=0, type=int)
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    source = f'{args.out_dir}source.root'
+    if not os.path.exists(source):
+        make_flat_snapshot(source, args.nevents)
+
+    resources.enable_threads(args.jobs)
+    hbins = get_bins()
+
+    for fmt in ['TTree', 'RNTuple']:
+        try:
+            result = bench_format(
+                source, f'{args.out_dir}{fmt}.root', fmt, hbins
+            )
+        except RuntimeError as e:
+            logger.warning(f"Skipping {fmt}: {e}")
+            continue
+
+        logger.info(
+            f"{fmt:>8}: {result['size_mb']:8.1f} MB, "
+            f"write {result['write_rate']:.3e} events/s, "
+            f"read {result['read_rate']:.3e} events/s"
+        )
+
+    return
+
+
+if __name__ == '__main__':
+    main()
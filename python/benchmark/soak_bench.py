@@ -0,0 +1,147 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import logging
+import statistics
+from argparse import ArgumentParser
+
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+
+def read_rss(report_dir):
+    '''
+    Rss after each file of the snapshot workers, in the order in which
+    the files were finished, and the number of worker processes.
+    '''
+    records = []
+    for path in glob.glob(f'{report_dir}partial/*.jsonl'):
+        with open(path) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+        os.remove(path)
+
+    records = [r for r in records if r['stage'] == 'snapshot_file']
+    records.sort(key=lambda r: r['finished'])
+
+    return [r['rss_mb'] for r in records], len({r['pid'] for r in records})
+
+
+def soak(arguments, nworkers, report_dir, max_tasks, max_rss):
+    '''
+    Process the tasks with the snapshot pool and summarise the memory of
+    the workers over the run.
+
+    Returns:
+    dict: median rss in the first and last tenth of the tasks, maximum
+        rss and number of worker processes.
+    '''
+    import python.tools.workers as workers
+    from python.correction.snapshot_maker import run_pool
+
+    workers.setup_workers(max_tasks, max_rss)
+    run_pool(arguments, nworkers, 1, desc=f"Soak {max_tasks}/{max_rss}")
+
+    rss, nprocs = read_rss(report_dir)
+    tenth = max(len(rss) // 10, 1)
+
+    return {
+        'tasks': len(rss),
+        'processes': nprocs,
+        'first_rss_mb': statistics.median(rss[:tenth]),
+        'last_rss_mb': statistics.median(rss[-tenth:]),
+        'max_rss_mb': max(rss),
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Soak test of the snapshot workers: process the same "
+        "synthetic files thousands of times and compare the memory of the "
+        "workers with and without recycling."
+    )
+    parser.add_argument("--out_dir", default='results/benchmarks/soak/')
+    parser.add_argument("--ntasks", default=2000, type=int)
+    parser.add_argument("--nfiles", default=4, type=int)
+    parser.add_argument("--nevents", default=2000, type=int)
+    parser.add_argument("-j", "--jobs", default=4, type=int)
+    parser.add_argument(
+        "--max_tasks", default=100, type=int,
+        help="Tasks per worker of the recycling run"
+    )
+    parser.add_argument(
+        "--max_rss", default=0., type=float,
+        help="Rss ceiling per worker of the recycling run in MB"
+    )
+    parser.add_argument(
+        "--tolerance", default=0.2, type=float,
+        help="Allowed relative rss growth with recycling"
+    )
+    args = parser.parse_args()
+
+    setup_logger('bench.log')
+
+    import python.tools.profiling as profiling
+    from python.benchmark.synthetic import make_dataset, mets
+    from python.correction.snapshot_maker import snapshot_columns
+
+    data = make_dataset(
+        f'{args.out_dir}data/', args.nfiles, args.nevents,
+        [0.3, -1.0, -0.2, 0.5]
+    )
+    with open(data['nanoAODs']) as f:
+        files = json.load(f)['MC']
+
+    report_dir = f'{args.out_dir}report/'
+    profiling.setup_profiling(report_dir)
+    quants = snapshot_columns(['PV_npvsGood'], mets)
+
+    results = {}
+    for mode, max_tasks, max_rss in [
+        ('no recycling', 0, -1.),
+        ('recycling', args.max_tasks, args.max_rss),
+    ]:
+        snap_dir = f'{args.out_dir}snapshots/'
+        shutil.rmtree(snap_dir, ignore_errors=True)
+        os.makedirs(snap_dir)
+
+        arguments = [
+            (
+                files[i % len(files)], data['golden_json'], data['pu_json'],
+                mets, snap_dir, quants, i, False
+            )
+            for i in range(args.ntasks)
+        ]
+        results[mode] = soak(
+            arguments, args.jobs, report_dir, max_tasks, max_rss
+        )
+        r = results[mode]
+        logger.info(
+            f"{mode:>12}: {r['tasks']} files in {r['processes']} processes, "
+            f"rss {r['first_rss_mb']:.0f} MB (first tenth) -> "
+            f"{r['last_rss_mb']:.0f} MB (last tenth), "
+            f"max {r['max_rss_mb']:.0f} MB"
+        )
+
+    shutil.rmtree(f'{args.out_dir}snapshots/', ignore_errors=True)
+    with open(f'{args.out_dir}results.json', 'w') as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Soak results saved in {args.out_dir}results.json")
+
+    r = results['recycling']
+    if r['last_rss_mb'] > r['first_rss_mb'] * (1 + args.tolerance):
+        logger.warning(
+            "Worker memory grows with recycling: "
+            f"{r['first_rss_mb']:.0f} MB -> {r['last_rss_mb']:.0f} MB."
+        )
+        sys.exit(1)
+
+    logger.info("Worker memory is flat with recycling.")
+
+    return
+
+
+if __name__ == '__main__':
+    main()
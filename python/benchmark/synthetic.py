@@ -0,0 +1,378 @@
+import os
+import json
+import math
+import logging
+import ROOT
+import correctionlib.schemav2 as cs
+from argparse import ArgumentParser
+
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+ROOT.gROOT.SetBatch(1)
+
+mets = [
+    'MET', 'PuppiMET', 'CaloMET', 'ChsMET', 'DeepMETResolutionTune',
+    'DeepMETResponseTune', 'RawMET', 'RawPuppiMET', 'TkMET'
+]
+
+_declared = []
+
+
+def declare_generator():
+    '''
+    Declare the C++ helpers generating muons and met, only once.
+    '''
+    if _declared:
+        return
+
+    ROOT.gInterpreter.Declare(
+    '''
+    #include "TRandom3.h"
+    #include "TLorentzVector.h"
+
+    TRandom3 synth_rng;
+
+    struct SynthMuons {
+        ROOT::RVecF pt, eta, phi, mass;
+        ROOT::RVec<UChar_t> pfIsoId;
+        ROOT::RVec<Bool_t> tightId;
+        ROOT::RVecI charge;
+    };
+
+    // Z->mumu decay in a fraction of events plus soft additional muons
+    SynthMuons synth_muons(double zfrac, double nextra) {
+        std::vector<TLorentzVector> vecs;
+        std::vector<int> charges;
+
+        if (synth_rng.Rndm() < zfrac) {
+            double mz = std::max(synth_rng.BreitWigner(91.1876, 2.4952), 1.);
+            TLorentzVector z;
+            z.SetPtEtaPhiM(
+                synth_rng.Exp(10.),
+                synth_rng.Gaus(0., 1.5),
+                synth_rng.Uniform(-M_PI, M_PI),
+                mz
+            );
+
+            // isotropic decay in the Z rest frame
+            double p = sqrt(std::max(mz * mz / 4. - 0.10566 * 0.10566, 0.));
+            double cost = synth_rng.Uniform(-1., 1.);
+            double sint = sqrt(1. - cost * cost);
+            double phi = synth_rng.Uniform(-M_PI, M_PI);
+            TLorentzVector mu1, mu2;
+            mu1.SetXYZM(p * sint * cos(phi), p * sint * sin(phi), p * cost, 0.10566);
+            mu2.SetXYZM(-p * sint * cos(phi), -p * sint * sin(phi), -p * cost, 0.10566);
+            mu1.Boost(z.BoostVector());
+            mu2.Boost(z.BoostVector());
+
+            vecs.push_back(mu1);
+            vecs.push_back(mu2);
+            charges.push_back(-1);
+            charges.push_back(1);
+        }
+
+        int n = synth_rng.Poisson(nextra);
+        for (int i = 0; i < n; i++) {
+            TLorentzVector mu;
+            mu.SetPtEtaPhiM(
+                3. + synth_rng.Exp(8.),
+                synth_rng.Uniform(-2.4, 2.4),
+                synth_rng.Uniform(-M_PI, M_PI),
+                0.10566
+            );
+            vecs.push_back(mu);
+            charges.push_back(synth_rng.Rndm() < 0.5 ? -1 : 1);
+        }
+
+        SynthMuons m;
+        for (std::size_t i = 0; i < vecs.size(); i++) {
+            if (vecs[i].Pt() < 1e-3) continue;
+            m.pt.push_back(vecs[i].Pt());
+            m.eta.push_back(vecs[i].Eta());
+            m.phi.push_back(vecs[i].Phi());
+            m.mass.push_back(vecs[i].M());
+            m.pfIsoId.push_back(synth_rng.Rndm() < 0.85 ? 4 + (synth_rng.Rndm() < 0.5) : 1);
+            m.tightId.push_back(synth_rng.Rndm() < 0.95);
+            m.charge.push_back(charges[i]);
+        }
+
+        // NanoAOD collections are sorted in pt
+        auto idx = ROOT::VecOps::Argsort(m.pt, [](float a, float b) {return a > b;});
+        m.pt = ROOT::VecOps::Take(m.pt, idx);
+        m.eta = ROOT::VecOps::Take(m.eta, idx);
+        m.phi = ROOT::VecOps::Take(m.phi, idx);
+        m.mass = ROOT::VecOps::Take(m.mass, idx);
+        m.pfIsoId = ROOT::VecOps::Take(m.pfIsoId, idx);
+        m.tightId = ROOT::VecOps::Take(m.tightId, idx);
+        m.charge = ROOT::VecOps::Take(m.charge, idx);
+
+        return m;
+    }
+
+    // met with gaussian resolution and a bias linear in npv
+    ROOT::RVecF synth_met(
+        int npv, double mx, double cx, double my, double cy, double resolution
+    ) {
+        double sigma = resolution * (10. + 0.5 * npv);
+        double x = synth_rng.Gaus(mx * npv + cx, sigma);
+        double y = synth_rng.Gaus(my * npv + cy, sigma);
+        return {static_cast<float>(sqrt(x * x + y * y)), static_cast<float>(atan2(y, x))};
+    }
+    '''
+    )
+    _declared.append(True)
+
+    return
+
+
+def make_nanoaod(
+    path, nevents, is_data, bias, seed=1, run0=355100,
+    events_per_lumi=500, lumis_per_run=20
+):
+    '''
+    Write a NanoAOD-like file with Events, Runs and LuminosityBlocks trees.
+    Must be run without implicit MT to be reproducible.
+
+    Args:
+    path (str): output file.
+    nevents (int): number of events.
+    is_data (bool): data files have no pileup truth information.
+    bias (list): injected met bias [m_x, c_x, m_y, c_y] vs npv.
+    seed (int): random seed.
+    run0 (int): first run number.
+    events_per_lumi (int): events per lumi section.
+    lumis_per_run (int): lumi sections per run.
+
+    Returns:
+    list: (run, luminosityBlock) pairs in the file.
+    '''
+    declare_generator()
+    ROOT.synth_rng.SetSeed(seed)
+
+    per_run = events_per_lumi * lumis_per_run
+
+    rdf = ROOT.RDataFrame(nevents)
+    rdf = rdf.Define("run", f"static_cast<UInt_t>({run0} + rdfentry_ / {per_run})")
+    rdf = rdf.Define(
+        "luminosityBlock",
+        f"static_cast<UInt_t>(1 + (rdfentry_ / {events_per_lumi}) % {lumis_per_run})"
+    )
+    rdf = rdf.Define("event", "static_cast<ULong64_t>(rdfentry_ + 1)")
+    rdf = rdf.Define(
+        "Pileup_nTrueInt",
+        "static_cast<Float_t>(std::max(synth_rng.Gaus(35., 12.), 0.))"
+    )
+    rdf = rdf.Define(
+        "PV_npvsGood",
+        "static_cast<UChar_t>(std::min(synth_rng.Poisson(0.7 * Pileup_nTrueInt), 255))"
+    )
+
+    rdf = rdf.Define("muons", "synth_muons(0.6, 0.5)")
+    columns = ['run', 'luminosityBlock', 'event', 'PV_npvsGood']
+    for col in ['pt', 'eta', 'phi', 'mass', 'pfIsoId', 'tightId', 'charge']:
+        rdf = rdf.Define(f"Muon_{col}", f"muons.{col}")
+        columns.append(f"Muon_{col}")
+    rdf = rdf.Define("nMuon", "static_cast<UInt_t>(Muon_pt.size())")
+    rdf = rdf.Define(
+        "HLT_IsoMu24",
+        "ROOT::VecOps::Any(Muon_pt > 26 && Muon_pfIsoId >= 4) "
+        "&& synth_rng.Rndm() < 0.95"
+    )
+    columns += ['nMuon', 'HLT_IsoMu24']
+
+    if not is_data:
+        columns.append('Pileup_nTrueInt')
+
+    # slightly different bias and resolution for each met type
+    for k, met in enumerate(mets):
+        scale = 1 + 0.1 * k
+        rdf = rdf.Define(
+            f"{met}_ptphi",
+            f"synth_met(PV_npvsGood, {bias[0] * scale}, {bias[1] * scale}, "
+            f"{bias[2] * scale}, {bias[3] * scale}, {0.8 + 0.05 * k})"
+        )
+        rdf = rdf.Define(f"{met}_pt", f"{met}_ptphi[0]")
+        rdf = rdf.Define(f"{met}_phi", f"{met}_ptphi[1]")
+        columns += [f"{met}_pt", f"{met}_phi"]
+
+    rdf.Snapshot("Events", path, columns)
+
+    # metadata trees
+    nlumis = (nevents - 1) // events_per_lumi + 1
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fMode = "UPDATE"
+
+    lumis = ROOT.RDataFrame(nlumis)
+    lumis = lumis.Define("run", f"static_cast<UInt_t>({run0} + rdfentry_ / {lumis_per_run})")
+    lumis = lumis.Define(
+        "luminosityBlock",
+        f"static_cast<UInt_t>(1 + rdfentry_ % {lumis_per_run})"
+    )
+    lumis.Snapshot("LuminosityBlocks", path, ["run", "luminosityBlock"], opts)
+
+    nruns = (nlumis - 1) // lumis_per_run + 1
+    runs = ROOT.RDataFrame(nruns)
+    runs = runs.Define("run", f"static_cast<UInt_t>({run0} + rdfentry_)")
+    runs = runs.Define(
+        "genEventCount",
+        f"static_cast<Long64_t>(std::min({per_run}ULL, {nevents}ULL - rdfentry_ * {per_run}))"
+    )
+    runs = runs.Define("genEventSumw", "static_cast<Double_t>(genEventCount)")
+    runs.Snapshot("Runs", path, ["run", "genEventCount", "genEventSumw"], opts)
+
+    return [
+        (run0 + i // lumis_per_run, 1 + i % lumis_per_run)
+        for i in range(nlumis)
+    ]
+
+
+def make_golden_json(path, lumis):
+    '''
+    Toy golden json certifying all but every tenth lumi section.
+    '''
+    golden = {}
+    for run, lumi in sorted(lumis):
+        if lumi % 10 == 0:
+            continue
+        ranges = golden.setdefault(str(run), [])
+        if ranges and ranges[-1][1] == lumi - 1:
+            ranges[-1][1] = lumi
+        else:
+            ranges.append([lumi, lumi])
+
+    with open(path, 'w') as f:
+        json.dump(golden, f, indent=4)
+
+    return
+
+
+def make_pu_json(path, name='Collisions_synthetic_goldenJSON'):
+    '''
+    Toy pileup weights in the format of the jsonpog puWeights.json.
+    '''
+    edges = list(range(0, 101))
+
+    def weights(shift):
+        w = []
+        for i in range(len(edges) - 1):
+            x = i + 0.5
+            data = math.exp(-0.5 * ((x - 35 - shift) / 12)**2)
+            mc = math.exp(-0.5 * ((x - 35) / 12)**2)
+            w.append(data / mc)
+        return w
+
+    content = []
+    for key, shift in [('nominal', 0), ('up', 2), ('down', -2)]:
+        content.append({"key": key, "value": cs.Binning(
+            nodetype="binning",
+            input="NumTrueInteractions",
+            edges=edges,
+            content=weights(shift),
+            flow="clamp"
+        )})
+
+    correction = cs.Correction(
+        name=name,
+        version=1,
+        inputs=[
+            cs.Variable(name='NumTrueInteractions', type='real'),
+            cs.Variable(name='weights', type='string'),
+        ],
+        output=cs.Variable(name='weight', type='real'),
+        data=cs.Category(
+            nodetype="category",
+            input='weights',
+            content=content
+        )
+    )
+    cset = cs.CorrectionSet(schema_version=2, corrections=[correction])
+
+    with open(path, 'w') as f:
+        f.write(cset.json(exclude_unset=True, indent=4))
+
+    return
+
+
+def make_dataset(out_dir, nfiles, nevents, bias, seed=1):
+    '''
+    Write synthetic DATA and MC NanoAOD files together with a golden json,
+    pileup weights and a file list in the format of inputs/nanoAODs/.
+
+    Args:
+    out_dir (str): output directory.
+    nfiles (int): number of files per DATA / MC.
+    nevents (int): number of events per file.
+    bias (list): injected met bias [m_x, c_x, m_y, c_y] vs npv.
+    seed (int): random seed.
+
+    Returns:
+    dict: paths of 'nanoAODs', 'golden_json' and 'pu_json'.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+
+    files = {'DATA': [], 'MC': []}
+    lumis = []
+
+    for idx in range(nfiles):
+        for dtmc in files:
+            path = os.path.abspath(f'{out_dir}/{dtmc}_{idx}.root')
+            is_data = (dtmc == 'DATA')
+
+            file_lumis = make_nanoaod(
+                path, nevents, is_data, bias,
+                seed=seed + 2 * idx + is_data,
+                # data files cover consecutive runs, mc uses run 1
+                run0=355100 + 100 * idx if is_data else 1
+            )
+            if is_data:
+                lumis += file_lumis
+            files[dtmc].append(path)
+
+    paths = {
+        'nanoAODs': f'{out_dir}/nanoAODs.json',
+        'golden_json': f'{out_dir}/golden.json',
+        'pu_json': f'{out_dir}/puWeights.json',
+    }
+
+    with open(paths['nanoAODs'], 'w') as f:
+        json.dump(files, f, indent=4)
+    make_golden_json(paths['golden_json'], lumis)
+    make_pu_json(paths['pu_json'])
+
+    logger.info(
+        f"Synthetic dataset with {nfiles} x {nevents} events per DATA / MC "
+        f"written to {out_dir}."
+    )
+
+    return paths
+
+
+def main():
+    parser = ArgumentParser(
+        description="Generate synthetic NanoAOD-like files for testing."
+    )
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--nfiles", default=2, type=int)
+    parser.add_argument("--nevents", default=10000, type=int)
+    parser.add_argument(
+        "--bias",
+        help="Injected met bias m_x,c_x,m_y,c_y vs npv",
+        default='0.3,-1.0,-0.2,0.5'
+    )
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    setup_logger('synthetic.log')
+
+    make_dataset(
+        args.out_dir, args.nfiles, args.nevents,
+        [float(b) for b in args.bias.split(',')], args.seed
+    )
+
+    return
+
+
+if __name__ == '__main__':
+    main()
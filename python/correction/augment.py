@@ -0,0 +1,240 @@
+import ROOT
+import os
+import json
+import logging
+from multiprocessing import Pool
+import numpy as np
+
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.resolver as resolver
+from python.correction.snapshot_maker import define_met_xy
+from python.tools.snapshot_io import (
+    get_snapshot_files, get_friend_path, snapshot_options, require_ttree
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_columns(path, tree):
+    tf = ROOT.TFile.Open(path)
+    names = [b.GetName() for b in tf.Get(tree).GetListOfBranches()]
+    tf.Close()
+
+    return names
+
+
+def read_columns(rdf, columns):
+    '''
+    Columns of a dataframe as numpy arrays in entry order (implicit MT is
+    disabled in the augmentation workers).
+    '''
+    return {k: np.asarray(v) for k, v in rdf.AsNumpy(columns).items()}
+
+
+def read_source(path, entries, mets):
+    '''
+    Read the met xy columns of the given entries of a NanoAOD file via an
+    entry list, so that only the baskets of these entries are read.
+
+    Args:
+    path (str): input file as in the file list.
+    entries (np.array): sorted entry numbers.
+    mets (list): met types to add.
+
+    Returns:
+    tuple: columns by name (with 'event' for the alignment check), bytes
+        read, size of the file and compressed size of the met branches.
+    '''
+    url = resolver.resolve(path)
+
+    elist = ROOT.TEntryList("xycorr_augment", "", "Events", url)
+    for e in entries:
+        elist.Enter(int(e))
+
+    chain = ROOT.TChain("Events")
+    chain.Add(url)
+    chain.SetEntryList(elist)
+
+    before = ROOT.TFile.GetFileBytesRead()
+    rdf = define_met_xy(ROOT.RDataFrame(chain), mets)
+    columns = ['event'] + [f'{met}_{xy}' for met in mets for xy in 'xy']
+    values = read_columns(rdf, columns)
+    bytes_read = ROOT.TFile.GetFileBytesRead() - before
+
+    # what a full reprocessing would read at least: these branches for
+    # all entries, from the file opened by the resolver if any
+    tf = resolver.take_open_file(url) or ROOT.TFile.Open(url)
+    tree = tf.Get("Events")
+    zipped = sum(
+        tree.GetBranch(f'{met}_{v}').GetZipBytes()
+        for met in mets for v in ['pt', 'phi']
+    )
+    size = tf.GetSize()
+    tf.Close()
+
+    if len(values['event']) != len(entries):
+        raise RuntimeError(
+            f"Read {len(values['event'])} entries from {path}, "
+            f"expected {len(entries)}."
+        )
+
+    return values, bytes_read, size, zipped
+
+
+def augment_file(args):
+    '''
+    Add the columns of new met types to a snapshot as friend tree, read
+    from the selected entries of its NanoAOD files only. Columns of an
+    earlier augmentation are kept.
+
+    Args:
+    args (tuple): (snapshot file, input files of the dataset, met types).
+
+    Returns:
+    dict: number of events, bytes read and bytes of a full reprocessing.
+    '''
+    path, infiles, mets = args
+    friend = get_friend_path(path)
+
+    result = {'events': 0, 'bytes_read': 0, 'source_bytes': 0,
+              'column_bytes': 0}
+
+    columns = get_columns(path, "Events")
+    previous = {}
+    if os.path.exists(friend) and \
+            os.path.getmtime(friend) >= os.path.getmtime(path):
+        previous = read_columns(
+            ROOT.RDataFrame("Friends", friend), get_columns(friend, "Friends")
+        )
+    columns += list(previous)
+
+    missing = [
+        met for met in mets
+        if f'{met}_x' not in columns or f'{met}_y' not in columns
+    ]
+    if not missing:
+        return result
+
+    with profiling.profile_stage('augment_file', partial=True, file=path):
+        snap = read_columns(
+            ROOT.RDataFrame("Events", path),
+            ['source_idx', 'source_entry', 'event']
+        )
+        if np.any(snap['source_idx'] < 0):
+            raise ValueError(
+                f"{path} has no source entries, snapshots of the dask "
+                "backend can not be augmented."
+            )
+
+        added = {
+            f'{met}_{xy}': None for met in missing for xy in 'xy'
+        }
+        for idx in np.unique(snap['source_idx']):
+            rows = np.flatnonzero(snap['source_idx'] == idx)
+            entries = np.unique(snap['source_entry'][rows])
+
+            values, nread, size, zipped = read_source(
+                infiles[idx], entries, missing
+            )
+            result['bytes_read'] += nread
+            result['source_bytes'] += size
+            result['column_bytes'] += zipped
+
+            # back to the order of the snapshot
+            pos = np.searchsorted(entries, snap['source_entry'][rows])
+            if np.any(values['event'][pos] != snap['event'][rows]):
+                raise RuntimeError(
+                    f"Events of {path} do not match the entries of "
+                    f"{infiles[idx]}. Was the file list changed?"
+                )
+            for col in added:
+                if added[col] is None:
+                    added[col] = np.zeros(
+                        len(snap['event']), dtype=values[col].dtype
+                    )
+                added[col][rows] = values[col][pos]
+
+        os.makedirs(os.path.dirname(friend), exist_ok=True)
+        tmp = friend.replace('.root', '.tmp.root')
+        out = {**previous, **added}
+        ROOT.RDF.FromNumpy(out).Snapshot(
+            "Friends", tmp, list(out), snapshot_options(fmt='TTree')
+        )
+        os.replace(tmp, friend)
+
+        result['events'] = len(snap['event'])
+        profiling.update_record(
+            events_in=result['events'], events_out=result['events'],
+            bytes_read=result['bytes_read']
+        )
+
+    return result
+
+
+def init_worker():
+    # arrays must follow the entry order
+    resources.enable_threads(1)
+
+
+def augment_snapshots(file_path, snap_dir, mets, datamc, nworkers):
+    '''
+    Add met types that are missing in the snapshots as friend trees,
+    without reprocessing the full NanoAOD. For every snapshot, only the
+    selected entries (stored as source_idx and source_entry) are read from
+    the input files. The histogram and validation steps pick up the
+    friend trees automatically. The bytes read are compared with a full
+    reprocessing in {snap_dir}augment_report.json.
+
+    Args:
+    file_path (str): Path to the file list (JSON) used for the snapshots.
+    snap_dir (str): Directory of snapshots.
+    mets (list): Met types, missing ones are added.
+    datamc (list): List of datasets.
+    nworkers (int): Number of worker processes.
+
+    Returns:
+    dict: report per dataset.
+    '''
+    require_ttree("Friend trees are")
+
+    with open(file_path) as f:
+        infiles = json.load(f)
+
+    report = {}
+    for dtmc in datamc:
+        files = get_snapshot_files(snap_dir, dtmc)
+        logger.info(
+            f"Augmenting {len(files)} {dtmc} snapshots with {nworkers} "
+            "processes."
+        )
+
+        arguments = [(f, infiles[dtmc], mets) for f in files]
+        with Pool(max(min(nworkers, len(files)), 1), init_worker) as pool:
+            results = pool.map(augment_file, arguments)
+
+        r = {
+            key: sum(res[key] for res in results)
+            for key in ['events', 'bytes_read', 'source_bytes', 'column_bytes']
+        }
+        report[dtmc] = r
+        profiling.add_to_record(events_in=r['events'], events_out=r['events'])
+
+        if r['events'] == 0:
+            logger.info(f"The {dtmc} snapshots already contain all mets.")
+            continue
+
+        logger.info(
+            f"Augmented {r['events']} {dtmc} events reading "
+            f"{r['bytes_read'] / 1024**2:.1f} MB. A full reprocessing reads "
+            f"up to {r['source_bytes'] / 1024**2:.1f} MB, at least "
+            f"{r['column_bytes'] / 1024**2:.1f} MB for these columns alone "
+            f"({1 - r['bytes_read'] / max(r['column_bytes'], 1):.0%} saved)."
+        )
+
+    path = f'{snap_dir}augment_report.json'
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Augmentation report saved in {path}")
+
+    return report
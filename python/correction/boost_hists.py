@@ -0,0 +1,189 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import boost_histogram as bh
+
+import python.tools.profiling as profiling
+from python.tools.snapshot_io import (
+    get_snapshot_files, get_friend_files, require_ttree
+)
+from python.correction.numpy_hists import bin_index, range_stats, write_hists
+
+logger = logging.getLogger(__name__)
+
+
+def iter_snapshots(files, columns, executor, friends=None, step_size='100 MB',
+                   step_entries=1000000):
+    '''
+    Iterate over the ROOT snapshots with uproot in chunks of about
+    step_size, decompressing and interpreting the baskets in the threads
+    of the executor. With friend trees, both are read in the same entry
+    ranges of step_entries entries.
+
+    Yields:
+    dict: numpy arrays by column name.
+    '''
+    import uproot
+
+    executors = {
+        'decompression_executor': executor,
+        'interpretation_executor': executor,
+    }
+
+    if not friends:
+        yield from uproot.iterate(
+            {f: 'Events' for f in files}, columns, step_size=step_size,
+            library='np', **executors
+        )
+        return
+
+    for path, friend in zip(files, friends):
+        with uproot.open(path) as f, uproot.open(friend) as ff:
+            events, added = f['Events'], ff['Friends']
+            fcols = [c for c in columns if c in added.keys()]
+            cols = [c for c in columns if c not in fcols]
+
+            for start in range(0, events.num_entries, step_entries):
+                stop = min(start + step_entries, events.num_entries)
+                batch = events.arrays(
+                    cols, entry_start=start, entry_stop=stop, library='np',
+                    **executors
+                )
+                batch.update(added.arrays(
+                    fcols, entry_start=start, entry_stop=stop, library='np',
+                    **executors
+                ))
+                yield batch
+
+
+def new_hist(xbins, ybins):
+    '''
+    Weighted 2d histogram over the bin numbers of a TH2D, including under-
+    and overflow, with the statistics of a TH2D.
+    '''
+    return {
+        'xbins': xbins,
+        'ybins': ybins,
+        'hist': bh.Histogram(
+            bh.axis.Integer(0, xbins[2] + 2, underflow=False, overflow=False),
+            bh.axis.Integer(0, ybins[2] + 2, underflow=False, overflow=False),
+            storage=bh.storage.Weight()
+        ),
+        'entries': 0,
+        'stats': np.zeros(7),
+    }
+
+
+def fill_hists_boost(batches, hbins, mets, pileups, threads):
+    '''
+    Fill the 2d histograms met xy vs pileup for all pileup weight
+    variations with boost-histogram, with the same names and binning as
+    histograms.book_hists. The bin numbers are computed like
+    TAxis::FindFixBin, so that entries on bin edges end up in the same
+    bins as with RDataFrame, and the weights are filled in several
+    threads.
+
+    Args:
+    batches (iterable): dictionaries of numpy arrays by column name.
+    hbins (dict): Dictionary with histogram binnings.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+    threads (int): Number of fill threads.
+
+    Returns:
+    tuple: histograms in the format of numpy_hists.new_hist by name and
+        number of events.
+    '''
+    hists = {}
+    nevents = 0
+    threads = threads if threads > 1 else None
+
+    for batch in batches:
+        nevents += len(batch['puWeight'])
+        for met in mets:
+            for pu in pileups:
+                npv = batch[pu].astype(np.float64)
+                ix = bin_index(npv, hbins['pileup'])
+                for var in [met+'_x', met+'_y']:
+                    y = batch[var].astype(np.float64)
+                    iy = bin_index(y, hbins['met'])
+                    for variation in ["", "Up", "Dn"]:
+                        w = batch["puWeight"+variation].astype(np.float64)
+                        name = f'{pu}_{var}_puweight{variation}'
+                        if name not in hists:
+                            hists[name] = new_hist(
+                                hbins['pileup'], hbins['met']
+                            )
+                        h = hists[name]
+                        h['hist'].fill(ix, iy, weight=w, threads=threads)
+                        h['entries'] += len(w)
+                        h['stats'] += range_stats(
+                            npv, y, w, ix, iy, h['xbins'], h['ybins']
+                        )
+
+    # layout of numpy_hists.new_hist: y bins first
+    for name, h in hists.items():
+        view = h.pop('hist').view()
+        h['sumw'] = np.ascontiguousarray(view.value.T)
+        h['sumw2'] = np.ascontiguousarray(view.variance.T)
+
+    return hists, nevents
+
+
+def make_hists_boost(
+    snap_dir, hist_dir, hbins, jobs, mets, pileups, datamc, files=None,
+    names=None
+):
+    '''
+    Same as histograms.make_hists, but reading the ROOT snapshots with
+    uproot and filling with boost-histogram, without ROOT and jitting.
+
+    snap_dir (str): Directory of snapshots.
+    hist_dir (str): Output directory for histograms.
+    hbins (dict): Dictionary with histogram binnings.
+    jobs (int): Number of threads for decompression and filling.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+    datamc (list): List of datasets to process (data / mc).
+    files (dict): Snapshots per dataset, default are all snapshots.
+    names (dict): Output names per dataset, default is the dataset.
+    '''
+    require_ttree("The boost-histogram engine is")
+
+    columns = list(pileups) + ['puWeight', 'puWeightUp', 'puWeightDn']
+    for met in mets:
+        columns += [f'{met}_x', f'{met}_y']
+
+    for dtmc in datamc:
+        n = max(jobs, 1)
+        logger.info(
+            f"Starting histogram production for {dtmc} with boost-histogram "
+            f"and {n} threads."
+        )
+
+        snapshots = files[dtmc] if files else get_snapshot_files(snap_dir, dtmc)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(n) as executor:
+            hists, nevents = fill_hists_boost(
+                iter_snapshots(
+                    snapshots, columns, executor, get_friend_files(snapshots)
+                ),
+                hbins, mets, pileups, n
+            )
+        wall = time.perf_counter() - start
+        logger.debug(f"Filled {nevents} events in {wall:.1f} s.")
+
+        profiling.add_to_record(events_in=nevents, events_out=nevents)
+
+        name = names[dtmc] if names else dtmc
+        rfile = hist_dir+name+'.root'
+        write_hists(rfile, hists)
+
+        logger.info(
+            f"Histogram production finished for {dtmc}. Saved in {rfile}"
+        )
+
+    return
@@ -0,0 +1,238 @@
+import json
+import math
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# range of the linear fits in correction_extractor
+fit_range = (10, 70)
+
+
+def read_hist(f, name):
+    '''
+    Bin contents of a 2d histogram met xy vs pileup in a file opened with
+    uproot, without under- and overflow.
+
+    Returns:
+    dict: pileup values and met xy bin centres, sum of weights and of
+        squared weights with shape (pileup, met xy).
+    '''
+    h = f[name]
+    xedges = h.axis(0).edges()
+    yedges = h.axis(1).edges()
+    sumw = h.values()
+    sumw2 = h.variances()
+
+    # pileup counts are integers, with unit bins all entries of a bin have
+    # the value of its low edge
+    width = np.diff(xedges)
+    if np.allclose(width, 1):
+        npv = xedges[:-1]
+    else:
+        npv = (xedges[:-1] + xedges[1:]) / 2
+
+    return {
+        'npv': npv,
+        'centres': (xedges[:-1] + xedges[1:]) / 2,
+        'y': (yedges[:-1] + yedges[1:]) / 2,
+        'sumw': sumw,
+        'sumw2': sumw2,
+    }
+
+
+def corrected_values(h, params, variation):
+    '''
+    Corrected met component in every bin of the histogram, like the
+    formulas of convert2json: the shift m * npv + c is subtracted, and the
+    stat variations move the corrected value by its uncertainty.
+
+    Args:
+    h (dict): histogram of read_hist.
+    params (dict): fit result with m, c, their uncertainties and correlation.
+    variation (str): 'nom', 'stat_up' or 'stat_dn'.
+
+    Returns:
+    np.array: corrected values with the shape of the histogram.
+    '''
+    corr = h['y'][None, :] - (params['m'] * h['npv'] + params['c'])[:, None]
+    if variation == 'nom':
+        return corr
+
+    sigma = np.sqrt(np.maximum(
+        (corr * params['m_stat'])**2 + params['c_stat']**2
+        + 2 * corr * params['m_stat'] * params['c_stat']
+        * params['correlation'],
+        0
+    ))
+
+    return corr + sigma if variation == 'stat_up' else corr - sigma
+
+
+def closure_metrics(h, corr, nsigma):
+    '''
+    Closure of the corrected values from the moments per pileup bin: the
+    corrected means, a weighted linear fit of the means (residual slope and
+    offset), the chi2 of the means with respect to zero and the mean over
+    the fit range.
+
+    Args:
+    h (dict): histogram of read_hist.
+    corr (np.array): corrected values per bin of corrected_values.
+    nsigma (float): maximal significance of the residual slope and of the
+        mean to pass.
+
+    Returns:
+    dict: closure metrics and 'passed'.
+    '''
+    sumw = h['sumw'].sum(axis=1)
+    sumw2 = h['sumw2'].sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (h['sumw'] * corr).sum(axis=1) / sumw
+        var = (h['sumw'] * corr**2).sum(axis=1) / sumw - mean**2
+        neff = sumw**2 / sumw2
+
+    sel = (h['centres'] >= fit_range[0]) & (h['centres'] <= fit_range[1]) \
+        & (sumw > 0) & (neff >= 2) & (var > 0)
+    if sel.sum() < 3:
+        raise ValueError(
+            f"Only {sel.sum()} filled pileup bins in the fit range, too few "
+            "for a closure test."
+        )
+
+    x, mu = h['npv'][sel], mean[sel]
+    err2 = var[sel] / neff[sel]
+    u = 1 / err2
+
+    # weighted least squares of mu = slope * x + offset
+    s, sx, sxx = u.sum(), (u * x).sum(), (u * x * x).sum()
+    sy, sxy = (u * mu).sum(), (u * x * mu).sum()
+    det = s * sxx - sx**2
+    slope = (s * sxy - sx * sy) / det
+    offset = (sxx * sy - sx * sxy) / det
+
+    w = sumw[sel]
+    avg = (w * mu).sum() / w.sum()
+    avg_err = math.sqrt((w**2 * err2).sum()) / w.sum()
+
+    slope_err = math.sqrt(s / det)
+    chi2 = float((u * mu**2).sum())
+    chi2_line = float((u * (mu - slope * x - offset)**2).sum())
+
+    result = {
+        'slope': float(slope),
+        'slope_err': slope_err,
+        'offset': float(offset),
+        'offset_err': math.sqrt(sxx / det),
+        'mean': float(avg),
+        'mean_err': avg_err,
+        'chi2': chi2,
+        'chi2_line': chi2_line,
+        'ndf': int(sel.sum()),
+        'means': mean[sel].tolist(),
+        'npv': x.tolist(),
+    }
+    result['passed'] = bool(
+        abs(slope) <= nsigma * slope_err and abs(avg) <= nsigma * avg_err
+    )
+
+    return result
+
+
+def check_closure(hist_dir, corr_dir, datamc, nsigma=3.):
+    '''
+    Closure test of the fitted corrections without reading the snapshots.
+    The correction is a shift per pileup value, so the corrected mean and
+    spread of met x and y in every pileup bin follow from the 2d histograms
+    of the histogram step and the fit results. For every met type,
+    component and variation, the corrected means must not depend on the
+    pileup and must be compatible with zero within nsigma standard
+    deviations. The pileup variations are tested on the histograms with the
+    varied weights they were fitted on.
+
+    Args:
+    hist_dir (str): Directory of histograms.
+    corr_dir (str): Directory of the fit results, the report is saved in
+        {corr_dir}closure_report.json.
+    datamc (list): List of datasets.
+    nsigma (float): maximal significance of the residual slope and of the
+        corrected mean.
+
+    Returns:
+    bool: whether all tests passed.
+    '''
+    import uproot
+
+    start = time.perf_counter()
+
+    weights = {'nom': '', 'pu_up': 'Up', 'pu_dn': 'Dn'}
+
+    report = {}
+    failed = []
+    for dtmc in datamc:
+        with open(f'{corr_dir}{dtmc}.json') as f:
+            corrs = json.load(f)
+        hist_file = uproot.open(f'{hist_dir}{dtmc}.root')
+
+        report[dtmc] = {}
+        for met, per_pu in corrs.items():
+            for pu, per_xy in per_pu.items():
+                for xy, per_var in per_xy.items():
+                    hists = {
+                        var: read_hist(
+                            hist_file,
+                            f'{pu}_{met}{xy}_puweight{weights[var]}'
+                        )
+                        for var in per_var
+                    }
+
+                    # keys of the variations as in the correctionlib file
+                    tests = {var: (var, 'nom') for var in per_var}
+                    for d in ['up', 'dn']:
+                        tests[f'stat_{xy[1]}{d}'] = ('nom', f'stat_{d}')
+
+                    results = {}
+                    for key, (var, shift) in tests.items():
+                        results[key] = closure_metrics(
+                            hists[var],
+                            corrected_values(hists[var], per_var[var], shift),
+                            nsigma
+                        )
+                        if not results[key]['passed']:
+                            failed.append(f'{dtmc} {met}{xy} {pu} {key}')
+
+                    report[dtmc][f'{met}{xy}_{pu}'] = results
+
+                    r = results['nom']
+                    logger.info(
+                        f"Closure {dtmc} {met}{xy}: residual slope "
+                        f"{r['slope']:.2e} +- {r['slope_err']:.2e}, mean "
+                        f"{r['mean']:.3f} +- {r['mean_err']:.3f} GeV, "
+                        f"chi2/ndf {r['chi2']:.1f}/{r['ndf']}"
+                    )
+
+        hist_file.close()
+
+    passed = not failed
+    report['nsigma'] = nsigma
+    report['passed'] = passed
+
+    out = f'{corr_dir}closure_report.json'
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    wall = time.perf_counter() - start
+    if passed:
+        logger.info(
+            f"Closure test passed in {wall * 1000:.0f} ms. Report saved in "
+            f"{out}"
+        )
+    else:
+        logger.error(
+            f"Closure test failed for {', '.join(failed)} "
+            f"(more than {nsigma} standard deviations). Report saved in {out}"
+        )
+
+    return passed
@@ -0,0 +1,181 @@
+import ROOT
+import os
+import json
+import logging
+from glob import glob
+from multiprocessing import Pool, RLock
+from tqdm import tqdm
+
+import python.tools.profiling as profiling
+from python.tools.snapshot_io import (
+    get_manifest_path, snapshot_options, count_entries
+)
+from inputs.config.snapshot import get_snapshot_config
+
+logger = logging.getLogger(__name__)
+
+
+def plan_groups(files, target_size):
+    """
+    Pack snapshot files into groups of about target_size bytes. Files are
+    kept in order, so the same inputs always give the same groups.
+
+    Args:
+    files (list): snapshot files.
+    target_size (int): target size of the merged files in bytes.
+
+    Returns:
+    list: lists of files per group.
+    """
+    groups = []
+    group = []
+    size = 0
+
+    for f in files:
+        fsize = os.path.getsize(f)
+        if group and size + fsize > target_size:
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(f)
+        size += fsize
+
+    if group:
+        groups.append(group)
+
+    return groups
+
+
+def get_stamps(files):
+    """
+    Size and modification time of the input files, to recognise snapshots
+    that were made again or rewritten since they were merged.
+    """
+    return [[os.path.getsize(f), os.path.getmtime(f)] for f in files]
+
+
+def compact_group(args):
+    """
+    Merge a group of snapshots into one file. A group is skipped if it has
+    already been merged from the same, unchanged inputs, so compaction can
+    be resumed. The merged file is written with clusters of the size in
+    inputs/config/snapshot.py, instead of the ROOT defaults.
+
+    Args:
+    args (tuple): (index of the group, input files, output directory).
+
+    Returns:
+    dict: output file, input files and number of entries.
+    """
+    idx, files, out_dir = args
+
+    out_file = f'{out_dir}compact_{idx}.root'
+    info_file = f'{out_dir}compact_{idx}.json'
+
+    if os.path.exists(info_file) and os.path.exists(out_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        if info['inputs'] == files \
+                and info.get('stamps') == get_stamps(files):
+            return info
+
+    with profiling.profile_stage('compact_file', partial=True, file=out_file):
+        entries_in = count_entries(files)
+
+        # write to a temporary file first, only complete files are published
+        tmp_file = f'{out_dir}compact_{idx}.tmp.root'
+        rdf = ROOT.RDataFrame("Events", files)
+        rdf.Snapshot(
+            "Events", tmp_file, "",
+            snapshot_options(cluster_mb=get_snapshot_config()['cluster_mb'])
+        )
+
+        entries_out = count_entries([tmp_file])
+        if entries_out != entries_in:
+            os.remove(tmp_file)
+            raise RuntimeError(
+                f"Merged file {out_file} has {entries_out} entries, "
+                f"but its inputs have {entries_in}."
+            )
+
+        os.replace(tmp_file, out_file)
+        profiling.update_record(events_in=entries_in, events_out=entries_out)
+
+    info = {
+        'file': out_file,
+        'inputs': files,
+        'stamps': get_stamps(files),
+        'entries': entries_out,
+        'size': os.path.getsize(out_file),
+    }
+    with open(info_file, 'w') as f:
+        json.dump(info, f, indent=4)
+
+    return info
+
+
+def init_worker(lock):
+    tqdm.set_lock(lock)
+
+
+def compact_snapshots(snap_dir, datamc, nworkers, target_size_mb=2000):
+    """
+    Merge the many small snapshots into few large files and write a
+    manifest, which is read by the following steps instead of the
+    file_*.root glob.
+
+    Args:
+        snap_dir (str): Directory of snapshots.
+        datamc (list): List of dataset types (e.g., 'DATA', 'MC').
+        nworkers (int): Number of worker processes.
+        target_size_mb (int): Target size of the merged files in MB.
+    """
+    for dtmc in datamc:
+
+        snap_dir_dtmc = os.path.join(snap_dir, dtmc, '')
+        files = sorted(glob(f'{snap_dir_dtmc}file_*.root'))
+        groups = plan_groups(files, target_size_mb * 1024**2)
+
+        logger.info(
+            f"Compacting {len(files)} {dtmc} snapshots into {len(groups)} "
+            f"files with {nworkers} processes."
+        )
+
+        arguments = [
+            (idx, group, snap_dir_dtmc) for idx, group in enumerate(groups)
+        ]
+
+        infos = []
+        pool = Pool(
+            max(min(nworkers, len(arguments)), 1),
+            initargs=(RLock(),),
+            initializer=init_worker
+        )
+        for info in tqdm(
+            pool.imap(compact_group, arguments),
+            total=len(arguments),
+            desc=f"Compacting {dtmc}",
+            dynamic_ncols=True,
+            leave=True
+        ):
+            infos.append(info)
+        pool.close()
+        pool.join()
+
+        entries = sum(info['entries'] for info in infos)
+        manifest = {
+            'files': [info['file'] for info in infos],
+            'entries': entries,
+            'sources': {info['file']: info['inputs'] for info in infos},
+        }
+        path = get_manifest_path(snap_dir, dtmc)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        profiling.add_to_record(events_in=entries, events_out=entries)
+        logger.info(
+            f"Compaction of {dtmc} finished with {entries} events. "
+            f"Manifest saved in {path}"
+        )
+
+    return
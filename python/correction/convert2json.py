@@ -1,16 +1,11 @@
-import ROOT
+import os
 import json
 import correctionlib.schemav2 as cs
-import correctionlib
 import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
-correctionlib.register_pyroot_binding()
-
-ROOT.EnableImplicitMT(24)
-
 
 def formula_expressions():
     # Expression for pt correction
@@ -190,10 +185,23 @@ def make_correction_with_formula(corr_dir, year, datamc, mets):
     )
 
     path = corr_dir.replace(f'{year}/', f'schemaV2_{year}.json')
+    tmp_path = os.path.join(
+        os.path.dirname(path), f'.tmp_{os.path.basename(path)}'
+    )
 
-    with open(path, 'w') as fout:
+    with open(tmp_path, 'w') as fout:
         fout.write(cset.json(exclude_unset=True, indent=4))
 
+    # make sure the vectorised evaluator reproduces correctionlib before
+    # the file replaces the previous one
+    from python.correction.evaluator import check_against_correctionlib
+    try:
+        check_against_correctionlib(tmp_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
     logger.info(f'Saved clib file in {path}')
 
     return
\ No newline at end of file
@@ -1,11 +1,45 @@
 import ROOT
 import os
+import math
 import python.tools.plot as plot
 import json
+from python.correction.sketches import read_sketch, estimate, get_sketch_file
+
+# standard error of the estimators relative to the standard error of the
+# mean for normal distributions
+rel_errors = {'median': math.sqrt(math.pi / 2), 'trimmed': 1.06}
+
+
+def get_estimator_graph(h, sketch, estimator):
+    """
+    Median or trimmed mean of met xy per pileup bin as a graph, with the
+    statistical uncertainty scaled from the spread in the histogram.
+
+    h (ROOT.TH2D): 2d histogram met xy vs pileup.
+    sketch (ROOT.SketchSet): quantile sketch of the same quantity.
+    estimator (str): 'median' or 'trimmed'.
+
+    Returns:
+    ROOT.TGraphErrors
+    """
+    g = ROOT.TGraphErrors()
+    for i, (x, value, weight) in enumerate(estimate(sketch, estimator)):
+        proj = h.ProjectionY(f"{h.GetName()}_py{i}", i+1, i+1)
+        neff = proj.GetEffectiveEntries()
+        if weight <= 0 or neff < 2 or math.isnan(value):
+            continue
+        n = g.GetN()
+        g.SetPoint(n, x, value)
+        g.SetPointError(
+            n, 0, rel_errors[estimator] * proj.GetStdDev() / math.sqrt(neff)
+        )
+
+    return g
+
 
 def get_corrections(
     hist_dir, hbins, corr_dir, plot_dir, mets, pileups, 
-    lumilabel, axislabels, datamc
+    lumilabel, axislabels, datamc, estimator='mean'
 ):
     """
     function to get xy corrections and plot results
@@ -19,6 +53,9 @@ def get_corrections(
     lumilabel (dict): Dictionary for lumi label position and text.
     axislabels (dict): Dictionary for axis labels.
     datamc (list): List of datasets to process (data / mc).
+    estimator (str): Estimator of met xy per pileup bin that is fitted,
+        'mean' (from the histograms), 'median' or 'trimmed' (10% trimmed
+        mean, both from the quantile sketches).
     """
 
     corr_dict = {}
@@ -52,7 +89,15 @@ def get_corrections(
 
                         # define and fit pol1 function
                         f1 = ROOT.TF1("pol1", "[0]*x+[1]", -10, 110)
-                        fitresult = h.Fit(f1, "R S", "", 10, 70)
+                        if estimator == 'mean':
+                            fitresult = h.Fit(f1, "R S", "", 10, 70)
+                        else:
+                            sketch = read_sketch(
+                                get_sketch_file(hist_dir, dtmc),
+                                f'{pu}_{met}{xy}{variations[variation]}'
+                            )
+                            g = get_estimator_graph(h, sketch, estimator)
+                            fitresult = g.Fit(f1, "R S", "", 10, 70)
 
                         # save fit parameter
                         corr_dict[met][pu][xy][variation] = {
@@ -0,0 +1,240 @@
+#ifndef XYCORR_QUANTILESKETCH_H
+#define XYCORR_QUANTILESKETCH_H
+
+#include <algorithm>
+#include <cmath>
+#include <memory>
+#include <vector>
+
+#include "ROOT/RDataFrame.hxx"
+#include "TVectorD.h"
+
+// Merging t-digest: a weighted distribution summarised by at most about
+// compression centroids, small near the tails and large in the bulk,
+// so quantiles and trimmed means are accurate with bounded memory. Digests
+// of different threads, files or jobs are merged by adding their
+// centroids.
+class TDigest {
+public:
+    explicit TDigest(double compression = 100.) : compression_(compression) {}
+
+    void Add(double x, double w = 1.) {
+        if (!(w > 0.) || !std::isfinite(x)) return;
+        buffer_.emplace_back(x, w);
+        if (buffer_.size() >= compression_) Compress();
+    }
+
+    void Merge(const TDigest &other) {
+        for (const auto &c : other.centroids_) buffer_.push_back(c);
+        for (const auto &c : other.buffer_) buffer_.push_back(c);
+        Compress();
+    }
+
+    double TotalWeight() {
+        Compress();
+        double total = 0.;
+        for (const auto &c : centroids_) total += c.second;
+        return total;
+    }
+
+    // value below which a fraction q of the weight lies
+    double Quantile(double q) {
+        Compress();
+        if (centroids_.empty()) return std::nan("");
+        if (centroids_.size() == 1) return centroids_[0].first;
+
+        const double target = q * TotalWeight();
+        double cum = 0.;
+        for (std::size_t i = 0; i + 1 < centroids_.size(); ++i) {
+            // interpolate between the centres of neighbouring centroids
+            const double left = cum + centroids_[i].second / 2.;
+            const double right = cum + centroids_[i].second
+                + centroids_[i + 1].second / 2.;
+            if (target < left && i == 0) return centroids_[0].first;
+            if (target <= right) {
+                const double f = (target - left) / (right - left);
+                return centroids_[i].first
+                    + f * (centroids_[i + 1].first - centroids_[i].first);
+            }
+            cum += centroids_[i].second;
+        }
+        return centroids_.back().first;
+    }
+
+    // mean of the weight between the quantiles lo and hi
+    double TrimmedMean(double lo, double hi) {
+        Compress();
+        const double total = TotalWeight();
+        const double wlo = lo * total, whi = hi * total;
+        double cum = 0., sum = 0., wsum = 0.;
+        for (const auto &c : centroids_) {
+            const double in = std::min(cum + c.second, whi) - std::max(cum, wlo);
+            if (in > 0.) {
+                sum += in * c.first;
+                wsum += in;
+            }
+            cum += c.second;
+        }
+        return wsum > 0. ? sum / wsum : std::nan("");
+    }
+
+    // flat representation: n, means, weights
+    void Serialize(std::vector<double> &out) {
+        Compress();
+        out.push_back(centroids_.size());
+        for (const auto &c : centroids_) out.push_back(c.first);
+        for (const auto &c : centroids_) out.push_back(c.second);
+    }
+
+    std::size_t Deserialize(const std::vector<double> &in, std::size_t pos) {
+        const std::size_t n = in[pos];
+        for (std::size_t i = 0; i < n; ++i)
+            buffer_.emplace_back(in[pos + 1 + i], in[pos + 1 + n + i]);
+        Compress();
+        return pos + 1 + 2 * n;
+    }
+
+private:
+    double K1(double q) const {
+        return compression_ / (2. * M_PI) * std::asin(2. * q - 1.);
+    }
+
+    void Compress() {
+        if (buffer_.empty()) return;
+        for (const auto &c : centroids_) buffer_.push_back(c);
+        std::sort(buffer_.begin(), buffer_.end());
+
+        double total = 0.;
+        for (const auto &c : buffer_) total += c.second;
+
+        std::vector<std::pair<double, double>> merged;
+        merged.push_back(buffer_[0]);
+        double cum = 0.;
+        for (std::size_t i = 1; i < buffer_.size(); ++i) {
+            auto &last = merged.back();
+            const double w = last.second + buffer_[i].second;
+            // a centroid may span one unit of the k1 scale function
+            if (K1(std::min((cum + w) / total, 1.)) - K1(cum / total) <= 1.) {
+                last.first += (buffer_[i].first - last.first)
+                    * buffer_[i].second / w;
+                last.second = w;
+            } else {
+                cum += last.second;
+                merged.push_back(buffer_[i]);
+            }
+        }
+
+        centroids_.swap(merged);
+        buffer_.clear();
+    }
+
+    double compression_;
+    std::vector<std::pair<double, double>> centroids_;
+    std::vector<std::pair<double, double>> buffer_;
+};
+
+// One digest per bin of the pileup axis.
+class SketchSet {
+public:
+    SketchSet(int nbins = 1, double lo = 0., double hi = 1.,
+              double compression = 100.)
+        : nbins_(nbins), lo_(lo), hi_(hi), compression_(compression),
+          digests_(nbins, TDigest(compression)) {}
+
+    void Fill(double pu, double x, double w) {
+        if (pu < lo_ || pu >= hi_) return;
+        digests_[int((pu - lo_) / (hi_ - lo_) * nbins_)].Add(x, w);
+    }
+
+    void Merge(const SketchSet &other) {
+        for (int i = 0; i < nbins_; ++i) digests_[i].Merge(other.digests_[i]);
+    }
+
+    int GetNbins() const { return nbins_; }
+    double GetBinCenter(int i) const {
+        return lo_ + (i + 0.5) * (hi_ - lo_) / nbins_;
+    }
+    TDigest &GetDigest(int i) { return digests_[i]; }
+
+    std::vector<double> Serialize() {
+        std::vector<double> out{double(nbins_), lo_, hi_, compression_};
+        for (auto &d : digests_) d.Serialize(out);
+        return out;
+    }
+
+    static SketchSet Deserialize(const std::vector<double> &in) {
+        SketchSet s(int(in[0]), in[1], in[2], in[3]);
+        std::size_t pos = 4;
+        for (auto &d : s.digests_) pos = d.Deserialize(in, pos);
+        return s;
+    }
+
+private:
+    int nbins_;
+    double lo_, hi_, compression_;
+    std::vector<TDigest> digests_;
+};
+
+// RDataFrame action filling a SketchSet per processing slot, merged at the
+// end of the event loop.
+class SketchHelper
+    : public ROOT::Detail::RDF::RActionImpl<SketchHelper> {
+public:
+    using Result_t = SketchSet;
+
+    SketchHelper(int nbins, double lo, double hi, double compression)
+        : result_(std::make_shared<SketchSet>(nbins, lo, hi, compression)) {
+        const auto nslots = ROOT::IsImplicitMTEnabled()
+            ? ROOT::GetThreadPoolSize() : 1;
+        for (unsigned int i = 0; i < nslots; ++i)
+            slots_.emplace_back(nbins, lo, hi, compression);
+    }
+    SketchHelper(SketchHelper &&) = default;
+    SketchHelper(const SketchHelper &) = delete;
+
+    std::shared_ptr<SketchSet> GetResultPtr() const { return result_; }
+    void Initialize() {}
+    void InitTask(TTreeReader *, unsigned int) {}
+
+    template <typename P, typename X, typename W>
+    void Exec(unsigned int slot, P pu, X x, W w) {
+        slots_[slot].Fill(pu, x, w);
+    }
+
+    void Finalize() {
+        for (auto &s : slots_) result_->Merge(s);
+    }
+
+    std::string GetActionName() { return "QuantileSketch"; }
+
+private:
+    std::shared_ptr<SketchSet> result_;
+    std::vector<SketchSet> slots_;
+};
+
+template <typename P, typename X, typename W>
+ROOT::RDF::RResultPtr<SketchSet> BookSketch(
+    ROOT::RDF::RNode df, const std::string &pu, const std::string &x,
+    const std::string &w, int nbins, double lo, double hi, double compression)
+{
+    return df.Book<P, X, W>(
+        SketchHelper(nbins, lo, hi, compression), {pu, x, w}
+    );
+}
+
+// storage of sketches in ROOT files
+inline TVectorD SketchToTVector(SketchSet &s)
+{
+    const auto flat = s.Serialize();
+    return TVectorD(flat.size(), flat.data());
+}
+
+inline SketchSet SketchFromTVector(const TVectorD &v)
+{
+    const double *data = v.GetMatrixArray();
+    return SketchSet::Deserialize(
+        std::vector<double>(data, data + v.GetNrows())
+    );
+}
+
+#endif
@@ -0,0 +1,74 @@
+#ifndef XYCORR_XYCORRECTION_H
+#define XYCORR_XYCORRECTION_H
+
+#include <cmath>
+#include <vector>
+#include <stdexcept>
+
+#include "ROOT/RVec.hxx"
+
+// Evaluates all variations of the MET xy correction of one met type in a
+// single call. Each parameter set holds the ten parameters of the formula
+// in convert2json.formula_expressions:
+// [m_x, c_x, m_y, c_y, m_x_stat, c_x_stat, corr_x, m_y_stat, c_y_stat, corr_y]
+//
+// The output contains corrected (pt, phi) pairs in the order
+// nominal, stat_xup, stat_xdn, stat_yup, stat_ydn and then the nominal
+// corrections of the additional parameter sets (e.g. pu_up, pu_dn).
+class XYCorrection {
+public:
+    XYCorrection(const std::vector<double> &params) : params_(params) {
+        if (params_.empty() || params_.size() % 10 != 0) {
+            throw std::invalid_argument(
+                "XYCorrection needs a multiple of ten parameters.");
+        }
+        nsets_ = params_.size() / 10;
+    }
+
+    std::size_t size() const { return 10 + 2 * (nsets_ - 1); }
+
+    // x and y components of the uncorrected met
+    ROOT::RVecD operator()(double x, double y, double npv) const {
+        ROOT::RVecD out(size());
+        const double *p = params_.data();
+
+        // linear shifts of the nominal parameters, shared by stat variations
+        const double cx = x - (p[0] * npv + p[1]);
+        const double cy = y - (p[2] * npv + p[3]);
+        const double sx = std::sqrt(
+            std::pow(cx * p[4], 2) + std::pow(p[5], 2)
+            + 2 * cx * p[4] * p[5] * p[6]);
+        const double sy = std::sqrt(
+            std::pow(cy * p[7], 2) + std::pow(p[8], 2)
+            + 2 * cy * p[7] * p[8] * p[9]);
+
+        Fill(out, 0, cx, cy);
+        Fill(out, 2, cx + sx, cy);
+        Fill(out, 4, cx - sx, cy);
+        Fill(out, 6, cx, cy + sy);
+        Fill(out, 8, cx, cy - sy);
+
+        for (std::size_t s = 1; s < nsets_; s++) {
+            const double *q = p + 10 * s;
+            Fill(out, 8 + 2 * s, x - (q[0] * npv + q[1]), y - (q[2] * npv + q[3]));
+        }
+
+        return out;
+    }
+
+    // same for met given in polar coordinates, e.g. directly from NanoAOD
+    ROOT::RVecD EvalPtPhi(double pt, double phi, double npv) const {
+        return (*this)(pt * std::cos(phi), pt * std::sin(phi), npv);
+    }
+
+private:
+    static void Fill(ROOT::RVecD &out, std::size_t i, double cx, double cy) {
+        out[i] = std::sqrt(std::pow(cx, 2) + std::pow(cy, 2));
+        out[i + 1] = std::atan2(cy, cx);
+    }
+
+    std::vector<double> params_;
+    std::size_t nsets_;
+};
+
+#endif
@@ -0,0 +1,267 @@
+import ROOT
+import os
+import json
+import logging
+import numpy as np
+from glob import glob
+from multiprocessing import Pool
+
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.backends as backends
+from python.tools.snapshot_io import remove_manifest, snapshot_options
+
+logger = logging.getLogger(__name__)
+
+# event keys of the index, sorted within each run
+key_dtype = [('lumi', 'u4'), ('event', 'u8'), ('entry', 'u8')]
+
+_declared = []
+
+
+def get_index_dir(snap_dir_dtmc):
+    return f'{snap_dir_dtmc}index/'
+
+
+def write_index(path, index_dir, target=None):
+    '''
+    Write the sorted event keys of a snapshot, sharded by run, to
+    {index_dir}run_{run}/{name}.npy. Older shards of the file are removed.
+
+    Args:
+    path (str): snapshot file.
+    index_dir (str): directory of the index.
+    target (str): final path of the snapshot, if it is indexed on scratch
+        before it is published.
+
+    Returns:
+    int: number of indexed events.
+    '''
+    target = target or path
+    name = os.path.basename(target).replace('.root', '')
+
+    for old in glob(f'{index_dir}run_*/{name}.npy'):
+        os.remove(old)
+
+    # the entry in the file is read explicitly, neither the order of
+    # AsNumpy nor rdfentry_ follow the file with implicit MT
+    rdf = backends.define_entry(
+        ROOT.RDataFrame("Events", path), "xycorr_entry"
+    )
+    cols = rdf.AsNumpy(["run", "luminosityBlock", "event", "xycorr_entry"])
+
+    for run in np.unique(cols['run']):
+        sel = cols['run'] == run
+        keys = np.empty(sel.sum(), dtype=key_dtype)
+        keys['lumi'] = cols['luminosityBlock'][sel]
+        keys['event'] = cols['event'][sel]
+        keys['entry'] = cols['xycorr_entry'][sel]
+        keys.sort(order=['lumi', 'event'])
+
+        os.makedirs(f'{index_dir}run_{run}/', exist_ok=True)
+        np.save(f'{index_dir}run_{run}/{name}.npy', keys)
+
+    # marker for files that are indexed
+    os.makedirs(f'{index_dir}files/', exist_ok=True)
+    with open(f'{index_dir}files/{name}.json', 'w') as f:
+        json.dump({'file': target, 'entries': len(cols['run'])}, f)
+
+    return len(cols['run'])
+
+
+def index_wrapper(args):
+    return write_index(*args)
+
+
+def find_duplicates(run_dir):
+    '''
+    Find events that appear more than once in the snapshots of one run.
+    The first occurrence in the order of the file names is kept.
+
+    Args:
+    run_dir (str): index directory of one run.
+
+    Returns:
+    dict: keys (run, luminosityBlock, event, entry) to drop per file name.
+    '''
+    run = int(os.path.basename(os.path.dirname(run_dir)).replace('run_', ''))
+    shards = sorted(glob(f'{run_dir}*.npy'))
+    names = [os.path.basename(s).replace('.npy', '') for s in shards]
+
+    keys = [np.load(s) for s in shards]
+    source = np.concatenate(
+        [np.full(len(k), i, dtype=np.int32) for i, k in enumerate(keys)]
+    )
+    keys = np.concatenate(keys)
+
+    # stable sort by key, then by file
+    order = np.lexsort((source, keys['event'], keys['lumi']))
+    keys = keys[order]
+    source = source[order]
+
+    dup = np.zeros(len(keys), dtype=bool)
+    dup[1:] = (keys['lumi'][1:] == keys['lumi'][:-1])\
+        & (keys['event'][1:] == keys['event'][:-1])
+
+    drops = {}
+    for i in np.unique(source[dup]):
+        k = keys[dup & (source == i)]
+        drops[names[i]] = [
+            (run, lumi, event, entry) for lumi, event, entry in zip(
+                k['lumi'].tolist(), k['event'].tolist(), k['entry'].tolist()
+            )
+        ]
+
+    return drops
+
+
+def drop_entries(args):
+    '''
+    Rewrite a snapshot without the given events and update its index. The
+    keys of the removed events are checked against the expected ones.
+
+    Args:
+    args (tuple): (snapshot file, keys (run, luminosityBlock, event,
+        entry) of the events to drop, index directory).
+
+    Returns:
+    int: number of dropped events.
+    '''
+    path, keys, index_dir = args
+    name = os.path.basename(path).replace('.root', '')
+
+    if not _declared:
+        backends.declare(
+            'std::map<std::string, std::vector<ULong64_t>> xycorr_dedup_drops;'
+        )
+        _declared.append(True)
+
+    drops = ROOT.std.vector['ULong64_t']()
+    for e in sorted(k[3] for k in keys):
+        drops.push_back(e)
+    ROOT.xycorr_dedup_drops[name] = drops
+
+    rdf = ROOT.RDataFrame("Events", path)
+    columns = list(rdf.GetColumnNames())
+    rdf = backends.define_entry(rdf, "xycorr_entry")
+
+    dropped = f'std::binary_search(xycorr_dedup_drops["{name}"].begin(), '\
+        f'xycorr_dedup_drops["{name}"].end(), xycorr_entry)'
+    removed = rdf.Filter(dropped).AsNumpy(
+        ["run", "luminosityBlock", "event"], lazy=True
+    )
+
+    # outside of the file_*.root pattern of the snapshots, so that leftovers
+    # of interrupted runs are never read as snapshots
+    tmp_path = os.path.join(
+        os.path.dirname(path), f'.tmp_{os.path.basename(path)}'
+    )
+    rdf.Filter(f'!{dropped}').Snapshot(
+        "Events", tmp_path, columns, snapshot_options()
+    )
+
+    removed = removed.GetValue()
+    found = sorted(zip(
+        removed['run'].tolist(), removed['luminosityBlock'].tolist(),
+        removed['event'].tolist()
+    ))
+    expected = sorted(k[:3] for k in keys)
+    if found != expected:
+        os.remove(tmp_path)
+        raise RuntimeError(
+            f"Removed {len(found)} events from {path} that differ from the "
+            f"{len(expected)} expected duplicates. Is the index outdated?"
+        )
+
+    os.replace(tmp_path, path)
+    write_index(path, index_dir)
+
+    return len(keys)
+
+
+def init_worker():
+    # one process per file
+    resources.enable_threads(1)
+
+
+def deduplicate(snap_dir, nworkers):
+    '''
+    Remove events that appear in more than one DATA snapshot, e.g. from
+    overlapping primary datasets, based on (run, luminosityBlock, event).
+    Snapshots without index are indexed first, then each worker checks
+    the runs of its own shard for duplicates, and the affected files are
+    rewritten.
+
+    Args:
+    snap_dir (str): Directory of snapshots.
+    nworkers (int): Number of worker processes.
+
+    Returns:
+    dict: number of duplicates per run.
+    '''
+    snap_dir_dtmc = os.path.join(snap_dir, 'DATA', '')
+    index_dir = get_index_dir(snap_dir_dtmc)
+    files = sorted(glob(f'{snap_dir_dtmc}file_*.root'))
+
+    nworkers = max(nworkers, 1)
+    pool = Pool(nworkers, initializer=init_worker)
+
+    # index snapshots that were not indexed during their production
+    missing = [
+        (f, index_dir) for f in files
+        if not os.path.exists(
+            f"{index_dir}files/{os.path.basename(f).replace('.root', '')}.json"
+        )
+    ]
+    if missing:
+        logger.info(f"Indexing {len(missing)} DATA snapshots.")
+        pool.map(index_wrapper, missing)
+
+    nevents = 0
+    for marker in glob(f'{index_dir}files/*.json'):
+        with open(marker) as f:
+            nevents += json.load(f)['entries']
+
+    # one shard per run
+    run_dirs = sorted(glob(f'{index_dir}run_*/'))
+    logger.info(f"Searching duplicates in {len(run_dirs)} runs.")
+
+    drops = {}
+    counts = {}
+    for run_dir, run_drops in zip(
+        run_dirs, pool.imap(find_duplicates, run_dirs)
+    ):
+        run = os.path.basename(os.path.dirname(run_dir)).replace('run_', '')
+        counts[run] = sum(len(e) for e in run_drops.values())
+        for name, keys in run_drops.items():
+            drops.setdefault(name, []).extend(keys)
+
+    arguments = [
+        (f'{snap_dir_dtmc}{name}.root', keys, index_dir)
+        for name, keys in drops.items()
+    ]
+    logger.info(f"Removing duplicates from {len(arguments)} DATA snapshots.")
+    removed = sum(pool.imap_unordered(drop_entries, arguments))
+
+    pool.close()
+    pool.join()
+
+    if removed:
+        remove_manifest(snap_dir, 'DATA')
+
+    counts = {run: n for run, n in counts.items() if n > 0}
+    with open(f'{index_dir}dedup_report.json', 'w') as f:
+        json.dump(
+            {'events': nevents, 'duplicates': removed, 'runs': counts},
+            f, indent=4
+        )
+
+    profiling.update_record(
+        events_in=nevents, events_out=nevents - removed, duplicates=removed
+    )
+    logger.info(
+        f"Removed {removed} duplicate events of {nevents} DATA events "
+        f"in {len(counts)} runs. Report saved in {index_dir}dedup_report.json"
+    )
+
+    return counts
@@ -0,0 +1,219 @@
+import gzip
+import json
+import os
+import logging
+import numpy as np
+
+from python.correction.convert2json import formula_expressions
+
+logger = logging.getLogger(__name__)
+# parsed correction files per (path, modification time)
+# parsed correction files, loaded only once per process
+_loaded = {}
+
+
+def split_key(key):
+    '''
+    Split a pt_phi key of the correction into variable and variation,
+    e.g. 'phi' -> ('phi', 'nom') and 'pt_stat_xup' -> ('pt', 'stat_xup').
+    '''
+    var, _, vrt = key.partition('_')
+
+    return var, vrt if vrt else 'nom'
+
+
+def load_xy_corrections(path):
+    '''
+    Load the parameters of all xy corrections from a schemaV2 json file.
+    The formula expressions are checked against the ones used to produce
+    the file, so that the vectorised evaluation is identical to the
+    evaluation with correctionlib.
+
+    Args:
+    path (str): path to schemaV2_{year}.json(.gz).
+
+    Returns:
+    dict: {(dtmc, met_type): {'params': {pset: parameters},
+        'variations': {variation: pset}}}, where the parameter sets are
+        'nom', 'pu_up' and 'pu_dn' and the variations are 'nom',
+        'stat_xup', ..., 'pu_up', 'pu_dn'.
+    '''
+    path = os.path.abspath(path)
+    # a file rewritten by the conversion step is loaded again
+    key = (path, os.stat(path).st_mtime_ns)
+    if key in _loaded:
+        return _loaded[key]
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        cset = json.load(f)
+
+    correction = [
+        c for c in cset['corrections'] if c['name'] == 'met_xy_corrections'
+    ][0]
+
+    expressions = formula_expressions()
+
+    corrections = {}
+    for dtmc_item in correction['data']['content']:
+        dtmc = dtmc_item['key']
+        for met_item in dtmc_item['value']['content']:
+            met = met_item['key']
+            params = {}
+            variations = {}
+
+            for item in met_item['value']['content']:
+                key = item['key']
+                _, vrt = split_key(key)
+
+                # pileup variations use the expressions of the nominal key
+                base = key.replace('_pu_up', '').replace('_pu_dn', '')
+                if item['value']['expression'] != expressions[base]:
+                    raise ValueError(
+                        f"Unknown expression for {dtmc}, {met}, {key} "
+                        f"in {path}."
+                    )
+
+                # stat variations share the parameters of the nominal fit
+                pset = vrt if vrt.startswith('pu_') else 'nom'
+                params[pset] = np.array(
+                    item['value']['parameters'], dtype=np.float64
+                )
+                variations[vrt] = pset
+
+            corrections[(dtmc, met)] = {
+                'params': params,
+                'variations': variations
+            }
+
+    _loaded[key] = corrections
+    logger.debug(f"Loaded xy corrections from {path}.")
+
+    return corrections
+
+
+def apply_xy_correction(
+    cset, met_pt, met_phi, npv, met_type, dtmc, variations=None
+):
+    '''
+    Evaluate the xy correction for arrays of events. The x and y shifts are
+    computed once per parameter set and shared by all statistical
+    variations. Works with numpy and (also jagged) awkward arrays.
+
+    Args:
+    cset (str or dict): path to schemaV2_{year}.json or the output of
+        load_xy_corrections.
+    met_pt (array): uncorrected met pt.
+    met_phi (array): uncorrected met phi.
+    npv (array): number of good primary vertices.
+    met_type (str): met type, e.g. 'PuppiMET'.
+    dtmc (str): 'DATA' or 'MC'.
+    variations (list): variations to evaluate, default is all available.
+        Possible are 'nom', 'stat_xup', 'stat_xdn', 'stat_yup', 'stat_ydn'
+        and for MC 'pu_up', 'pu_dn'.
+
+    Returns:
+    dict (numpy) or record array (awkward): corrected pt and phi with the
+        same keys as the pt_phi input of the correction, e.g. 'pt',
+        'phi_stat_xup' or 'pt_pu_dn'.
+    '''
+    if isinstance(cset, str):
+        cset = load_xy_corrections(cset)
+
+    params = cset[(dtmc, met_type)]['params']
+    available = list(cset[(dtmc, met_type)]['variations'])
+
+    if variations is None:
+        variations = available
+
+    unknown = [v for v in variations if v not in available]
+    if unknown:
+        raise KeyError(
+            f"Variations {unknown} not available for {dtmc}, {met_type}. "
+            f"Choose from {available}."
+        )
+
+    met_x = met_pt * np.cos(met_phi)
+    met_y = met_pt * np.sin(met_phi)
+
+    out = {}
+    shifted = {}
+    for vrt in variations:
+        pset = cset[(dtmc, met_type)]['variations'][vrt]
+        p = params[pset]
+
+        # linear shifts, computed once per parameter set
+        if pset not in shifted:
+            shifted[pset] = (
+                met_x - (p[0] * npv + p[1]),
+                met_y - (p[2] * npv + p[3]),
+            )
+        pt_x, pt_y = shifted[pset]
+
+        # statistical variations as defined in the formula expressions
+        if vrt.startswith('stat_x'):
+            sigma = np.sqrt(
+                (pt_x * p[4])**2 + p[5]**2 + 2 * pt_x * p[4] * p[5] * p[6]
+            )
+            pt_x = pt_x + sigma if vrt.endswith('up') else pt_x - sigma
+        elif vrt.startswith('stat_y'):
+            sigma = np.sqrt(
+                (pt_y * p[7])**2 + p[8]**2 + 2 * pt_y * p[7] * p[8] * p[9]
+            )
+            pt_y = pt_y + sigma if vrt.endswith('up') else pt_y - sigma
+
+        suffix = '' if vrt == 'nom' else f'_{vrt}'
+        out[f'pt{suffix}'] = np.sqrt(pt_x**2 + pt_y**2)
+        out[f'phi{suffix}'] = np.arctan2(pt_y, pt_x)
+
+    if type(met_pt).__module__.startswith('awkward'):
+        import awkward as ak
+        return ak.zip(out)
+
+    return out
+
+
+def check_against_correctionlib(path, nevents=10000, seed=1, rtol=1e-9):
+    '''
+    Compare the vectorised evaluation with correctionlib for random events
+    and all corrections in the file.
+
+    Args:
+    path (str): path to schemaV2_{year}.json(.gz).
+    nevents (int): number of random events.
+    seed (int): random seed.
+    rtol (float): relative tolerance.
+
+    Returns:
+    float: largest absolute deviation.
+    '''
+    import correctionlib
+
+    ceval = correctionlib.CorrectionSet.from_file(path)['met_xy_corrections']
+    cset = load_xy_corrections(path)
+
+    rng = np.random.default_rng(seed)
+    met_pt = rng.exponential(30, nevents)
+    met_phi = rng.uniform(-np.pi, np.pi, nevents)
+    npv = rng.integers(0, 100, nevents).astype(np.float64)
+
+    max_diff = 0.
+    for dtmc, met in cset:
+        result = apply_xy_correction(cset, met_pt, met_phi, npv, met, dtmc)
+
+        for key, values in result.items():
+            reference = ceval.evaluate(key, met, dtmc, met_pt, met_phi, npv)
+
+            if not np.allclose(values, reference, rtol=rtol, atol=rtol):
+                raise AssertionError(
+                    f"Vectorised evaluation of {dtmc}, {met}, {key} "
+                    f"differs from correctionlib."
+                )
+            max_diff = max(max_diff, np.max(np.abs(values - reference)))
+
+    logger.info(
+        f"Vectorised evaluation agrees with correctionlib for {path}. "
+        f"Largest deviation: {max_diff:.2e}"
+    )
+
+    return max_diff
@@ -1,7 +1,17 @@
 import ROOT
 import os
+import time
 import logging
-from glob import glob
+
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.backends as backends
+from python.tools.snapshot_io import (
+    get_snapshot_files, get_friend_files, get_entries
+)
+from python.correction.sketches import (
+    book_sketches, write_sketches, get_sketch_file
+)
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +33,7 @@ def check_snapshots(snap_dir, datamc):
     all_files = 0
 
     for dtmc in datamc:
-        files = f'{snap_dir}{dtmc}/*.root'
-
-        files = glob(files)
+        files = get_snapshot_files(snap_dir, dtmc)
         all_files += len(files)
 
         for f in files:
@@ -45,7 +53,7 @@ def check_snapshots(snap_dir, datamc):
                         notrees.append(f)
                     
                     else:
-                        if tree.GetEntries() == 0:
+                        if get_entries(tree, f) == 0:
                             logger.debug(
                             f"File {f} does not contain any events."
                         )
@@ -91,8 +99,51 @@ def check_snapshots(snap_dir, datamc):
     return
 
 
+def book_hists(rdf, hbins, mets, pileups):
+    """
+    Book the 2d histograms met xy vs pileup for all pileup weight
+    variations.
+
+    rdf (ROOT.RDataFrame): dataframe with met xy, pileup and weight columns.
+    hbins (dict): Dictionary with histogram binnings.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+
+    Returns:
+    dict: lazy histograms by name.
+    """
+    hists = {}
+
+    for met in mets:
+        met_vars = [met+'_x', met+'_y']
+
+        for pu in pileups:
+
+            for variation in ["", "Up", "Dn"]:      
+                # definition of 2d histograms met_xy vs npv
+                for var in met_vars:
+                    h = rdf.Histo2D(
+                        (
+                            f'{pu}_{var}_puweight{variation}', 
+                            '', 
+                            hbins['pileup'][2], 
+                            hbins['pileup'][0], 
+                            hbins['pileup'][1], 
+                            hbins['met'][2], 
+                            hbins['met'][0], 
+                            hbins['met'][1]
+                        ),
+                        pu, var,
+                        "puWeight"+variation
+                    )
+                    hists[f'{pu}_{var}_puweight{variation}'] = h
+
+    return hists
+
+
 def make_hists(
-    snap_dir, hist_dir, hbins, jobs, mets, pileups, datamc
+    snap_dir, hist_dir, hbins, jobs, mets, pileups, datamc, estimator='mean',
+    files=None, names=None
 ):
     """
     function to make 2d histograms for xy correction
@@ -100,14 +151,23 @@ def make_hists(
     snap_dir (str): Directory of snapshots.
     hist_dir (str): Output directory for histograms.
     hbins (dict): Dictionary with histogram binnings.
-    jobs (int): Number of threads for parallel processing.
+    jobs (int): Number of implicit MT threads for parallel processing.
     mets (list): List of mets to process.
     pileups (list): List of pileup quantities to process.
     datamc (list): List of datasets to process (data / mc).
+    estimator (str): Estimator of the fits, quantile sketches are filled
+        in the same event loop for 'median' and 'trimmed'.
+    files (dict): Snapshots per dataset, default are all snapshots.
+    names (dict): Output names per dataset, default is the dataset.
     """
 
-    if jobs > 1:
-        ROOT.EnableImplicitMT(jobs)
+    resources.enable_threads(jobs)
+
+    if estimator != 'mean' and backends.is_distributed():
+        raise ValueError(
+            "Quantile sketches are not supported with distributed "
+            "RDataFrame, please use --estimator mean."
+        )
 
     for dtmc in datamc:
         n = max(jobs, 1)
@@ -117,40 +177,42 @@ def make_hists(
 
         is_data = (dtmc=='DATA')
 
-        hists = {}
-
-        rdf = ROOT.RDataFrame("Events", f"{snap_dir}/{dtmc}/file_*.root")
-
-        for met in mets:
-            met_vars = [met+'_x', met+'_y']
-
-            for pu in pileups:
-
-                for variation in ["", "Up", "Dn"]:      
-                    # definition of 2d histograms met_xy vs npv
-                    for var in met_vars:
-                        h = rdf.Histo2D(
-                            (
-                                f'{pu}_{var}_puweight{variation}', 
-                                '', 
-                                hbins['pileup'][2], 
-                                hbins['pileup'][0], 
-                                hbins['pileup'][1], 
-                                hbins['met'][2], 
-                                hbins['met'][0], 
-                                hbins['met'][1]
-                            ),
-                            pu, var,
-                            "puWeight"+variation
-                        )
-                        hists[f'{pu}_{var}_puweight{variation}'] = h
-
-        rfile = hist_dir+dtmc+'.root'
+        snapshots = files[dtmc] if files\
+            else get_snapshot_files(snap_dir, dtmc)
+        rdf = backends.make_rdf(
+            "Events", snapshots, get_friend_files(snapshots)
+        )
+        nevents = rdf.Count()
+
+        hists = book_hists(rdf, hbins, mets, pileups)
+        sketches = book_sketches(rdf, hbins, mets, pileups)\
+            if estimator != 'mean' else {}
+
+        # event loop, the rest of the wall time is neither jitting nor
+        # the loop itself (e.g. merging the per-slot results, setup)
+        before = profiling.rdf_timing()
+        start = time.perf_counter()
+        nevents = nevents.GetValue()
+        wall = time.perf_counter() - start
+        after = profiling.rdf_timing()
+
+        other = wall - (after['jit'] - before['jit'])\
+            - (after['loop'] - before['loop'])
+        profiling.add_to_record(events_in=nevents, events_out=nevents)
+        profiling.update_record(**{
+            f'other_per_slot_{dtmc}': other / max(ROOT.GetThreadPoolSize(), 1)
+        })
+
+        name = names[dtmc] if names else dtmc
+        rfile = hist_dir+name+'.root'
         hfile = ROOT.TFile(rfile, "recreate")
         for var in hists.keys():
-            hists[var].Write()
+            hists[var].GetValue().Write()
         hfile.Close()
 
+        if sketches:
+            write_sketches(sketches, get_sketch_file(hist_dir, name))
+
         logger.info(
             f"Histogram production finished for {dtmc}. Saved in {rfile}"
         )
@@ -0,0 +1,233 @@
+import os
+import json
+import logging
+from multiprocessing import Pool
+
+from python.tools.snapshot_io import get_snapshot_files
+
+logger = logging.getLogger(__name__)
+
+# name of the merged output of a stage per dataset
+outputs = {
+    'hists': '{dtmc}',
+    'validate': 'validation_{dtmc}',
+}
+
+
+def get_partial_dir(hist_dir, stage):
+    return f'{hist_dir}partial/{stage}/'
+
+
+def get_plan_path(hist_dir, stage):
+    return f'{get_partial_dir(hist_dir, stage)}plan.json'
+
+
+def split_files(files, nslices):
+    '''
+    Split files into at most nslices contiguous slices of similar length.
+    '''
+    nslices = max(min(nslices, len(files)), 1)
+    size, rest = divmod(len(files), nslices)
+
+    slices = []
+    start = 0
+    for i in range(nslices):
+        end = start + size + (1 if i < rest else 0)
+        slices.append(files[start:end])
+        start = end
+
+    return slices
+
+
+def make_plan(stage, snap_dir, hist_dir, datamc, nslices, fanin=8):
+    '''
+    Map and merge jobs of a stage. Every map job processes a slice of the
+    snapshots of one dataset and writes partial outputs, which are merged
+    in a tree with at most fanin inputs per merge job. The plan is saved,
+    so that condor jobs and the local executor process the same slices.
+
+    Args:
+    stage (str): 'hists' or 'validate'.
+    snap_dir (str): Directory of snapshots.
+    hist_dir (str): Directory of the merged outputs.
+    datamc (list): List of datasets.
+    nslices (int): Number of map jobs per dataset.
+    fanin (int): Maximum number of inputs per merge job.
+
+    Returns:
+    dict: 'maps' and 'merges' in an order that respects the dependencies.
+    '''
+    part_dir = get_partial_dir(hist_dir, stage)
+    os.makedirs(part_dir, exist_ok=True)
+    fanin = max(fanin, 2)
+
+    plan = {'stage': stage, 'maps': [], 'merges': []}
+
+    for dtmc in datamc:
+        files = get_snapshot_files(snap_dir, dtmc)
+        if not files:
+            raise RuntimeError(f"No {dtmc} snapshots found in {snap_dir}.")
+
+        # partial outputs, named without file extension
+        level = []
+        for i, fslice in enumerate(split_files(files, nslices)):
+            plan['maps'].append({
+                'dtmc': dtmc,
+                'files': fslice,
+                'output': f'{dtmc}_{i}',
+            })
+            level.append(
+                (f'{part_dir}{dtmc}_{i}', f"map_{len(plan['maps'])-1}")
+            )
+
+        depth = 0
+        while True:
+            groups = [level[i:i+fanin] for i in range(0, len(level), fanin)]
+            final = (len(groups) == 1)
+            next_level = []
+
+            for i, group in enumerate(groups):
+                # a single remaining output moves up to the next level
+                if len(group) == 1 and not final:
+                    next_level.append(group[0])
+                    continue
+
+                output = hist_dir + outputs[stage].format(dtmc=dtmc)\
+                    if final else f'{part_dir}{dtmc}_L{depth}_{i}'
+                plan['merges'].append({
+                    'dtmc': dtmc,
+                    'inputs': [key for key, _ in group],
+                    'output': output,
+                    'parents': [node for _, node in group],
+                    'final': final,
+                })
+                next_level.append(
+                    (output, f"merge_{len(plan['merges'])-1}")
+                )
+
+            if final:
+                break
+            level = next_level
+            depth += 1
+
+    with open(get_plan_path(hist_dir, stage), 'w') as f:
+        json.dump(plan, f, indent=4)
+
+    logger.info(
+        f"Planned {len(plan['maps'])} map and {len(plan['merges'])} merge "
+        f"jobs for the {stage} step."
+    )
+
+    return plan
+
+
+def read_plan(hist_dir, stage):
+    with open(get_plan_path(hist_dir, stage)) as f:
+        return json.load(f)
+
+
+def merge_root_files(inputs, output):
+    '''
+    Merge histograms of several files like hadd. The output is written
+    to a temporary file first and renamed when complete.
+    '''
+    import ROOT
+
+    tmp = f'{output}.tmp.root'
+    merger = ROOT.TFileMerger(False)
+    merger.SetPrintLevel(0)
+    merger.OutputFile(tmp, "RECREATE")
+    for f in inputs:
+        merger.AddFile(f)
+
+    if not merger.Merge():
+        raise RuntimeError(f"Merging {inputs} into {output} failed.")
+    os.replace(tmp, output)
+
+    return
+
+
+def run_merge(merge):
+    '''
+    Merge the partial outputs (histograms and quantile sketches) of the
+    parents of a merge job.
+
+    Args:
+    merge (dict): merge job of the plan.
+    '''
+    hists = [f'{key}.root' for key in merge['inputs']]
+    missing = [f for f in hists if not os.path.exists(f)]
+    if missing:
+        raise RuntimeError(f"Partial outputs {missing} are missing.")
+
+    merge_root_files(hists, f"{merge['output']}.root")
+
+    sketches = [
+        f'{key}_sketches.root' for key in merge['inputs']
+        if os.path.exists(f'{key}_sketches.root')
+    ]
+    if sketches:
+        from python.correction.sketches import merge_sketch_files
+        merge_sketch_files(sketches, f"{merge['output']}_sketches.root")
+
+    logger.info(
+        f"Merged {len(hists)} partial outputs into {merge['output']}.root"
+    )
+
+    return
+
+
+def run_map(plan, job, hist_dir, process):
+    '''
+    Run one map job of the plan.
+
+    Args:
+    plan (dict): plan of the stage.
+    job (int): index of the map job.
+    hist_dir (str): Directory of the merged outputs.
+    process (function): Called with the keywords datamc, files (per
+        dataset), hist_dir (output directory) and names (output names per
+        dataset), e.g. a functools.partial of histograms.make_hists.
+    '''
+    m = plan['maps'][job]
+    logger.info(
+        f"Map job {job}: {len(m['files'])} {m['dtmc']} snapshots "
+        f"to {m['output']}."
+    )
+    process(
+        datamc=[m['dtmc']],
+        files={m['dtmc']: m['files']},
+        hist_dir=get_partial_dir(hist_dir, plan['stage']),
+        names={m['dtmc']: m['output']}
+    )
+
+    return
+
+
+def map_wrapper(args):
+    return run_map(*args)
+
+
+def run_local(plan, hist_dir, process, nworkers):
+    '''
+    Local executor of a plan: the map jobs run in a pool of processes,
+    then the merges run in the order of the plan, like the condor DAG.
+
+    Args:
+    plan (dict): plan of the stage.
+    hist_dir (str): Directory of the merged outputs.
+    process (function): see run_map, must be picklable.
+    nworkers (int): Number of worker processes.
+    '''
+    arguments = [
+        (plan, job, hist_dir, process)
+        for job in range(len(plan['maps']))
+    ]
+
+    with Pool(max(nworkers, 1)) as pool:
+        pool.map(map_wrapper, arguments)
+
+    for merge in plan['merges']:
+        run_merge(merge)
+
+    return
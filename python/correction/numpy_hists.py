@@ -0,0 +1,184 @@
+import time
+import logging
+import numpy as np
+
+import python.tools.profiling as profiling
+from python.tools.arrow_io import get_arrow_files, iter_batches
+
+logger = logging.getLogger(__name__)
+
+
+def bin_index(values, bins):
+    '''
+    Bin numbers like TAxis::FindFixBin, 0 is underflow and nbins+1 overflow.
+    NaN goes to the overflow, like in TH1::Fill.
+    '''
+    low, high, nbins = bins
+    with np.errstate(invalid='ignore'):
+        # same order of operations as FindFixBin, so that values at the
+        # bin edges end up in the same bin
+        idx = np.floor(nbins * (values - low) / (high - low))
+    idx = np.clip(np.nan_to_num(idx, nan=nbins), -1, nbins).astype(np.int64)
+    idx = idx + 1
+    idx[values >= high] = nbins + 1
+
+    return idx
+
+
+def new_hist(xbins, ybins):
+    '''
+    Empty weighted 2d histogram with under- and overflow bins and the
+    statistics of a ROOT TH2D.
+    '''
+    shape = (ybins[2] + 2, xbins[2] + 2)
+
+    return {
+        'xbins': xbins,
+        'ybins': ybins,
+        'sumw': np.zeros(shape),
+        'sumw2': np.zeros(shape),
+        'entries': 0,
+        # tsumw, tsumw2, tsumwx, tsumwx2, tsumwy, tsumwy2, tsumwxy
+        'stats': np.zeros(7),
+    }
+
+
+def fill_hist(h, x, y, w):
+    '''
+    Fill arrays of x, y and weights into a histogram of new_hist.
+    '''
+    ix = bin_index(x, h['xbins'])
+    iy = bin_index(y, h['ybins'])
+    flat = iy * h['sumw'].shape[1] + ix
+
+    shape = h['sumw'].shape
+    h['sumw'] += np.bincount(flat, w, h['sumw'].size).reshape(shape)
+    h['sumw2'] += np.bincount(flat, w * w, h['sumw'].size).reshape(shape)
+    h['entries'] += len(x)
+    h['stats'] += range_stats(x, y, w, ix, iy, h['xbins'], h['ybins'])
+
+    return h
+
+
+def range_stats(x, y, w, ix, iy, xbins, ybins):
+    '''
+    Sums of weights and weighted moments of a TH2D (tsumw, tsumw2, tsumwx,
+    tsumwx2, tsumwy, tsumwy2, tsumwxy), only of the entries in range, like
+    ROOT.
+    '''
+    inr = (ix > 0) & (ix <= xbins[2]) & (iy > 0) & (iy <= ybins[2])
+    x, y, w = x[inr], y[inr], w[inr]
+
+    return np.array([
+        w.sum(), (w * w).sum(), (w * x).sum(), (w * x * x).sum(),
+        (w * y).sum(), (w * y * y).sum(), (w * x * y).sum()
+    ])
+
+
+def to_th2(name, h):
+    '''
+    Writable TH2D for uproot from a histogram of new_hist.
+    '''
+    from uproot.writing.identify import to_TAxis, to_TH2x
+
+    def axis(axname, bins):
+        return to_TAxis(axname, '', bins[2], bins[0], bins[1])
+
+    return to_TH2x(
+        name, '',
+        h['sumw'].ravel(),
+        h['entries'], *h['stats'],
+        h['sumw2'].ravel(),
+        axis('xaxis', h['xbins']), axis('yaxis', h['ybins'])
+    )
+
+
+def fill_hists_numpy(batches, hbins, mets, pileups):
+    '''
+    Fill the 2d histograms met xy vs pileup for all pileup weight
+    variations from batches of numpy arrays, with the same names and
+    binning as histograms.book_hists.
+
+    Args:
+    batches (iterable): dictionaries of numpy arrays by column name.
+    hbins (dict): Dictionary with histogram binnings.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+
+    Returns:
+    tuple: histograms by name and number of events.
+    '''
+    hists = {}
+    nevents = 0
+
+    for batch in batches:
+        nevents += len(batch['puWeight'])
+        for met in mets:
+            for pu in pileups:
+                npv = batch[pu].astype(np.float64)
+                for variation in ["", "Up", "Dn"]:
+                    w = batch["puWeight"+variation].astype(np.float64)
+                    for var in [met+'_x', met+'_y']:
+                        name = f'{pu}_{var}_puweight{variation}'
+                        if name not in hists:
+                            hists[name] = new_hist(
+                                hbins['pileup'], hbins['met']
+                            )
+                        fill_hist(
+                            hists[name], npv, batch[var].astype(np.float64), w
+                        )
+
+    return hists, nevents
+
+
+def write_hists(path, hists):
+    '''
+    Write histograms of new_hist as TH2D to a ROOT file with uproot.
+    '''
+    import uproot
+
+    with uproot.recreate(path) as f:
+        for name, h in hists.items():
+            f[name] = to_th2(name, h)
+
+    return
+
+
+def make_hists_numpy(snap_dir, hist_dir, hbins, mets, pileups, datamc):
+    '''
+    Same as histograms.make_hists, but reading the exported Arrow/Parquet
+    snapshots into numpy arrays, without ROOT.
+
+    snap_dir (str): Directory of snapshots.
+    hist_dir (str): Output directory for histograms.
+    hbins (dict): Dictionary with histogram binnings.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+    datamc (list): List of datasets to process (data / mc).
+    '''
+    columns = list(pileups) + ['puWeight', 'puWeightUp', 'puWeightDn']
+    for met in mets:
+        columns += [f'{met}_x', f'{met}_y']
+
+    for dtmc in datamc:
+        logger.info(f"Starting histogram production for {dtmc} with numpy.")
+
+        files = get_arrow_files(snap_dir, dtmc)
+
+        start = time.perf_counter()
+        hists, nevents = fill_hists_numpy(
+            iter_batches(files, columns), hbins, mets, pileups
+        )
+        wall = time.perf_counter() - start
+        logger.debug(f"Filled {nevents} events in {wall:.1f} s.")
+
+        profiling.add_to_record(events_in=nevents, events_out=nevents)
+
+        rfile = hist_dir+dtmc+'.root'
+        write_hists(rfile, hists)
+
+        logger.info(
+            f"Histogram production finished for {dtmc}. Saved in {rfile}"
+        )
+
+    return
@@ -0,0 +1,269 @@
+import os
+import json
+import glob
+import socket
+import struct
+import logging
+import socketserver
+from argparse import ArgumentParser
+
+import numpy as np
+
+from python.correction.evaluator import (
+    load_xy_corrections, apply_xy_correction as apply_in_process
+)
+
+logger = logging.getLogger(__name__)
+
+# open connections to evaluation services by socket path and process id,
+# so that forked workers open their own, sockets that could not be reached
+# are not tried again
+_connections = {}
+_unreachable = set()
+
+# length of the json header of a message
+header_format = '!Q'
+
+
+def default_socket():
+    '''
+    Socket of the evaluation service of this user on this node, can be set
+    with XYCORR_SOCKET.
+    '''
+    return os.environ.get(
+        'XYCORR_SOCKET', f'/tmp/xycorr_{os.getuid()}.sock'
+    )
+
+
+def recv_exact(conn, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = conn.recv_into(view[pos:])
+        if n == 0:
+            raise ConnectionError("Connection closed by the peer.")
+        pos += n
+
+    return buf
+
+
+def send_message(conn, header, arrays=()):
+    '''
+    Send a json header followed by float64 arrays of equal length.
+    '''
+    payload = json.dumps(header).encode()
+    conn.sendall(struct.pack(header_format, len(payload)) + payload)
+    for a in arrays:
+        conn.sendall(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+
+    return
+
+
+def recv_message(conn, narrays_key='keys'):
+    '''
+    Receive a message of send_message. The header gives the number of
+    entries 'n' and the names of the arrays under narrays_key.
+
+    Returns:
+    tuple: header and dict of arrays by name.
+    '''
+    size = struct.unpack(
+        header_format, recv_exact(conn, struct.calcsize(header_format))
+    )[0]
+    header = json.loads(recv_exact(conn, size).decode())
+
+    arrays = {}
+    for name in header.get(narrays_key, []):
+        arrays[name] = np.frombuffer(
+            recv_exact(conn, 8 * header['n']), dtype=np.float64
+        )
+
+    return header, arrays
+
+
+class EvaluationHandler(socketserver.BaseRequestHandler):
+    '''
+    Evaluate batches of a client until it disconnects.
+    '''
+    def handle(self):
+        while True:
+            try:
+                header, arrays = recv_message(self.request, 'inputs')
+            except ConnectionError:
+                return
+
+            try:
+                out = apply_in_process(
+                    self.server.get_corrections(header['path']),
+                    arrays['met_pt'], arrays['met_phi'], arrays['npv'],
+                    header['met_type'], header['dtmc'], header['variations']
+                )
+            except (KeyError, ValueError, OSError) as e:
+                send_message(self.request, {
+                    'error': str(e), 'type': type(e).__name__
+                })
+                continue
+
+            send_message(
+                self.request,
+                {'n': header['n'], 'keys': list(out)},
+                list(out.values())
+            )
+
+
+class EvaluationServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_corrections(self, path):
+        # files that were not preloaded are loaded on first request
+        return load_xy_corrections(path)
+
+
+def serve(paths, socket_path=None):
+    '''
+    Load the xy corrections of all given files once and evaluate batches
+    of downstream jobs on this node via a Unix socket until interrupted.
+
+    Args:
+    paths (list): schemaV2_{year}.json files or glob patterns.
+    socket_path (str): socket of the service, default see default_socket.
+    '''
+    socket_path = socket_path or default_socket()
+
+    for pattern in paths:
+        for path in glob.glob(pattern):
+            load_xy_corrections(path)
+            logger.info(f"Loaded xy corrections from {path}.")
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    with EvaluationServer(socket_path, EvaluationHandler) as server:
+        os.chmod(socket_path, 0o600)
+        logger.info(f"Evaluation service listening on {socket_path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+    return
+
+
+def get_connection(socket_path):
+    '''
+    Connection of this process to the service, None if it is not running.
+    '''
+    key = (socket_path, os.getpid())
+    if key in _connections:
+        return _connections[key]
+    if socket_path in _unreachable:
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        _unreachable.add(socket_path)
+        logger.info(
+            f"No evaluation service at {socket_path}, evaluating in process."
+        )
+        return None
+
+    _connections[key] = conn
+
+    return conn
+
+
+def apply_xy_correction(
+    path, met_pt, met_phi, npv, met_type, dtmc, variations=None,
+    socket_path=None
+):
+    '''
+    Evaluate the xy correction via the evaluation service of this node.
+    Same arguments and results as evaluator.apply_xy_correction for numpy
+    arrays. Without a running service, and for awkward arrays, the
+    correction is evaluated in this process.
+
+    Args:
+    path (str): path to schemaV2_{year}.json.
+    met_pt, met_phi, npv (array): met pt, met phi and number of good
+        primary vertices.
+    met_type (str): met type, e.g. 'PuppiMET'.
+    dtmc (str): 'DATA' or 'MC'.
+    variations (list): variations to evaluate, default is all available.
+    socket_path (str): socket of the service, default see default_socket.
+
+    Returns:
+    dict: corrected pt and phi by key, e.g. 'pt' or 'phi_stat_xup'.
+    '''
+    socket_path = socket_path or default_socket()
+    conn = get_connection(socket_path)
+
+    if conn is None or type(met_pt).__module__.startswith('awkward'):
+        return apply_in_process(
+            path, met_pt, met_phi, npv, met_type, dtmc, variations
+        )
+
+    inputs = [np.asarray(a, dtype=np.float64) for a in (met_pt, met_phi, npv)]
+    try:
+        send_message(conn, {
+            'path': os.path.abspath(path),
+            'met_type': met_type,
+            'dtmc': dtmc,
+            'variations': variations,
+            'n': len(inputs[0]),
+            'inputs': ['met_pt', 'met_phi', 'npv'],
+        }, inputs)
+        header, out = recv_message(conn)
+    except OSError:
+        # the service went away, continue without it
+        logger.warning(
+            f"Lost the evaluation service at {socket_path}, evaluating in "
+            "process."
+        )
+        conn.close()
+        del _connections[(socket_path, os.getpid())]
+        _unreachable.add(socket_path)
+        return apply_in_process(
+            path, met_pt, met_phi, npv, met_type, dtmc, variations
+        )
+
+    if 'error' in header:
+        errors = {
+            'KeyError': KeyError, 'ValueError': ValueError,
+            'FileNotFoundError': FileNotFoundError,
+        }
+        raise errors.get(header['type'], RuntimeError)(header['error'])
+
+    return out
+
+
+def main():
+    parser = ArgumentParser(
+        description="Evaluation service of the xy corrections for the "
+        "jobs on this node."
+    )
+    parser.add_argument(
+        "json", nargs='+',
+        help="schemaV2_{year}.json files or glob patterns to preload"
+    )
+    parser.add_argument(
+        "--socket", default=None,
+        help=f"Socket of the service, default is {default_socket()}"
+    )
+    args = parser.parse_args()
+
+    from python.tools.logger_setup import setup_logger
+    setup_logger('service.log')
+
+    serve(args.json, args.socket)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
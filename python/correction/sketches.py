@@ -0,0 +1,200 @@
+import os
+import logging
+
+import python.tools.backends as backends
+
+logger = logging.getLogger(__name__)
+
+header = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cpp', 'QuantileSketch.h'
+)
+
+_declared = []
+
+# estimators of the met xy per pileup bin for the fits
+estimators = ['mean', 'median', 'trimmed']
+
+
+def declare_sketches():
+    '''
+    Declare the quantile sketches in the interpreter, only once.
+    '''
+    if not _declared:
+        with open(header) as f:
+            backends.declare(f.read())
+        _declared.append(header)
+
+    return
+
+
+def get_sketch_file(hist_dir, dtmc):
+    return f'{hist_dir}{dtmc}_sketches.root'
+
+
+def book_sketches(rdf, hbins, mets, pileups, compression=100.):
+    """
+    Book quantile sketches (t-digests) of met xy per pileup bin for all
+    pileup weight variations, filled in the same event loop as the
+    histograms and merged over the processing slots. Each sketch keeps
+    about compression centroids per pileup bin, independent of the number
+    of events.
+
+    rdf (ROOT.RDataFrame): dataframe with met xy, pileup and weight columns.
+    hbins (dict): Dictionary with histogram binnings.
+    mets (list): List of mets to process.
+    pileups (list): List of pileup quantities to process.
+    compression (float): Accuracy of the sketches.
+
+    Returns:
+    dict: lazy sketches by name, named like the histograms.
+    """
+    import ROOT
+
+    declare_sketches()
+    node = ROOT.RDF.AsRNode(rdf)
+
+    sketches = {}
+    for met in mets:
+        for pu in pileups:
+            for variation in ["", "Up", "Dn"]:
+                for var in [met+'_x', met+'_y']:
+                    weight = "puWeight"+variation
+                    types = [rdf.GetColumnType(c) for c in [pu, var, weight]]
+                    sketches[f'{pu}_{var}_puweight{variation}'] = \
+                        ROOT.BookSketch[tuple(types)](
+                            node, pu, var, weight,
+                            hbins['pileup'][2],
+                            hbins['pileup'][0],
+                            hbins['pileup'][1],
+                            compression
+                        )
+
+    return sketches
+
+
+def serialize(sketches):
+    '''
+    Sketches as lists of floats, e.g. to return them from pool workers.
+    '''
+    return {name: list(s.Serialize()) for name, s in sketches.items()}
+
+
+def merge_serialized(parts, merged=None):
+    '''
+    Merge serialized sketches of several files or jobs.
+
+    Args:
+    parts (list): dicts of serialized sketches by name.
+    merged (dict): sketches to merge into, e.g. of earlier files.
+
+    Returns:
+    dict: merged sketches by name.
+    '''
+    import ROOT
+
+    declare_sketches()
+
+    merged = {} if merged is None else merged
+    for part in parts:
+        for name, flat in part.items():
+            s = ROOT.SketchSet.Deserialize(ROOT.std.vector['double'](flat))
+            if name in merged:
+                merged[name].Merge(s)
+            else:
+                merged[name] = s
+
+    return merged
+
+
+def write_sketches(sketches, path):
+    '''
+    Write sketches to a ROOT file, one TVectorD per sketch.
+
+    Args:
+    sketches (dict): sketches (or lazy results) by name.
+    path (str): output file.
+    '''
+    import ROOT
+
+    tf = ROOT.TFile(path, "recreate")
+    for name, s in sketches.items():
+        if hasattr(s, 'GetValue'):
+            s = s.GetValue()
+        ROOT.SketchToTVector(s).Write(name)
+    tf.Close()
+
+    logger.info(f"Quantile sketches saved in {path}")
+
+    return
+
+
+def merge_sketch_files(inputs, output):
+    '''
+    Merge the sketches of several files, e.g. partial outputs of condor
+    jobs, into one file.
+    '''
+    import ROOT
+
+    declare_sketches()
+
+    merged = {}
+    for path in inputs:
+        tf = ROOT.TFile(path, "READ")
+        for key in tf.GetListOfKeys():
+            s = ROOT.SketchFromTVector(key.ReadObj())
+            if key.GetName() in merged:
+                merged[key.GetName()].Merge(s)
+            else:
+                merged[key.GetName()] = s
+        tf.Close()
+
+    tmp = f'{output}.tmp.root'
+    write_sketches(merged, tmp)
+    os.replace(tmp, output)
+
+    return
+
+
+def read_sketch(path, name):
+    import ROOT
+
+    declare_sketches()
+
+    tf = ROOT.TFile(path, "READ")
+    v = tf.Get(name)
+    if not v:
+        tf.Close()
+        raise RuntimeError(
+            f"Sketch {name} not found in {path}. The histograms have to be "
+            "produced with the same --estimator."
+        )
+    s = ROOT.SketchFromTVector(v)
+    tf.Close()
+
+    return s
+
+
+def estimate(sketch, estimator, trim=0.1):
+    '''
+    Median or trimmed mean of each pileup bin of a sketch.
+
+    Args:
+    sketch (ROOT.SketchSet): sketch of one met component.
+    estimator (str): 'median' or 'trimmed'.
+    trim (float): fraction removed on each side for the trimmed mean.
+
+    Returns:
+    list: (bin center, estimate, sum of weights) per pileup bin.
+    '''
+    values = []
+    for i in range(sketch.GetNbins()):
+        d = sketch.GetDigest(i)
+        if estimator == 'median':
+            value = d.Quantile(0.5)
+        elif estimator == 'trimmed':
+            value = d.TrimmedMean(trim, 1 - trim)
+        else:
+            raise ValueError(f"Unknown estimator {estimator}.")
+        values.append((sketch.GetBinCenter(i), value, d.TotalWeight()))
+
+    return values
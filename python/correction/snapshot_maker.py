@@ -1,18 +1,31 @@
 import ROOT
 import logging
-from multiprocessing import Pool, RLock
+from multiprocessing import RLock
 from tqdm import tqdm
 import os
+import shutil
 import correctionlib
 import json
 
 import python.tools.filters as filters
 import python.tools.condor_configurizer as condor 
-
-correctionlib.register_pyroot_binding()
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.backends as backends
+import python.correction.dedup as dedup
+import python.tools.telemetry as telemetry
+import python.tools.staging as staging
+import python.tools.resolver as resolver
+import python.tools.workers as workers
+from python.tools.snapshot_io import (
+    remove_manifest, snapshot_options, count_entries
+)
 
 logger = logging.getLogger(__name__)
 
+# pileup corrections already declared in the interpreter
+_cs_pu = {}
+
 
 def get_corrections(rdf, is_data, pu_json):
     """
@@ -36,89 +49,291 @@ def get_corrections(rdf, is_data, pu_json):
         rdf = rdf.Define("puWeightUp", "1")
         rdf = rdf.Define("puWeightDn", "1")
     else:
-        ROOT.gROOT.ProcessLine(
-            f"""
-            auto cset = correction::CorrectionSet::from_file("{pu_json}");
-            auto cs_pu = cset->at("{cname}");
-            """
-        )
+        # declare correction only once per file
+        if pu_json not in _cs_pu:
+            backends.register_correctionlib()
+            name = f'cs_pu_{len(_cs_pu)}'
+            backends.declare(
+                f"""
+                auto {name} = correction::CorrectionSet::from_file(
+                    "{pu_json}")->at("{cname}");
+                """
+            )
+            _cs_pu[pu_json] = name
+        cs_pu = _cs_pu[pu_json]
 
         rdf = rdf.Define("puWeight", 
-                         'cs_pu->evaluate({Pileup_nTrueInt, "nominal"})')
+                         f'{cs_pu}->evaluate({{Pileup_nTrueInt, "nominal"}})')
         rdf = rdf.Define("puWeightUp", 
-                         'cs_pu->evaluate({Pileup_nTrueInt, "up"})')
+                         f'{cs_pu}->evaluate({{Pileup_nTrueInt, "up"}})')
         rdf = rdf.Define("puWeightDn", 
-                         'cs_pu->evaluate({Pileup_nTrueInt, "down"})')
+                         f'{cs_pu}->evaluate({{Pileup_nTrueInt, "down"}})')
 
     return rdf
 
 
-def make_single_snapshot(
-    f, g_json, pu_json, mets, snap_dir, quants, idx, isdata
-):
+def snapshot_columns(pileups, mets):
     """
-    Creates a snapshot of filtered events and saves it to a ROOT file.
+    Columns (quantities) saved in the snapshots.
+
+    Parameters:
+    pileups (list): List of pileup variables, the first one is used as npv.
+    mets (list): List of MET types.
+
+    Returns:
+    list: column names.
+    """
+    quants = list(pileups)
+    quants += ['run', 'luminosityBlock', 'event']
+    quants += ['source_idx', 'source_entry']
+    quants += ['puWeight', 'puWeightUp', 'puWeightDn']
+    quants += ['mass_Z']
+    for met in mets:
+        quants += [f'{met}_x', f'{met}_y']
+
+    return quants
+
+
+def define_met_xy(rdf, mets):
+    """
+    Define the x and y components of the given met types.
+    """
+    for met in mets:
+        rdf = rdf.Define(f"{met}_x", f"{met}_pt * cos({met}_phi)")
+        rdf = rdf.Define(f"{met}_y", f"{met}_pt * sin({met}_phi)")
+
+    return rdf
+
+
+def define_source(rdf, idx):
+    """
+    Define the origin of each event: index of the input file in the file
+    list and entry number in that file, so that further columns can be
+    added later from the selected entries only (see augment.py). Must be
+    called before any filter, so that every entry is counted.
+
+    With implicit MT, rdfentry_ is not the entry in the input tree, see
+    backends.define_entry.
 
     Parameters:
-    f (str): Path to the input ROOT file.
+    rdf (RDataFrame): NanoAOD dataframe of a single input file.
+    idx (int): Index of the input file, not an int for distributed
+        dataframes over all files, where the origin is not known (-1).
+
+    Returns:
+    RDataFrame: dataframe with source_idx and source_entry columns.
+    """
+    if not isinstance(idx, int):
+        rdf = rdf.Define("source_idx", "-1")
+        return rdf.Define("source_entry", "static_cast<Long64_t>(-1)")
+
+    rdf = rdf.Define("source_idx", f"{idx}")
+
+    return backends.define_entry(rdf, "source_entry")
+
+
+def select_events(rdf, g_json, pu_json, mets, npv, isdata):
+    """
+    Apply the golden lumi, Z->mumu and pileup steps and define the x and y
+    components of the met types. Also books the instrumentation of the
+    selection, filled in the same event loop.
+
+    Parameters:
+    rdf (RDataFrame): NanoAOD dataframe.
     g_json (str): Path to the golden JSON file.
     pu_json (str): Path to the JSON file containing pileup corrections.
     mets (list): List of MET types (e.g., MET, PuppiMET).
-    snap_dir (str): Output snapshot directory.
-    quants (list): Quantities (columns) to save in the snapshot.
-    idx (int): Index for the output filename.
+    npv (str): Pileup variable, converted to int.
     isdata (bool): Flag indicating whether the input is data or simulation.
 
     Returns:
-    None
+    tuple: selected dataframe and dictionary of lazy results for profiling.
     """
-
-    rdf = ROOT.RDataFrame("Events", f)
-
-    logger.debug(
-        f"Processing input file {f}"
-    )
+    # instrumentation, filled in the same event loop as the outputs
+    stats = {
+        'events_in': rdf.Count(),
+        'mean_nMuon': rdf.Mean("nMuon"),
+    }
 
     # check golden lumi
     if isdata:
         rdf = filters.filter_lumi(rdf, g_json)
 
-    # check for dimuon Z resonance events
-    rdf = filters.filter_zmm(rdf)
+    # check for dimuon Z resonance events, with the muon pairs looped over
+    rdf = filters.filter_zmm(rdf, stats)
 
     # get pileup weights
     rdf = get_corrections(rdf, isdata, pu_json)
 
     # ensure the datatype is consistent
-    npv = quants[0]
     rdf = rdf.Redefine(npv, f"static_cast<int>({npv})")
 
     # definition of x and y component of met
-    for met in mets:
-        rdf = rdf.Define(f"{met}_x", f"{met}_pt * cos({met}_phi)")
-        rdf = rdf.Define(f"{met}_y", f"{met}_pt * sin({met}_phi)")
+    rdf = define_met_xy(rdf, mets)
+
+    stats['events_out'] = rdf.Count()
+
+    return rdf, stats
 
-    spath = f'{snap_dir}file_{idx}.root'
+
+def make_single_snapshot(
+    f, g_json, pu_json, mets, snap_dir, quants, idx, isdata, nevents=None
+):
+    """
+    Creates a snapshot of filtered events and saves it to a ROOT file.
+
+    Parameters:
+    f (str or list): Path to the input ROOT file, or all input files with
+        a distributed backend.
+    g_json (str): Path to the golden JSON file.
+    pu_json (str): Path to the JSON file containing pileup corrections.
+    mets (list): List of MET types (e.g., MET, PuppiMET).
+    snap_dir (str): Output snapshot directory.
+    quants (list): Quantities (columns) to save in the snapshot.
+    idx (int): Index for the output filename.
+    isdata (bool): Flag indicating whether the input is data or simulation.
+    nevents (int): Only process the first nevents entries (for autotuning).
+
+    Returns:
+    None
+    """
+
+    # the fastest available source of remote input files
+    if isinstance(f, str):
+        f = resolver.resolve(f)
+
+    if nevents is None:
+        rdf = backends.make_rdf("Events", f)
+    else:
+        # a global range keeps implicit MT usable, unlike RDataFrame.Range
+        spec = ROOT.RDF.Experimental.RDatasetSpec()
+        spec.AddSample(ROOT.RDF.Experimental.RSample("sample", "Events", f))
+        spec.WithGlobalRange(
+            ROOT.RDF.Experimental.RDatasetSpec.REntryRange(0, nevents)
+        )
+        rdf = ROOT.RDataFrame(spec)
 
     logger.debug(
-        f"The rdf contains the following columns: {rdf.GetColumnNames()}"
+        f"Processing input file {f}"
     )
+    beat = telemetry.track(rdf, f)
+
+    rdf = define_source(rdf, idx)
+    rdf, stats = select_events(rdf, g_json, pu_json, mets, quants[0], isdata)
+
+    # distributed snapshots write one file per partition, file_{idx}_{i}
+    spath = f'{snap_dir}file_{idx}.root'
+
     logger.debug(
-        f'Mean pileup weight" {rdf.Mean("puWeight").GetValue()}'
+        f"The rdf contains the following columns: {rdf.GetColumnNames()}"
     )
+    mean_puweight = rdf.Mean("puWeight")
 
-    rdf.Snapshot("Events", spath, quants)
+    # written to scratch first and published when complete, distributed
+    # workers write directly
+    staged = nevents is None and not backends.is_distributed()
+    opath = staging.stage_path(spath) if staged else spath
+
+    rdf.Snapshot("Events", opath, quants, snapshot_options())
+    telemetry.finish(beat)
+
+    logger.debug(f'Mean pileup weight: {mean_puweight.GetValue()}')
+    profiling.update_record(**{k: v.GetValue() for k, v in stats.items()})
+
+    if staged:
+        # event keys for the removal of duplicates across datasets
+        if isdata:
+            dedup.write_index(opath, dedup.get_index_dir(snap_dir), spath)
+
+        staging.publish(
+            opath, spath,
+            count_entries([opath]), stats['events_out'].GetValue()
+        )
 
     return
 
 
 def job_wrapper(args):
-    return make_single_snapshot(*args)
+    with profiling.profile_stage('snapshot_file', partial=True, file=args[0]):
+        return make_single_snapshot(*args)
+
+
+def init_worker(lock, threads):
+    """
+    Initialize a snapshot worker process.
+
+    Parameters:
+    lock (RLock): Lock shared by the tqdm progress bars.
+    threads (int): Number of implicit MT threads of this worker.
+    """
+    tqdm.set_lock(lock)
+    resources.enable_threads(threads)
+
+
+def run_pool(arguments, nworkers, threads, desc="Total progess"):
+    """
+    Process snapshot arguments with a pool of worker processes.
+
+    Parameters:
+    arguments (list): Argument tuples for make_single_snapshot.
+    nworkers (int): Number of worker processes.
+    threads (int): Number of implicit MT threads per worker.
+    desc (str): Description of the progress bar.
+    """
+    # workers are recycled when they reach their task or memory limit
+    for _ in tqdm(
+        workers.imap_unordered(
+            job_wrapper, arguments, nworkers,
+            initializer=init_worker, initargs=(RLock(), threads)
+        ),
+        total=len(arguments),
+        desc=desc,
+        dynamic_ncols=True,
+        leave=True
+    ): 
+        pass
+
+    return
+
+
+def autotune_snapshot(arguments, tmp_dir, ncpu, tune_file, nevents=20000):
+    """
+    Find the best split of workers and threads for the snapshot production
+    by processing the first nevents of a few input files per split.
+
+    Parameters:
+    arguments (list): Argument tuples for make_single_snapshot.
+    tmp_dir (str): Temporary output directory of the test snapshots.
+    ncpu (int): Number of available cpus.
+    tune_file (str): Cache file for the autotune result.
+    nevents (int): Number of events processed per worker.
+
+    Returns:
+    tuple: (workers, threads)
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    def run(nworkers, threads):
+        test_args = []
+        for i in range(nworkers):
+            f, g_json, pu_json, mets, _, quants, _, isdata = \
+                arguments[i % len(arguments)]
+            test_args.append(
+                (f, g_json, pu_json, mets, tmp_dir, quants, i, isdata, nevents)
+            )
+        run_pool(test_args, nworkers, threads, desc="Autotune")
+        return nworkers * nevents
+
+    workers, threads = resources.autotune(run, ncpu, tune_file)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return workers, threads
 
 
 def make_snapshot(
     file_path, g_json, pu_json, mets, pileups, snap_dir, 
-    nthreads, condor_no, condor_dir, datamc, year, proxy_path
+    nthreads, condor_no, condor_dir, datamc, year, proxy_path,
+    threads=1, tune_file=None, condor_args=''
 ):
     '''
     Creates ntuples using input data and applies the necessary filters
@@ -131,11 +346,16 @@ def make_snapshot(
         mets (list): List of MET types.
         pileups (list): List of pileup variables.
         snap_dir (str): Output directory for snapshots.
-        nthreads (int): Number of threads for multiprocessing.
+        nthreads (int): Number of worker processes for multiprocessing.
         condor_no (int): Condor job number (-1 for local execution).
         condor_dir (str): Condor directory.
         datamc (list): List of dataset types (e.g., 'DATA', 'MC').
         year (str): Data taking epoch.
+        proxy_path (str): Path to the VOMS proxy for condor.
+        threads (int): Number of implicit MT threads per worker process.
+        tune_file (str): If given, autotune workers and threads and cache
+            the result in this file.
+        condor_args (str): Further options of the condor jobs.
     '''
     logger.info("Starting production of ntuples")
 
@@ -153,15 +373,12 @@ def make_snapshot(
         is_data = (dtmc == 'DATA')
 
         # output quantities for snapshots
-        quants = pileups
-        quants += ['puWeight', 'puWeightUp', 'puWeightDn']
-        quants += ['mass_Z']
-        for met in mets:
-            quants += [f'{met}_x', f'{met}_y']
+        quants = snapshot_columns(pileups, mets)
 
         # output directory for snapshots
         snap_dir_dtmc = snap_dir+'/'+dtmc + '/'
         os.makedirs(snap_dir_dtmc, exist_ok=True)
+        remove_manifest(snap_dir, dtmc)
 
         # arguments for running snapshot production
         arguments = [
@@ -169,42 +386,63 @@ def make_snapshot(
             for idx, f in enumerate(infiles)
         ]
 
+        if condor_no < 0 and nthreads > 0 and tune_file\
+                and not backends.is_distributed():
+            nthreads, threads = autotune_snapshot(
+                arguments,
+                f'{snap_dir_dtmc}autotune/',
+                resources.available_cpus(),
+                tune_file
+            )
+
         nthreads = min(nthreads, len(infiles))
 
-        if condor_no >= 0:
+        if backends.is_distributed() and condor_no < 0:
+            # one distributed graph over all files, written per partition
+            logger.info("Producing ntuples with distributed RDataFrame.")
+            make_single_snapshot(
+                infiles, g_json, pu_json, mets, snap_dir_dtmc, quants,
+                'dist', is_data
+            )
+            logger.info("Ntuple production finished.")
+
+        elif condor_no >= 0:
             # start single job
+            resources.enable_threads(threads)
             job_wrapper(arguments[condor_no])
+            staging.wait_published()
 
         elif nthreads==0:
             # setup condor job script
-            condor.setup_job(condor_dir, dtmc, year)
+            condor.setup_job(condor_dir, dtmc, year, threads, condor_args)
 
             # setup condor submit file
             condor.setup_condor_lxplus(
                 len(arguments),
                 condor_dir,
                 dtmc,
-                proxy_path
+                proxy_path,
+                threads
             )
 
         else:
             # setup multiprocessing
             logger.info(
-                f"Producing ntuples locally with {nthreads} threads."
-            )
-            pool = Pool(
-                nthreads,
-                initargs=(RLock,),
-                initializer=tqdm.set_lock
+                f"Producing ntuples locally with {nthreads} processes "
+                f"and {threads} threads each."
             )
-            for _ in tqdm(
-                pool.imap_unordered(job_wrapper, arguments),
-                total=len(arguments),
-                desc="Total progess",
-                dynamic_ncols=True,
-                leave=True
-            ): 
-                pass
+            run_pool(arguments, nthreads, threads)
+
+            # the last publish of a worker is only logged if it fails
+            missing = [
+                a[0] for a in arguments
+                if not os.path.exists(f'{snap_dir_dtmc}file_{a[6]}.root')
+            ]
+            if missing:
+                logger.error(
+                    f"No snapshots were published for {len(missing)} "
+                    f"input files: {missing}"
+                )
             logger.info("Ntuple production finished.")
 
     return
\ No newline at end of file
@@ -0,0 +1,235 @@
+import ROOT
+import os
+import json
+import logging
+from multiprocessing import RLock
+from tqdm import tqdm
+
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.backends as backends
+import python.tools.telemetry as telemetry
+import python.tools.resolver as resolver
+import python.tools.workers as workers
+import python.tools.staging as staging
+import python.correction.dedup as dedup
+from python.correction.snapshot_maker import (
+    select_events, snapshot_columns, define_source
+)
+from python.correction.histograms import book_hists
+from python.correction.sketches import (
+    book_sketches, serialize, merge_serialized, write_sketches,
+    get_sketch_file
+)
+from python.tools.snapshot_io import (
+    remove_manifest, snapshot_options, count_entries
+)
+
+logger = logging.getLogger(__name__)
+
+
+def stream_single_file(
+    f, g_json, pu_json, mets, pileups, hbins, isdata, snap_dir=None, idx=0,
+    sketches=False
+):
+    """
+    Apply the event selection to NanoAOD and fill the 2d histograms
+    directly, without writing snapshots.
+
+    Parameters:
+    f (str or list): Path to the input ROOT file, or all input files with
+        a distributed backend.
+    g_json (str): Path to the golden JSON file.
+    pu_json (str): Path to the JSON file containing pileup corrections.
+    mets (list): List of MET types.
+    pileups (list): List of pileup variables.
+    hbins (dict): Dictionary with histogram binnings.
+    isdata (bool): Flag indicating whether the input is data or simulation.
+    snap_dir (str): If given, snapshots are written as side output in the
+        same event loop.
+    idx (int): Index for the output filename of the snapshot.
+    sketches (bool): Also fill quantile sketches.
+
+    Returns:
+    tuple: filled histograms by name, mergeable with TH1.Add, and
+        serialized sketches by name.
+    """
+    logger.debug(f"Streaming input file {f}")
+
+    # the fastest available source of remote input files
+    if isinstance(f, str):
+        f = resolver.resolve(f)
+
+    rdf = backends.make_rdf("Events", f)
+    beat = telemetry.track(rdf, f)
+    if snap_dir:
+        rdf = define_source(rdf, idx)
+    rdf, stats = select_events(rdf, g_json, pu_json, mets, pileups[0], isdata)
+
+    hists = book_hists(rdf, hbins, mets, pileups)
+    qsketches = book_sketches(rdf, hbins, mets, pileups) if sketches else {}
+
+    # written to scratch first and published when complete, like in
+    # make_single_snapshot, distributed workers write directly
+    spath = f'{snap_dir}file_{idx}.root' if snap_dir else None
+    staged = bool(snap_dir) and not backends.is_distributed()
+    if snap_dir:
+        opath = staging.stage_path(spath) if staged else spath
+        rdf.Snapshot(
+            "Events", opath, snapshot_columns(pileups, mets),
+            snapshot_options(lazy=True)
+        )
+
+    profiling.update_record(**{k: v.GetValue() for k, v in stats.items()})
+    telemetry.finish(beat)
+
+    if staged:
+        # event keys for the removal of duplicates across datasets
+        if isdata:
+            dedup.write_index(opath, dedup.get_index_dir(snap_dir), spath)
+
+        staging.publish(
+            opath, spath,
+            count_entries([opath]), stats['events_out'].GetValue()
+        )
+
+    return (
+        {name: h.GetValue() for name, h in hists.items()},
+        serialize({name: s.GetValue() for name, s in qsketches.items()})
+    )
+
+
+def stream_wrapper(args):
+    with profiling.profile_stage('stream_file', partial=True, file=args[0]):
+        return stream_single_file(*args)
+
+
+def init_worker(lock, threads):
+    tqdm.set_lock(lock)
+    resources.enable_threads(threads)
+
+
+def merge_hists(total, partial):
+    """
+    Add partial histograms of one file to the total.
+    """
+    for name, h in partial.items():
+        if name in total:
+            total[name].Add(h)
+        else:
+            h.SetDirectory(0)
+            total[name] = h
+
+    return total
+
+
+def make_hists_streaming(
+    file_path, g_json, pu_json, mets, pileups, hbins, hist_dir,
+    nworkers, threads, datamc, snap_dir=None, estimator='mean'
+):
+    """
+    Fill the 2d histograms for the xy correction directly from NanoAOD.
+    Each worker returns the histograms of its file, which are merged in
+    memory and saved in {hist_dir}{dtmc}.root like in make_hists.
+
+    Args:
+        file_path (str): Path to the file list (JSON).
+        g_json (str): Path to golden JSON file.
+        pu_json (str): Path to pileup corrections JSON.
+        mets (list): List of MET types.
+        pileups (list): List of pileup variables.
+        hbins (dict): Dictionary with histogram binnings.
+        hist_dir (str): Output directory for histograms.
+        nworkers (int): Number of worker processes.
+        threads (int): Number of implicit MT threads per worker process.
+        datamc (list): List of dataset types (e.g., 'DATA', 'MC').
+        snap_dir (str): If given, snapshots are written as side output.
+        estimator (str): Estimator of the fits, quantile sketches are
+            filled for 'median' and 'trimmed'.
+    """
+    logger.info("Starting histogram production from NanoAOD")
+
+    if nworkers == 0 and not backends.is_distributed():
+        raise ValueError(
+            "Streaming runs locally or with a distributed backend, "
+            "please set -j."
+        )
+
+    sketches = (estimator != 'mean')
+    if sketches and backends.is_distributed():
+        raise ValueError(
+            "Quantile sketches are not supported with distributed "
+            "RDataFrame, please use --estimator mean."
+        )
+
+    with open(file_path, 'r') as f:
+        files = json.load(f)
+
+    for dtmc in datamc:
+
+        infiles = files[dtmc]
+        is_data = (dtmc == 'DATA')
+
+        snap_dir_dtmc = None
+        if snap_dir:
+            snap_dir_dtmc = snap_dir+'/'+dtmc + '/'
+            os.makedirs(snap_dir_dtmc, exist_ok=True)
+            remove_manifest(snap_dir, dtmc)
+
+        hists = {}
+        qsketches = {}
+
+        if backends.is_distributed():
+            # one graph over all files, merged by RDataFrame
+            logger.info(f"Streaming {dtmc} with distributed RDataFrame.")
+            hists = merge_hists(hists, stream_single_file(
+                infiles, g_json, pu_json, mets, pileups, hbins, is_data,
+                snap_dir_dtmc, 'dist'
+            )[0])
+
+        else:
+            nworkers = min(nworkers, len(infiles))
+            logger.info(
+                f"Streaming {dtmc} with {nworkers} processes "
+                f"and {threads} threads each."
+            )
+
+            arguments = [
+                (
+                    f, g_json, pu_json, mets, pileups, hbins, is_data,
+                    snap_dir_dtmc, idx, sketches
+                )
+                for idx, f in enumerate(infiles)
+            ]
+
+            for partial, part in tqdm(
+                workers.imap_unordered(
+                    stream_wrapper, arguments, nworkers,
+                    initializer=init_worker, initargs=(RLock(), threads)
+                ),
+                total=len(arguments),
+                desc=f"Streaming {dtmc}",
+                dynamic_ncols=True,
+                leave=True
+            ):
+                hists = merge_hists(hists, partial)
+                if sketches:
+                    qsketches = merge_serialized([part], qsketches)
+
+            # files streamed in this process
+            staging.wait_published()
+
+        rfile = hist_dir+dtmc+'.root'
+        hfile = ROOT.TFile(rfile, "recreate")
+        for var in hists.keys():
+            hists[var].Write()
+        hfile.Close()
+
+        if sketches:
+            write_sketches(qsketches, get_sketch_file(hist_dir, dtmc))
+
+        logger.info(
+            f"Histogram production finished for {dtmc}. Saved in {rfile}"
+        )
+
+    return
@@ -6,11 +6,84 @@ import glob
 import logging
 
 import python.tools.plot as plot
+import python.tools.resources as resources
+import python.tools.profiling as profiling
+import python.tools.backends as backends
+from python.tools.snapshot_io import get_snapshot_files, get_friend_files
+import python.correction.xy_functor as xy_functor
+from python.correction.evaluator import split_key
 
 logger = logging.getLogger(__name__)
 
 
-def validate_json(snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets):
+# correction files already loaded in the interpreter for correctionlib
+_cs_xy = {}
+
+
+def define_corrected_met(rdf, schemav2_json, met, dtmc, engine='functor'):
+    """
+    Define corrected pt and phi columns '{met}_{pt,phi}_corr{variation}'
+    for all variations of the correction.
+
+    Args:
+        rdf (ROOT.RDataFrame): dataframe with '{met}_x', '{met}_y' columns.
+        schemav2_json (str): path to correctionlib file.
+        met (str): met type.
+        dtmc (str): DATA or MC.
+        engine (str): 'functor' evaluates all variations in one call of
+            the compiled XYCorrection, 'correctionlib' evaluates each
+            variation separately with correctionlib.
+
+    Returns:
+        tuple: dataframe and list of the defined columns.
+    """
+    columns = []
+
+    if engine == 'functor':
+        rdf, keys = xy_functor.define_xy_corrections(
+            rdf, schemav2_json, met, dtmc
+        )
+        for i, key in enumerate(keys):
+            var, vrt = split_key(key)
+            vrt = '' if vrt == 'nom' else f'_{vrt}'
+            rdf = rdf.Define(f'{met}_{var}_corr{vrt}', f'{met}_xycorr[{i}]')
+            columns.append(f'{met}_{var}_corr{vrt}')
+
+        return rdf, columns
+
+    # declare correction only once per file
+    if schemav2_json not in _cs_xy:
+        backends.register_correctionlib()
+        name = f'cs_xy_{len(_cs_xy)}'
+        backends.declare(
+            f'auto {name} = correction::CorrectionSet::from_file(\
+            "{schemav2_json}")->at("met_xy_corrections");'
+        )
+        _cs_xy[schemav2_json] = name
+    cs_xy = _cs_xy[schemav2_json]
+
+    variations = ['', '_stat_xup', '_stat_xdn', '_stat_yup', '_stat_ydn']
+    if dtmc == 'MC':
+        variations += ['_pu_up', '_pu_dn']
+
+    for var in ['pt', 'phi']:
+        for vrt in variations:
+            rdf = rdf.Define(
+                f'{met}_{var}_corr{vrt}', 
+                f'{cs_xy}->evaluate({{\
+                    "{var}{vrt}", "{met}", "{dtmc}", \
+                    {met}_pt, {met}_phi, static_cast<float>(PV_npvsGood)\
+                }})'
+            )
+            columns.append(f'{met}_{var}_corr{vrt}')
+
+    return rdf, columns
+
+
+def validate_json(
+    snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets, nthreads=0,
+    engine='functor', files=None, names=None
+):
     """
     Create histograms for closure validation.
 
@@ -22,14 +95,32 @@ def validate_json(snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets):
         year (str): name of the year.
         bin_dict (dict): bining configuration.
         mets (list): met types to validate.
+        nthreads (int): number of implicit MT threads.
+        engine (str): evaluation of the correction, 'functor' or
+            'correctionlib'.
+        files (dict): snapshots per dataset, default are all snapshots.
+        names (dict): output names per dataset, default is
+            validation_{dtmc}.
+
+    Returns:
+        dict: number of event loops per dataset.
     """
     logger.info("Starting validation of correction.")
 
+    resources.enable_threads(nthreads)
+
     # define variations for later
     variations = ['', '_stat_xup', '_stat_xdn', '_stat_yup', '_stat_ydn']
 
     variables = ['pt', 'phi']
 
+    # the correctionlib file
+    schemav2_json = corr_dir.replace(f'{year}/', f'schemaV2_{year}.json')
+
+    # book histograms of all datasets lazily
+    rdfs = {}
+    counts = {}
+    hists = {}
     for dtmc in datamc:
 
         # in MC also define pileup variations
@@ -39,14 +130,13 @@ def validate_json(snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets):
             pu_variations = []
         
         # setup of dataframe
-        rdf = ROOT.RDataFrame("Events", f"{snap_dir}{dtmc}/file_*.root")
-
-        # loading the pileup correctionlib file
-        schemav2_json = corr_dir.replace(f'{year}/', f'schemaV2_{year}.json')
-        ROOT.gROOT.ProcessLine(
-            f'auto cs_xy = correction::CorrectionSet::from_file(\
-            "{schemav2_json}")->at("met_xy_corrections");'
+        snapshots = files[dtmc] if files\
+            else get_snapshot_files(snap_dir, dtmc)
+        rdf = backends.make_rdf(
+            "Events", snapshots, get_friend_files(snapshots)
         )
+        rdfs[dtmc] = rdf
+        counts[dtmc] = rdf.Count()
 
         # loop over different met types, calculate correction and histograms
         for met in mets:
@@ -55,22 +145,13 @@ def validate_json(snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets):
             rdf = rdf.Define(f'{met}_phi', f'atan2({met}_y, {met}_x)')
             rdf = rdf.Define(f'{met}_pt', f'sqrt({met}_y*{met}_y + {met}_x*{met}_x)')
         
-            # correct pt and phi for different variations
-            for var in variables:
-                
-                # statistical variations for both data and mc
-                for vrt in variations+pu_variations:
-
-                    rdf = rdf.Define(
-                        f'{met}_{var}_corr{vrt}', 
-                        f'cs_xy->evaluate({{\
-                            "{var}{vrt}", "{met}", "{dtmc}", \
-                            {met}_pt, {met}_phi, static_cast<float>(PV_npvsGood)\
-                        }})'
-                    )                 
+            # correct pt and phi for all variations
+            rdf, _ = define_corrected_met(
+                rdf, schemav2_json, met, dtmc, engine
+            )
 
         # create histograms for defined variables
-        hists = []
+        hists[dtmc] = []
         save_variations = ['_corr'+v for v in variations+pu_variations] + ['']
         
         for vrt in save_variations:
@@ -80,24 +161,46 @@ def validate_json(snap_dir, corr_dir, hist_dir, datamc, year, bin_dict, mets):
                     logger.debug(f'Making histogram: {met}_{var}{vrt}')
 
                     bins = bin_dict[var]
-                    hists.append(
+                    hists[dtmc].append(
                         rdf.Histo1D(
                             (f'{met}_{var}{vrt}', '', bins[2], bins[0], bins[1]),
                             f'{met}_{var}{vrt}',
                             "puWeight"
-                        ).Clone()
+                        )
                     )
 
+    # fill all histograms in one event loop per dataset, run concurrently
+    backends.run_graphs(
+        [h for dtmc in hists for h in hists[dtmc]] + list(counts.values())
+    )
+
+    for dtmc in datamc:
+
+        # the snapshots must have been read only once
+        nruns = backends.get_nruns(rdfs[dtmc])
+        logger.info(f"Validation of {dtmc} needed {nruns} event loop(s).")
+        profiling.add_to_record(
+            events_in=counts[dtmc].GetValue(),
+            events_out=counts[dtmc].GetValue()
+        )
+        if nruns > 1:
+            raise RuntimeError(
+                f"Validation of {dtmc} ran {nruns} event loops instead of "
+                "one. All histograms must be booked before the first result "
+                "is accessed."
+            )
+
         # save histograms
-        rfile = f'{hist_dir}validation_{dtmc}.root'
+        name = names[dtmc] if names else f'validation_{dtmc}'
+        rfile = f'{hist_dir}{name}.root'
 
         with ROOT.TFile(rfile, 'recreate') as f:
-            for h in hists:
-                h.Write()
+            for h in hists[dtmc]:
+                h.GetValue().Write()
 
         logger.info(f"{dtmc} histograms successfully saved at {rfile}.")
 
-    return
+    return {dtmc: backends.get_nruns(rdfs[dtmc]) for dtmc in datamc}
 
 
 def make_validation_plots(
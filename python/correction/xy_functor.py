@@ -0,0 +1,117 @@
+import os
+import zlib
+import logging
+
+from python.correction.evaluator import load_xy_corrections
+import python.tools.backends as backends
+
+logger = logging.getLogger(__name__)
+
+header = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cpp', 'XYCorrection.h'
+)
+
+# global functor instances per (correction file, modification time, dtmc,
+# met)
+_instances = {}
+_declared = []
+
+
+def declare_xy_functor():
+    '''
+    Compile the XYCorrection class, only once per process. The header is
+    declared by content, so distributed workers do not need access to it.
+    '''
+    if not _declared:
+        with open(header) as f:
+            backends.declare(f.read())
+        _declared.append(header)
+
+    return
+
+
+def functor_keys(path, met, dtmc):
+    '''
+    Keys of the correction (pt_phi input of correctionlib) in the order of
+    the XYCorrection output, e.g. ['pt', 'phi', 'pt_stat_xup', ...].
+    '''
+    params = load_xy_corrections(path)[(dtmc, met)]['params']
+
+    keys = []
+    for vrt in ['nom', 'stat_xup', 'stat_xdn', 'stat_yup', 'stat_ydn']\
+            + [p for p in params if p != 'nom']:
+        suffix = '' if vrt == 'nom' else f'_{vrt}'
+        keys += [f'pt{suffix}', f'phi{suffix}']
+
+    return keys
+
+
+def get_xy_functor(path, met, dtmc):
+    '''
+    Declare a global XYCorrection instance for one met type with the
+    parameters from the correction file.
+
+    Args:
+    path (str): path to schemaV2_{year}.json.
+    met (str): met type.
+    dtmc (str): 'DATA' or 'MC'.
+
+    Returns:
+    str: name of the C++ instance.
+    '''
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns, dtmc, met)
+
+    if key not in _instances:
+        declare_xy_functor()
+
+        params = load_xy_corrections(path)[(dtmc, met)]['params']
+        values = list(params['nom'])
+        for pset in params:
+            if pset != 'nom':
+                values += list(params[pset])
+
+        name = f'xycorr_{dtmc}_{met}_{zlib.adler32(repr(key[:2]).encode())}'
+        backends.declare(
+            f'const XYCorrection {name}'
+            f'({{{", ".join(repr(float(v)) for v in values)}}});'
+        )
+        _instances[key] = name
+        logger.debug(f"Declared xy correction functor {name}.")
+
+    return _instances[key]
+
+
+def define_xy_corrections(
+    rdf, path, met, dtmc, npv='PV_npvsGood', columns=None, polar=False
+):
+    '''
+    Define a column '{met}_xycorr' with all corrected pt and phi variations
+    of one met type, evaluated in a single call per event.
+
+    Args:
+    rdf (ROOT.RDataFrame): dataframe with the met and npv columns.
+    path (str): path to schemaV2_{year}.json.
+    met (str): met type.
+    dtmc (str): 'DATA' or 'MC'.
+    npv (str): column with the number of good primary vertices.
+    columns (tuple): met columns, default is ('{met}_x', '{met}_y').
+    polar (bool): set if the columns are pt and phi, e.g.
+        ('PuppiMET_pt', 'PuppiMET_phi') in NanoAOD.
+
+    Returns:
+    tuple: dataframe and list of keys of the entries of '{met}_xycorr'.
+    '''
+    name = get_xy_functor(path, met, dtmc)
+
+    if columns is None:
+        columns = (f'{met}_x', f'{met}_y')
+
+    method = f'{name}.EvalPtPhi' if polar else name
+
+    rdf = rdf.Define(
+        f'{met}_xycorr',
+        f'{method}({columns[0]}, {columns[1]}, {npv})'
+    )
+
+    return rdf, functor_keys(path, met, dtmc)
@@ -0,0 +1,161 @@
+import os
+import logging
+from glob import glob
+from multiprocessing import Pool
+
+from python.tools.snapshot_io import get_snapshot_files, require_ttree
+
+logger = logging.getLogger(__name__)
+
+extensions = {'feather': 'feather', 'parquet': 'parquet'}
+
+
+def get_arrow_dir(snap_dir, dtmc):
+    return os.path.join(snap_dir, dtmc, 'arrow', '')
+
+
+def convert_file(args):
+    '''
+    Convert one snapshot to Arrow IPC (feather) or Parquet in chunks.
+    Feather files are written uncompressed, so they can be memory-mapped
+    without copying. Parquet files are compressed and store min/max
+    statistics per column and row group.
+
+    Args:
+    args (tuple): (snapshot file, output file, format).
+
+    Returns:
+    int: number of converted events.
+    '''
+    import uproot
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path, out_path, fmt = args
+    tmp_path = f'{out_path}.tmp'
+
+    writer = None
+    nevents = 0
+    with uproot.open(path) as f:
+        for arrays in f['Events'].iterate(library='np', step_size='100 MB'):
+            batch = pa.record_batch(list(arrays.values()), names=list(arrays))
+
+            if writer is None:
+                if fmt == 'feather':
+                    writer = pa.ipc.new_file(tmp_path, batch.schema)
+                else:
+                    writer = pq.ParquetWriter(
+                        tmp_path, batch.schema, compression='zstd',
+                        write_statistics=True
+                    )
+
+            if fmt == 'feather':
+                writer.write_batch(batch)
+            else:
+                writer.write_table(pa.Table.from_batches([batch]))
+            nevents += batch.num_rows
+
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, out_path)
+
+    return nevents
+
+
+def export_snapshots(snap_dir, datamc, fmt='feather', nworkers=1):
+    '''
+    Convert the snapshots (or compacted snapshots) to Arrow IPC/feather or
+    Parquet files in {snap_dir}{dtmc}/arrow/, readable without ROOT.
+
+    Args:
+    snap_dir (str): Directory of snapshots.
+    datamc (list): List of dataset types (e.g., 'DATA', 'MC').
+    fmt (str): 'feather' or 'parquet'.
+    nworkers (int): Number of worker processes.
+    '''
+    require_ttree("The Arrow export is")
+
+    for dtmc in datamc:
+        files = get_snapshot_files(snap_dir, dtmc)
+        out_dir = get_arrow_dir(snap_dir, dtmc)
+        os.makedirs(out_dir, exist_ok=True)
+
+        # outputs of an earlier export in another format are removed
+        for old in glob(f'{out_dir}*'):
+            os.remove(old)
+
+        arguments = [
+            (
+                f,
+                out_dir + os.path.basename(f).replace(
+                    '.root', f'.{extensions[fmt]}'
+                ),
+                fmt
+            )
+            for f in files
+        ]
+
+        logger.info(
+            f"Exporting {len(files)} {dtmc} snapshots to {fmt} in {out_dir}"
+        )
+        with Pool(max(min(nworkers, len(arguments)), 1)) as pool:
+            nevents = sum(pool.imap_unordered(convert_file, arguments))
+
+        logger.info(f"Exported {nevents} {dtmc} events.")
+
+    return
+
+
+def get_arrow_files(snap_dir, dtmc):
+    '''
+    Exported snapshot files of a dataset, feather preferred over parquet.
+    '''
+    arrow_dir = get_arrow_dir(snap_dir, dtmc)
+
+    for ext in ['feather', 'parquet']:
+        files = sorted(glob(f'{arrow_dir}*.{ext}'))
+        if files:
+            return files
+
+    raise FileNotFoundError(
+        f"No exported snapshots in {arrow_dir}, run with --export_snapshots."
+    )
+
+
+def iter_batches(files, columns):
+    '''
+    Iterate over the exported snapshots in record batches. Feather files
+    are memory-mapped and the columns are returned as numpy views without
+    copying; parquet files are decoded batch by batch and only the
+    requested columns are read.
+
+    Args:
+    files (list): feather or parquet files.
+    columns (list): column names.
+
+    Yields:
+    dict: numpy arrays by column name.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for path in files:
+        if path.endswith('.feather'):
+            source = pa.memory_map(path, 'r')
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield {
+                    c: batch.column(batch.schema.get_field_index(c)).to_numpy()
+                    for c in columns
+                }
+
+        else:
+            pfile = pq.ParquetFile(path, memory_map=True)
+            for batch in pfile.iter_batches(columns=columns):
+                yield {
+                    c: batch.column(i).to_numpy(zero_copy_only=False)
+                    for i, c in enumerate(batch.schema.names)
+                }
+
+    return
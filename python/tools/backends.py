@@ -0,0 +1,276 @@
+import glob
+import hashlib
+import logging
+
+import python.tools.resolver as resolver
+from python.tools.snapshot_io import require_ttree
+
+logger = logging.getLogger(__name__)
+
+# execution backend of the RDataFrame graphs
+_config = {'backend': 'local', 'client': None, 'npartitions': None}
+
+# C++ code declared in this process, also declared on distributed workers
+_code = []
+
+# code already declared in a distributed worker process
+_worker_declared = set()
+
+# chains of dataframes with friend trees
+_chains = []
+
+# input file of the last single-file dataframe, opened while resolving it
+_input_file = []
+
+# whether the correctionlib pyroot binding is registered in this process
+_correctionlib = []
+
+# whether the counter of tree entries is declared in this process
+_entry_counter = []
+
+
+def setup_backend(backend='local', scheduler=None, nworkers=1, npartitions=0):
+    '''
+    Select how RDataFrame graphs are executed. 'local' runs them in this
+    process (with implicit MT), 'dask' runs them with distributed
+    RDataFrame on a dask cluster. The input files are then split into
+    partitions of clusters of entries, and the results are merged by the
+    framework.
+
+    Args:
+    backend (str): 'local' or 'dask'.
+    scheduler (str): Address of the dask scheduler, e.g. tcp://host:8786.
+        If not given, a LocalCluster with nworkers processes is started.
+    nworkers (int): Number of workers of the LocalCluster.
+    npartitions (int): Number of partitions per dataframe, 0 lets the
+        framework decide.
+    '''
+    _config['backend'] = backend
+    _config['npartitions'] = npartitions or None
+
+    if backend == 'local':
+        return
+
+    if backend != 'dask':
+        raise ValueError(f"Unknown backend {backend}.")
+
+    from dask.distributed import Client, LocalCluster
+
+    if scheduler:
+        client = Client(scheduler)
+    else:
+        cluster = LocalCluster(
+            n_workers=max(nworkers, 1), threads_per_worker=1, processes=True
+        )
+        client = Client(cluster)
+    _config['client'] = client
+
+    logger.info(f"Running RDataFrame graphs on dask cluster {client}.")
+
+    _initialize_workers()
+
+    return
+
+
+def is_distributed():
+    return _config['backend'] != 'local'
+
+
+def register_correctionlib():
+    '''
+    Make correctionlib available in the ROOT interpreter, only once per
+    process and only when it is needed.
+    '''
+    if not _correctionlib:
+        import correctionlib
+        correctionlib.register_pyroot_binding()
+        _correctionlib.append(True)
+
+    return
+
+
+def _declare_on_worker(code):
+    '''
+    Declare all C++ code of the main process in a worker process. Runs
+    before each task, but declares every piece of code only once.
+    '''
+    import ROOT
+
+    register_correctionlib()
+
+    for c in code:
+        key = hashlib.sha256(c.encode()).hexdigest()
+        if key not in _worker_declared:
+            ROOT.gInterpreter.Declare(c)
+            _worker_declared.add(key)
+
+    return
+
+
+def _initialize_workers():
+    import ROOT
+    ROOT.RDF.Experimental.Distributed.initialize(
+        _declare_on_worker, list(_code)
+    )
+
+    return
+
+
+def declare(code):
+    '''
+    Declare C++ code (functions, classes, global objects) in this process
+    and, with a distributed backend, in all workers.
+
+    Args:
+    code (str): C++ code.
+    '''
+    import ROOT
+
+    ROOT.gInterpreter.Declare(code)
+    _code.append(code)
+
+    if is_distributed():
+        _initialize_workers()
+
+    return
+
+
+def make_rdf(tree, files, friends=None):
+    '''
+    Create an RDataFrame for the selected backend.
+
+    Args:
+    tree (str): Name of the tree.
+    files (str or list): File name, glob pattern or list of files.
+    friends (list): Files with a 'Friends' tree per file, whose columns
+        are added to the dataframe (see snapshot_io.get_friend_files).
+
+    Returns:
+    RDataFrame
+    '''
+    import ROOT
+
+    kwargs = {'daskclient': _config['client']}
+    if _config['npartitions']:
+        kwargs['npartitions'] = _config['npartitions']
+
+    if friends:
+        require_ttree("Friend trees are")
+        chain = ROOT.TChain(tree)
+        friend_chain = ROOT.TChain('Friends')
+        for f, friend in zip(files, friends):
+            chain.Add(f)
+            friend_chain.Add(friend)
+        chain.AddFriend(friend_chain)
+        # the chains must live as long as the dataframe
+        _chains.append((chain, friend_chain))
+
+        if not is_distributed():
+            return ROOT.RDataFrame(chain)
+        return ROOT.RDF.Experimental.Distributed.Dask.RDataFrame(
+            chain, **kwargs
+        )
+
+    if not is_distributed():
+        # reuse the file opened by the resolver, the file of the previous
+        # dataframe is closed, workers process one file at a time. With
+        # implicit MT, RDataFrame opens the file per task anyway.
+        tfile = resolver.take_open_file(files) \
+            if isinstance(files, str) else None
+        if tfile:
+            for f in _input_file:
+                f.Close()
+            _input_file[:] = [tfile]
+            return ROOT.RDataFrame(tfile.Get(tree))
+
+        return ROOT.RDataFrame(tree, files)
+
+    # the distributed dataframe needs explicit file names
+    if isinstance(files, str):
+        files = [files]
+    files = [
+        m for f in files for m in (sorted(glob.glob(f)) if '*' in f else [f])
+    ]
+
+    return ROOT.RDF.Experimental.Distributed.Dask.RDataFrame(
+        tree, files, **kwargs
+    )
+
+
+def define_entry(rdf, column):
+    '''
+    Define the entry number in the input tree of a dataframe of a single
+    file. With implicit MT, rdfentry_ is not the entry in the tree, so the
+    entries are counted per slot from the first entry of the range of the
+    current task. The counter is evaluated in a filter, which must come
+    before all other filters so that every entry is counted in order. Only
+    one such event loop can run at a time in a process.
+
+    Args:
+    rdf (ROOT.RDataFrame): dataframe without filters.
+    column (str): name of the entry column.
+
+    Returns:
+    ROOT.RDataFrame: filtered dataframe with the entry column.
+    '''
+    import ROOT
+
+    if not _entry_counter:
+        ROOT.gInterpreter.Declare(
+            """
+            namespace xycorr {
+            // first entry of the current task and entries seen since, per
+            // slot
+            std::vector<std::pair<Long64_t, Long64_t>> tree_entries;
+            Long64_t next_tree_entry(unsigned int slot, Long64_t first) {
+                auto &s = tree_entries[slot];
+                if (s.first != first) {
+                    s.first = first;
+                    s.second = 0;
+                }
+                return first + s.second++;
+            }
+            void reset_tree_entries(unsigned int nslots) {
+                tree_entries.assign(nslots, {-1, 0});
+            }
+            }
+            """
+        )
+        _entry_counter.append(True)
+
+    ROOT.xycorr.reset_tree_entries(rdf.GetNSlots())
+
+    rdf = rdf.DefinePerSample(
+        f"{column}_first",
+        "static_cast<Long64_t>(rdfsampleinfo_.EntryRange().first)"
+    )
+    rdf = rdf.Define(
+        column, f"xycorr::next_tree_entry(rdfslot_, {column}_first)"
+    )
+
+    return rdf.Filter(f"{column} >= 0", f"{column} counter")
+
+
+def run_graphs(results):
+    '''
+    Run the event loops of all given lazy results concurrently.
+    '''
+    import ROOT
+
+    if is_distributed():
+        ROOT.RDF.Experimental.Distributed.RunGraphs(results)
+    else:
+        ROOT.RDF.RunGraphs(results)
+
+    return
+
+
+def get_nruns(rdf):
+    '''
+    Number of event loops run by a dataframe. Distributed dataframes do
+    not count them, their graph is executed once per RunGraphs call.
+    '''
+    if is_distributed():
+        return 1
+
+    return rdf.GetNRuns()
@@ -5,7 +5,7 @@ import glob
 logger = logging.getLogger(__name__)
 
 
-def setup_job(condor_dir, dtmc, year):
+def setup_job(condor_dir, dtmc, year, threads=1, extra_args=''):
     logger.info("Setting up the job script")
     # setup condor job script
     path = os.getcwd()
@@ -15,7 +15,8 @@ def setup_job(condor_dir, dtmc, year):
         "voms-proxy-info -all -file $2 \n"\
         f"cd {path} \n"\
         f"source env.sh \n"\
-        f"python get_xy_corrs.py -S --condor $1 --process {dtmc} --year {year} --debug"
+        f"python get_xy_corrs.py -S --condor $1 --process {dtmc} --year {year} "\
+        f"--threads {threads} {extra_args} --debug"
 
     log_dir = f'{condor_dir}{dtmc}/logs/'
 
@@ -34,7 +35,7 @@ def setup_job(condor_dir, dtmc, year):
     return
 
 
-def setup_condor_lxplus(njobs, condor_dir, dtmc, proxy_path):
+def setup_condor_lxplus(njobs, condor_dir, dtmc, proxy_path, threads=1):
 
     logger.info("Setting up the submit file.")
 
@@ -50,7 +51,7 @@ log = logs/job_$(Cluster)_$(Process).log
 # job requirements
 universe = vanilla
 +JobFlavour = "microcentury"
-RequestCPUs = 1
+RequestCPUs = {threads}
 
 Proxy_path = {proxy_path}
 
@@ -66,3 +67,94 @@ queue {njobs}"""
 
     logger.info(f"Run script for {njobs} via: \n{run_script}")
     return
+
+
+def setup_dag(
+    condor_dir, stage, plan, stage_args, year, datamc, proxy_path,
+    threads=1, extra_args=''
+):
+    '''
+    Write a DAG of the map and merge jobs of a stage (see
+    python/correction/mapreduce.py). The merge jobs of a level start when
+    all their parents are done, the validation plots are made at the end.
+
+    Args:
+    condor_dir (str): Condor directory.
+    stage (str): 'hists' or 'validate'.
+    plan (dict): map and merge jobs of the stage.
+    stage_args (str): options of get_xy_corrs.py selecting the stage.
+    year (str): Data taking epoch.
+    datamc (list): List of datasets.
+    proxy_path (str): Path to the VOMS proxy.
+    threads (int): Number of cpus per job.
+    extra_args (str): Further options of the jobs.
+    '''
+    logger.info(f"Setting up the DAG of the {stage} step.")
+
+    dag_dir = f'{condor_dir}{stage}/'
+    os.makedirs(f'{dag_dir}logs/', exist_ok=True)
+
+    path = os.getcwd()
+    job_script = f"#!/bin/bash \n"\
+        f"export X509_USER_PROXY=$1 \n"\
+        f"shift \n"\
+        f"cd {path} \n"\
+        f"source env.sh \n"\
+        f"python get_xy_corrs.py {stage_args} $@ "\
+        f"--process {','.join(datamc)} --year {year} "\
+        f"--threads {threads} -j {threads} {extra_args} --debug"
+
+    with open(f'{dag_dir}job.sh', 'w') as job:
+        job.write(job_script)
+
+    submit_script = f"""executable = ./job.sh
+arguments = $(Proxy_path) $(mode) $(index)
+
+# output/error/log files
+output = logs/$(node).out
+error = logs/$(node).err
+log = logs/dag.log
+
+# job requirements
+universe = vanilla
++JobFlavour = "microcentury"
+RequestCPUs = {threads}
+
+Proxy_path = {proxy_path}
+
+queue"""
+
+    with open(f'{dag_dir}node.sub', 'w') as submit:
+        submit.write(submit_script)
+
+    lines = []
+    for i in range(len(plan['maps'])):
+        lines.append(f'JOB map_{i} node.sub')
+        lines.append(f'VARS map_{i} mode="--condor" index="{i}" node="map_{i}"')
+    for i, merge in enumerate(plan['merges']):
+        lines.append(f'JOB merge_{i} node.sub')
+        lines.append(
+            f'VARS merge_{i} mode="--merge_job" index="{i}" node="merge_{i}"'
+        )
+        lines.append(f"PARENT {' '.join(merge['parents'])} CHILD merge_{i}")
+
+    if stage == 'validate':
+        finals = [
+            f'merge_{i}' for i, merge in enumerate(plan['merges'])
+            if merge['final']
+        ]
+        lines.append('JOB plots node.sub')
+        lines.append('VARS plots mode="--plots_only" index="" node="plots"')
+        lines.append(f"PARENT {' '.join(finals)} CHILD plots")
+
+    path_dag = f'{dag_dir}{stage}.dag'
+    with open(path_dag, 'w') as dag:
+        dag.write('\n'.join(lines) + '\n')
+
+    run_script = f"cd {dag_dir} && condor_submit_dag {stage}.dag && cd {path}"
+    logger.info(
+        f"Run the DAG of {len(plan['maps'])} map and {len(plan['merges'])} "
+        f"merge jobs via: \n{run_script}"
+    )
+
+    return
@@ -0,0 +1,138 @@
+#ifndef XYCORR_HEARTBEAT_H
+#define XYCORR_HEARTBEAT_H
+
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <cstdio>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <unistd.h>
+
+#include "TFile.h"
+#include "ROOT/RDataFrame.hxx"
+
+// Writes a heartbeat line in json format every `interval` seconds from a
+// separate thread, so that heartbeats are also written while python waits
+// for an event loop. Each line contains the work unit (input file), the
+// events processed in the unit and in the process, the event rate since
+// the last heartbeat, the bytes read from files and the resident memory.
+class Heartbeat {
+public:
+    Heartbeat(const std::string &path, const std::string &host, double interval)
+        : path_(path), host_(host), interval_(interval), pid_(getpid()) {
+        thread_ = std::thread([this] { Loop(); });
+    }
+
+    ~Heartbeat() { Stop(); }
+
+    void Start(const std::string &unit) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        unit_ = unit;
+        unitEvents_ = 0;
+        unitStart_ = Now();
+        WriteLocked("start");
+    }
+
+    void Add(ULong64_t n) {
+        events_ += n;
+        unitEvents_ += n;
+    }
+
+    // total: exact number of events of the unit, the partial counts are
+    // only updated every few entries
+    void Finish(ULong64_t total) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        events_ += total - unitEvents_;
+        unitEvents_ = total;
+        WriteLocked("done");
+        unit_.clear();
+    }
+
+    void Stop() {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            if (stop_) return;
+            stop_ = true;
+        }
+        cv_.notify_all();
+        if (thread_.joinable()) thread_.join();
+    }
+
+private:
+    static double Now() {
+        return std::chrono::duration<double>(
+            std::chrono::system_clock::now().time_since_epoch()).count();
+    }
+
+    static double RssMB() {
+        long pages = 0, rss = 0;
+        FILE *f = std::fopen("/proc/self/statm", "r");
+        if (f) {
+            if (std::fscanf(f, "%ld %ld", &pages, &rss) != 2) rss = 0;
+            std::fclose(f);
+        }
+        return rss * sysconf(_SC_PAGESIZE) / 1048576.;
+    }
+
+    void Loop() {
+        std::unique_lock<std::mutex> lock(mutex_);
+        while (!stop_) {
+            cv_.wait_for(lock, std::chrono::duration<double>(interval_));
+            if (!stop_ && !unit_.empty()) WriteLocked("beat");
+        }
+    }
+
+    void WriteLocked(const char *state) {
+        const double now = Now();
+        const ULong64_t events = events_;
+        const double rate = now > lastTime_ && lastTime_ > 0
+            ? (events - lastEvents_) / (now - lastTime_) : 0.;
+        lastTime_ = now;
+        lastEvents_ = events;
+
+        FILE *f = std::fopen(path_.c_str(), "a");
+        if (!f) return;
+        std::fprintf(f,
+            "{\"time\": %.3f, \"host\": \"%s\", \"pid\": %d, \"state\": \"%s\", "
+            "\"unit\": \"%s\", \"unit_start\": %.3f, \"unit_events\": %llu, "
+            "\"events\": %llu, \"rate\": %.1f, \"bytes_read\": %lld, "
+            "\"rss_mb\": %.1f}\n",
+            now, host_.c_str(), pid_, state, unit_.c_str(), unitStart_,
+            (unsigned long long)unitEvents_, (unsigned long long)events,
+            rate, (long long)TFile::GetFileBytesRead(), RssMB());
+        std::fclose(f);
+    }
+
+    std::string path_;
+    std::string host_;
+    double interval_;
+    int pid_;
+
+    std::string unit_;
+    double unitStart_ = 0;
+    std::atomic<ULong64_t> events_{0};
+    std::atomic<ULong64_t> unitEvents_{0};
+    double lastTime_ = 0;
+    ULong64_t lastEvents_ = 0;
+
+    bool stop_ = false;
+    std::mutex mutex_;
+    std::condition_variable cv_;
+    std::thread thread_;
+};
+
+// Count the entries of a dataframe into a heartbeat while the event loop
+// runs, in steps of `every` entries per processing slot.
+inline ROOT::RDF::RResultPtr<ULong64_t> TrackEvents(
+    ROOT::RDF::RNode df, Heartbeat &hb, ULong64_t every)
+{
+    auto count = df.Count();
+    count.OnPartialResultSlot(every, [&hb, every](unsigned int, ULong64_t &) {
+        hb.Add(every);
+    });
+    return count;
+}
+
+#endif
@@ -7,9 +7,17 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def get_nevents_path(nanoAODs):
+    '''
+    Numbers of events per file of a file list, saved next to it.
+    '''
+    return nanoAODs.replace('.json', '_nevents.json')
+
+
 def get_files_from_das(datasets, nanoAODs, redirector, year):
     '''
-    make file lists from DAS identifiers in datasets.json
+    make file lists from DAS identifiers in datasets.json, and save the
+    numbers of events per file in get_nevents_path(nanoAODs)
 
     Args:
     datasets (str): location of datasets.json
@@ -25,6 +33,7 @@ def get_files_from_das(datasets, nanoAODs, redirector, year):
             dsets = json.load(f)[year]
 
         fdict = {}
+        nevents = {}
 
         # looping through datasets (DATA, MC)
         for k in dsets.keys():
@@ -32,17 +41,18 @@ def get_files_from_das(datasets, nanoAODs, redirector, year):
 
             # loop through sub datasets
             for d in dsets[k]["names"]:
-                logger.debug(f'dasgoclient -query="file dataset={d}"')
-                stream = os.popen(
-                    f'dasgoclient -query="file dataset={d}"'
-                )
-                fdict[k] += [
-                    redirector +
-                    s.replace('\n', '') for s in stream.readlines()
-                ]
+                query = f'file dataset={d} | grep file.name, file.nevents'
+                logger.debug(f'dasgoclient -query="{query}"')
+                stream = os.popen(f'dasgoclient -query="{query}"')
+                for s in stream.readlines():
+                    name, n = s.split()
+                    fdict[k].append(redirector + name)
+                    nevents[redirector + name] = int(n)
 
         with open(nanoAODs, "w") as f:
             json.dump(fdict, f, indent=4)
+        with open(get_nevents_path(nanoAODs), "w") as f:
+            json.dump(nevents, f, indent=4)
 
     logger.info(f"File lists saved in {nanoAODs}")
 
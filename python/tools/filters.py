@@ -1,6 +1,7 @@
-import ROOT
 import json
 
+import python.tools.backends as backends
+
 
 def filter_lumi(rdf, g_json):
     """
@@ -54,8 +55,8 @@ def filter_lumi(rdf, g_json):
     return rdf
 
 
-ROOT.gROOT.ProcessLine(
-'''
+# C++ code of the dimuon selection, declared on first use
+get_indices_code = '''
 ROOT::VecOps::RVec<Int_t> get_indices(
     UInt_t nMuon,
     ROOT::VecOps::RVec<Float_t> *Muon_pt,
@@ -123,19 +124,39 @@ ROOT::VecOps::RVec<Int_t> get_indices(
     return s;
 }
 '''
-)
+_declared = []
+
+
+def declare_get_indices():
+    '''
+    Compile get_indices, only once per process.
+    '''
+    if not _declared:
+        backends.declare(get_indices_code)
+        _declared.append(True)
 
+    return
 
-def filter_zmm(rdf):
+
+def filter_zmm(rdf, stats=None):
     """
     function to get rdf with events filtered for Z->mumu
     
     rdf (ROOT.RDataFrame) : RDataFrame with recorded data
+    stats (dict) : if given, the number of muon pairs looped over in the
+        triggered events is booked as 'muon_pairs'
     """
 
+    declare_get_indices()
+
     # isomu24 trigger
     rdf = rdf.Filter("HLT_IsoMu24")
 
+    if stats is not None:
+        stats['muon_pairs'] = rdf.Define(
+            "nMuonPairs", "static_cast<double>(nMuon) * (nMuon - 1) / 2"
+        ).Sum("nMuonPairs")
+
     rdf = rdf.Define(
         "ind",
         f"""ROOT::VecOps::RVec<Int_t> (get_indices(
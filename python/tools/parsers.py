@@ -33,6 +33,69 @@ def parse_arguments():
         default=False, 
         help="set if snapshot of data should be saved (for validation)"
         )
+    parser.add_argument(
+        "--dedup",
+        help="Remove DATA events contained in more than one snapshot, "\
+        "e.g. from overlapping primary datasets.",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--augment",
+        help="Add the met types of --met that are missing in the snapshots "\
+        "as friend trees, reading only the selected NanoAOD entries.",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--compact",
+        help="Merge the snapshots into few large files and write a manifest "\
+        "that is read by the following steps.",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--compact_size",
+        help="Target size of the merged snapshots in MB. Default is 2000",
+        default=2000,
+        type=int
+    )
+    parser.add_argument(
+        "--export_snapshots",
+        help="Convert the snapshots to 'feather' (Arrow IPC) or 'parquet' "\
+        "files, which can be read without ROOT.",
+        default=None,
+        choices=['feather', 'parquet'],
+        type=str
+    )
+    parser.add_argument(
+        "--hist_engine",
+        help="Fill the histograms with RDataFrame from the ROOT snapshots "\
+        "('rdf'), with uproot and multithreaded boost-histogram from the "\
+        "ROOT snapshots ('boost') or with numpy from the exported snapshots "\
+        "('numpy'). Default is 'rdf'",
+        default='rdf',
+        choices=['rdf', 'boost', 'numpy'],
+        type=str
+    )
+    parser.add_argument(
+        "--estimator",
+        help="Estimator of met xy per pileup bin that is fitted: 'mean', "\
+        "'median' or 'trimmed' (10%% trimmed mean). The latter two are "\
+        "taken from quantile sketches, which are filled in the histogram "\
+        "step with the same option. Default is 'mean'",
+        default='mean',
+        choices=['mean', 'median', 'trimmed'],
+        type=str
+    )
+    parser.add_argument(
+        "--stream",
+        help="Fill the histograms directly from NanoAOD without writing "\
+        "snapshots (replaces -S and -H). Together with -S, snapshots are "\
+        "written as side output.",
+        default=False,
+        action='store_true'
+    )
     parser.add_argument(
         "--met",
         help="Comma-separated list of MET types; default is 'MET,PuppiMET'",
@@ -68,6 +131,20 @@ def parse_arguments():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        "--closure",
+        help="Fast closure test of the fits from the 2d histograms, without "\
+        "reading the snapshots",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--closure_sigma",
+        help="Maximal significance of the residual slope and of the mean "\
+        "after correction in the closure test. Default is 3",
+        default=3.,
+        type=float
+    )
     parser.add_argument(
         "--jobs",
         "-j",
@@ -75,6 +152,116 @@ def parse_arguments():
         default=0,
         type=int
     )
+    parser.add_argument(
+        "--threads",
+        help='Number of ROOT implicit MT threads per worker process '\
+        'in the snapshot step. Default is 1',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        "--autotune",
+        help="Measure the best split of workers and threads for the snapshot "\
+        "step on this host with a short test run before producing ntuples.",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--backend",
+        help="Execution of the snapshot, histogram and validation steps: "\
+        "'local' (processes and implicit MT) or 'dask' (distributed "\
+        "RDataFrame). Default is 'local'",
+        default='local',
+        choices=['local', 'dask'],
+        type=str
+    )
+    parser.add_argument(
+        "--scheduler",
+        help="Address of the dask scheduler, e.g. tcp://host:8786. If not "\
+        "given, a local dask cluster with -j workers is started.",
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        "--npartitions",
+        help="Number of partitions per dataframe with the dask backend. "\
+        "Default is 0, which lets RDataFrame decide",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "--open_budget",
+        help="Seconds an input file may take to open before it is also "\
+        "opened via the next redirector, 0 disables this. Default is 10",
+        default=10.,
+        type=float
+    )
+    parser.add_argument(
+        "--heartbeat",
+        help="Seconds between heartbeats of workers and condor jobs, "\
+        "0 disables them. Default is 30",
+        default=30.,
+        type=float
+    )
+    parser.add_argument(
+        "--max_tasks",
+        help="Input files after which a snapshot or streaming worker is "\
+        "replaced by a fresh process. Default is 0 (no limit)",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "--max_rss",
+        help="Memory ceiling per snapshot or streaming worker in MB; a "\
+        "worker above it is replaced after its current file. Default is 0, "\
+        "which shares 80%% of the available memory among the workers, "\
+        "negative values disable the ceiling",
+        default=0.,
+        type=float
+    )
+    parser.add_argument(
+        "--monitor",
+        help="Follow throughput, ETA and stragglers of a running ntuple "\
+        "production from the heartbeats of its workers and condor jobs.",
+        default=False,
+        action='store_true'
+    )
+    parser.add_argument(
+        "--preview",
+        help="Run the requested steps on a reproducible sample of this "\
+        "fraction of the input files, stratified by run period, and report "\
+        "the expected precision of a full run. Outputs are kept apart "\
+        "under version {version}_preview{fraction}. Default is 0 (off)",
+        default=0.,
+        type=float
+    )
+    parser.add_argument(
+        "--mapreduce",
+        help="Split the histogram or validation step into this many map "\
+        "jobs per dataset, whose outputs are merged in a tree. Runs as a "\
+        "condor DAG with -j 0, otherwise locally with -j processes. "\
+        "Default is 0 (off)",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "--fanin",
+        help="Maximum number of partial outputs per merge job. Default is 8",
+        default=8,
+        type=int
+    )
+    parser.add_argument(
+        "--merge_job",
+        help="Index of the merge job of a condor DAG. -1 is default.",
+        default=-1,
+        type=int
+    )
+    parser.add_argument(
+        "--plots_only",
+        help="Only make the validation plots from existing histograms.",
+        default=False,
+        action='store_true'
+    )
     parser.add_argument(
         "--condor",
         help='Indicating job number. -1 is default and does everything locally.',
@@ -93,6 +280,12 @@ def parse_arguments():
         default=False,
         action='store_true'
     )
+    parser.add_argument(
+        "--force",
+        help="Rerun the requested steps even if their outputs are up to date.",
+        default=False,
+        action='store_true'
+    )
     parser.add_argument(
         "--skip_check",
         help="Skip check of snapshot to speed up histogram step.",
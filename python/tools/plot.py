@@ -4,6 +4,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+ROOT.gROOT.SetBatch(1)
+
 
 def plot_2dim(
         h,
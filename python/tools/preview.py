@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+
+from python.tools.das_query import get_nevents_path
+
+logger = logging.getLogger(__name__)
+
+# run period (or MC sample) of a NanoAOD file, e.g. Run2022C/Muon
+stratum_re = re.compile(r'/store/(?:data|mc)/([^/]+)/([^/]+)/')
+
+
+def get_stratum(path):
+    '''
+    Run period and primary dataset (data) or campaign and sample (MC) of
+    an input file, taken from its LFN.
+    '''
+    m = stratum_re.search(path)
+    if m is None:
+        return 'other'
+
+    return f'{m.group(1)}/{m.group(2)}'
+
+
+def file_hash(path):
+    '''
+    Reproducible pseudo-random number in [0, 1) of an input file. It only
+    depends on the LFN, not on the redirector or the order of the list.
+    '''
+    lfn = path[path.find('/store/'):] if '/store/' in path else path
+    digest = hashlib.sha256(lfn.encode()).hexdigest()
+
+    return int(digest[:15], 16) / 16**15
+
+
+def sample_files(files, fraction):
+    '''
+    Deterministic sample of input files, stratified by run period: in each
+    stratum, the files with the smallest hashes are taken, at least one.
+    The sample is the same in every run and only changes at the margin
+    when files are added.
+
+    Args:
+    files (list): input files.
+    fraction (float): fraction of files per stratum.
+
+    Returns:
+    list: sampled files in their original order.
+    '''
+    strata = {}
+    for f in files:
+        strata.setdefault(get_stratum(f), []).append(f)
+
+    selected = set()
+    for stratum, sfiles in strata.items():
+        n = max(1, round(fraction * len(sfiles)))
+        selected.update(sorted(sfiles, key=file_hash)[:n])
+        logger.debug(f"Preview of {stratum}: {n} of {len(sfiles)} files.")
+
+    return [f for f in files if f in selected]
+
+
+def event_fractions(full, sample, full_path):
+    '''
+    Fraction of the input events in the sample per dataset, from the
+    numbers of events per file of the DAS query. The statistical
+    precision scales with the events, not with the files, which differ in
+    size. File lists without event numbers use the fraction of files.
+
+    Args:
+    full (dict): full file list per dataset.
+    sample (dict): sampled file list per dataset.
+    full_path (str): path of the full file list.
+
+    Returns:
+    dict: fraction of sampled events per dataset.
+    '''
+    nevents_path = get_nevents_path(full_path)
+    nevents = {}
+    if os.path.exists(nevents_path):
+        with open(nevents_path) as f:
+            nevents = json.load(f)
+
+    fractions = {}
+    for dtmc in full:
+        if nevents and all(f in nevents for f in full[dtmc]):
+            fractions[dtmc] = sum(nevents[f] for f in sample[dtmc]) \
+                / max(sum(nevents[f] for f in full[dtmc]), 1)
+        else:
+            logger.warning(
+                f"Numbers of events per file of {dtmc} missing in "
+                f"{nevents_path}, using the fraction of files."
+            )
+            fractions[dtmc] = len(sample[dtmc]) / max(len(full[dtmc]), 1)
+
+    return fractions
+
+
+def write_sample(full_path, sample_path, fraction):
+    '''
+    Write the preview file list in the format of inputs/nanoAODs/.
+
+    Args:
+    full_path (str): full file list.
+    sample_path (str): output file list.
+    fraction (float): fraction of files per stratum.
+
+    Returns:
+    dict: fraction of sampled events per dataset.
+    '''
+    with open(full_path) as f:
+        full = json.load(f)
+
+    sample = {
+        dtmc: sample_files(files, fraction) for dtmc, files in full.items()
+    }
+
+    with open(sample_path, 'w') as f:
+        json.dump(sample, f, indent=4)
+
+    fractions = event_fractions(full, sample, full_path)
+    for dtmc in full:
+        logger.info(
+            f"Preview of {dtmc}: {len(sample[dtmc])} of {len(full[dtmc])} "
+            f"files ({fractions[dtmc]:.1%} of the events) in "
+            f"{len(set(map(get_stratum, full[dtmc])))} run periods."
+        )
+
+    return fractions
+
+
+def report_precision(corr_dir, datamc, full_path, sample_path):
+    '''
+    Expected statistical precision of the fitted slopes m and offsets c
+    in a full run, extrapolated from the preview: the uncertainties scale
+    with the square root of the sampled fraction of events. Also gives the expected
+    spread of the preview result around the full result, since the preview
+    is a subset of the full data.
+
+    Args:
+    corr_dir (str): directory of the preview fit results.
+    datamc (list): List of datasets.
+    full_path (str): full file list.
+    sample_path (str): preview file list.
+
+    Returns:
+    dict: report, also saved in {corr_dir}preview_report.json.
+    '''
+    with open(full_path) as f:
+        full = json.load(f)
+    with open(sample_path) as f:
+        sample = json.load(f)
+
+    fractions = event_fractions(full, sample, full_path)
+
+    report = {}
+    for dtmc in datamc:
+        fraction = fractions[dtmc]
+        with open(f'{corr_dir}{dtmc}.json') as f:
+            corrs = json.load(f)
+
+        report[dtmc] = {'fraction': fraction}
+        for met, per_pu in corrs.items():
+            for pu, per_xy in per_pu.items():
+                for xy, per_var in per_xy.items():
+                    res = per_var['nom']
+                    entry = {}
+                    for p in ['m', 'c']:
+                        stat = res[f'{p}_stat']
+                        entry[p] = res[p]
+                        entry[f'{p}_stat_preview'] = stat
+                        entry[f'{p}_stat_full'] = stat * math.sqrt(fraction)
+                        entry[f'{p}_preview_vs_full'] = \
+                            stat * math.sqrt(1 - fraction)
+                    report[dtmc][f'{met}{xy}_{pu}'] = entry
+
+                    logger.info(
+                        f"Preview {dtmc} {met}{xy}: "
+                        f"m = {entry['m']:.4f} +- {entry['m_stat_preview']:.4f} "
+                        f"(full run +- {entry['m_stat_full']:.4f}), "
+                        f"c = {entry['c']:.3f} +- {entry['c_stat_preview']:.3f} "
+                        f"(full run +- {entry['c_stat_full']:.3f})"
+                    )
+
+    out = f'{corr_dir}preview_report.json'
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Preview report saved in {out}")
+
+    return report
@@ -0,0 +1,376 @@
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import socket
+import logging
+import resource
+import importlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# report configuration and records of the current process
+_config = {'report_dir': None, 'rdf_timers': False}
+_records = []
+_active = []
+
+
+def setup_profiling(report_dir):
+    '''
+    Set the directory of the run reports. Partial reports of pool workers
+    and condor jobs are written to {report_dir}partial/.
+
+    Args:
+    report_dir (str): Directory for reports.
+    '''
+    _config['report_dir'] = report_dir
+    os.makedirs(f'{report_dir}partial/', exist_ok=True)
+
+    return
+
+
+def install_rdf_timers():
+    '''
+    Collect the jit and event loop times reported by RDataFrame through a
+    log handler. Info messages of RDataFrame are only counted and not
+    printed; warnings and errors are passed on. Only done once per process
+    and only if ROOT is already in use.
+
+    Returns:
+    bool: whether the timers are available.
+    '''
+    if 'ROOT' not in sys.modules:
+        return False
+
+    if _config['rdf_timers']:
+        return True
+
+    import ROOT
+
+    ROOT.gInterpreter.Declare(
+    '''
+    #include <mutex>
+    #include <ROOT/RLogger.hxx>
+    #include <ROOT/RDataFrame.hxx>
+
+    struct XYCorrRDFTiming {
+        double jit = 0;
+        double loop = 0;
+        int nloops = 0;
+    };
+    XYCorrRDFTiming xycorr_rdf_timing;
+
+    class XYCorrRDFLogHandler : public ROOT::Experimental::RLogHandler {
+    public:
+        bool Emit(const ROOT::Experimental::RLogEntry &entry) override {
+            if (entry.fChannel != &ROOT::Detail::RDF::RDFLogChannel())
+                return true;
+
+            const std::string &msg = entry.fMessage;
+            const std::string jit = "compilation phase completed in ";
+            const std::string loop = "s CPU, ";
+
+            std::lock_guard<std::mutex> lock(fMutex);
+            auto pos = msg.find(jit);
+            if (pos != std::string::npos) {
+                xycorr_rdf_timing.jit += std::atof(msg.c_str() + pos + jit.size());
+            }
+            pos = msg.find(loop);
+            if (msg.rfind("Finished event loop", 0) == 0 && pos != std::string::npos) {
+                xycorr_rdf_timing.loop += std::atof(msg.c_str() + pos + loop.size());
+                xycorr_rdf_timing.nloops++;
+            }
+
+            // swallow info messages, pass on warnings and errors
+            return entry.fLevel < ROOT::Experimental::ELogLevel::kInfo;
+        }
+
+    private:
+        std::mutex fMutex;
+    };
+
+    ROOT::Experimental::RLogScopedVerbosity xycorr_rdf_verbosity(
+        ROOT::Detail::RDF::RDFLogChannel(),
+        ROOT::Experimental::ELogLevel::kInfo
+    );
+
+    struct XYCorrRDFLogInstaller {
+        XYCorrRDFLogInstaller() {
+            ROOT::Experimental::RLogManager::Get().PushFront(
+                std::make_unique<XYCorrRDFLogHandler>()
+            );
+        }
+    };
+    XYCorrRDFLogInstaller xycorr_rdf_log_installer;
+    '''
+    )
+    _config['rdf_timers'] = True
+
+    return True
+
+
+def rdf_timing():
+    '''
+    Accumulated jit time, event loop time and number of event loops of
+    RDataFrame in this process.
+    '''
+    if not install_rdf_timers():
+        return {'jit': 0., 'loop': 0., 'nloops': 0}
+
+    import ROOT
+    t = ROOT.xycorr_rdf_timing
+
+    return {'jit': t.jit, 'loop': t.loop, 'nloops': t.nloops}
+
+
+def _usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        'wall': time.perf_counter(),
+        'cpu': self_usage.ru_utime + self_usage.ru_stime
+            + children.ru_utime + children.ru_stime,
+        # ru_maxrss is given in kB on linux
+        'rss': max(self_usage.ru_maxrss, children.ru_maxrss) / 1024.,
+    }
+
+
+def current_rss_mb():
+    '''
+    Current (not peak) rss of this process in MB.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024.**2
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+@contextmanager
+def profile_stage(stage, partial=False, **info):
+    '''
+    Record wall time, cpu time (including child processes), peak and
+    final rss and
+    RDataFrame jit and event loop times of a step. The yielded record can
+    be updated with further metrics, e.g. events_in and events_out, also
+    via update_record from inside the step.
+
+    Args:
+    stage (str): Name of the step.
+    partial (bool): Write the record to the partial reports right away,
+        e.g. in pool workers or condor jobs.
+    info: Additional information stored in the record.
+    '''
+    record = {
+        'stage': stage,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        **info
+    }
+    start = _usage()
+    start_rdf = rdf_timing()
+
+    _active.append(record)
+    try:
+        yield record
+    finally:
+        _active.pop()
+
+        stop = _usage()
+        stop_rdf = rdf_timing()
+
+        record['wall'] = stop['wall'] - start['wall']
+        record['cpu'] = stop['cpu'] - start['cpu']
+        record['peak_rss_mb'] = stop['rss']
+        record['rss_mb'] = current_rss_mb()
+        record['finished'] = time.time()
+        record['jit'] = stop_rdf['jit'] - start_rdf['jit']
+        record['event_loop'] = stop_rdf['loop'] - start_rdf['loop']
+        record['event_loops'] = stop_rdf['nloops'] - start_rdf['nloops']
+        record['root_loaded'] = 'ROOT' in sys.modules
+        if record.get('events_in') and record['wall'] > 0:
+            record['events_per_s'] = record['events_in'] / record['wall']
+
+        if partial:
+            write_partial(record)
+        else:
+            _records.append(record)
+
+        logger.debug(f"Profile of {stage}: {record}")
+
+
+def timed_import(name):
+    '''
+    Import the module of a step on first use and add the import time to
+    the innermost active step record as 'import_s'.
+
+    Args:
+    name (str): Module name, e.g. 'python.correction.convert2json'.
+
+    Returns:
+    module
+    '''
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    add_to_record(import_s=time.perf_counter() - start)
+
+    logger.debug(
+        f"Imported {name} in {time.perf_counter() - start:.2f} s, "
+        f"ROOT loaded: {'ROOT' in sys.modules}"
+    )
+
+    return module
+
+
+def update_record(**metrics):
+    '''
+    Add metrics to the innermost active step record, if any.
+    '''
+    if _active:
+        _active[-1].update(metrics)
+
+    return
+
+
+def add_to_record(**metrics):
+    '''
+    Add metrics to the values in the innermost active step record, e.g.
+    to count events over several datasets.
+    '''
+    if _active:
+        for key, value in metrics.items():
+            _active[-1][key] = _active[-1].get(key, 0) + value
+
+    return
+
+
+def write_partial(record):
+    '''
+    Append a record to the partial report of this process.
+    '''
+    if _config['report_dir'] is None:
+        return
+
+    path = (
+        f"{_config['report_dir']}partial/"
+        f"{socket.gethostname()}_{os.getpid()}.jsonl"
+    )
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    return
+
+
+def summarise(records):
+    '''
+    Sum up the records per step.
+    '''
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r['stage'], {
+            'records': 0, 'wall': 0., 'cpu': 0., 'import_s': 0., 'jit': 0.,
+            'events_in': 0, 'events_out': 0, 'peak_rss_mb': 0.
+        })
+        s['records'] += 1
+        for key in ['wall', 'cpu', 'import_s', 'jit', 'events_in', 'events_out']:
+            s[key] += r.get(key, 0) or 0
+        s['peak_rss_mb'] = max(s['peak_rss_mb'], r.get('peak_rss_mb', 0.))
+
+    return summary
+
+
+def summarise_workers(records, stages=('snapshot_file', 'stream_file')):
+    '''
+    Memory per worker process (or condor job) over the files it processed:
+    number of files and rss after the first and the last file. Growth
+    between them points to memory accumulating in long-lived workers.
+    '''
+    workers = {}
+    for r in records:
+        if r['stage'] not in stages or 'rss_mb' not in r:
+            continue
+        w = workers.setdefault(f"{r['host']}_{r['pid']}", {
+            'files': 0, 'first_rss_mb': r['rss_mb'], 'last_rss_mb': 0.,
+            'peak_rss_mb': 0.
+        })
+        w['files'] += 1
+        w['last_rss_mb'] = r['rss_mb']
+        w['peak_rss_mb'] = max(w['peak_rss_mb'], r.get('peak_rss_mb', 0.))
+
+    return workers
+
+
+def write_report():
+    '''
+    Merge the records of this process with all partial reports, write the
+    report of this run as json and csv and log a summary per step.
+
+    Returns:
+    str: path of the json report.
+    '''
+    report_dir = _config['report_dir']
+    if report_dir is None:
+        return None
+
+    records = list(_records)
+    partials = glob.glob(f'{report_dir}partial/*.jsonl')
+    for path in partials:
+        with open(path) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    path = f'{report_dir}report_{stamp}'
+
+    with open(f'{path}.json', 'w') as f:
+        json.dump(
+            {
+                'records': records,
+                'summary': summarise(records),
+                'workers': summarise_workers(records),
+            },
+            f, indent=4
+        )
+
+    keys = []
+    for r in records:
+        keys += [k for k in r if k not in keys]
+    with open(f'{path}.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=keys)
+        writer.writeheader()
+        writer.writerows(records)
+
+    # partial reports are now part of this report
+    for p in partials:
+        os.remove(p)
+
+    lines = [
+        f"{'step':>16} {'records':>7} {'wall/s':>9} {'cpu/s':>9} "
+        f"{'import/s':>8} {'jit/s':>7} {'events in':>11} {'events out':>11} "
+        f"{'rss/MB':>8}"
+    ]
+    for stage, s in summarise(records).items():
+        lines.append(
+            f"{stage:>16} {s['records']:>7} {s['wall']:>9.1f} "
+            f"{s['cpu']:>9.1f} {s['import_s']:>8.2f} {s['jit']:>7.1f} "
+            f"{s['events_in']:>11} "
+            f"{s['events_out']:>11} {s['peak_rss_mb']:>8.0f}"
+        )
+    logger.info("Profile of this run:\n" + "\n".join(lines))
+
+    workers = summarise_workers(records)
+    if workers:
+        growth = [w['last_rss_mb'] - w['first_rss_mb'] for w in workers.values()]
+        logger.info(
+            f"{len(workers)} workers processed "
+            f"{sum(w['files'] for w in workers.values())} files, peak rss "
+            f"{max(w['peak_rss_mb'] for w in workers.values()):.0f} MB, "
+            f"largest growth {max(growth):.0f} MB."
+        )
+    logger.info(f"Report saved in {path}.json and {path}.csv")
+
+    return f'{path}.json'
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# redirectors or replica prefixes in the configured order, latency budget
+# before a hedged open, seconds until all opens of a round are given up,
+# rounds over all prefixes and base of the exponential backoff
+_config = {
+    'prefixes': [],
+    'budget': 10.,
+    'timeout': 120.,
+    'retries': 3,
+    'backoff': 5.,
+    'latency_file': None,
+}
+
+# smoothed open latency per prefix in seconds
+_latency = {}
+
+# files opened by the winning open of a round by url, until they are taken
+# over by the dataframe
+_open_files = {}
+
+
+def setup_resolver(
+    prefixes, budget=10., latency_file=None, timeout=120., retries=3,
+    backoff=5.
+):
+    '''
+    Configure how input files are opened. Files are opened via the
+    fastest known prefix first. If the open takes longer than the latency
+    budget, an open via the next prefix is started in parallel and the
+    first successful one is used. Failed rounds are retried with
+    exponential backoff.
+
+    Args:
+    prefixes (list): Redirectors or replica prefixes, e.g.
+        root://cms-xrd-global.cern.ch// or a local directory.
+    budget (float): Seconds before a hedged open is started, 0 disables
+        hedging.
+    latency_file (str): Json file to keep the latencies between runs.
+    timeout (float): Seconds until the opens of a round are given up.
+    retries (int): Number of rounds over all prefixes.
+    backoff (float): Seconds to wait after the first failed round,
+        doubled after each further round.
+    '''
+    _config.update(
+        prefixes=list(prefixes), budget=budget, timeout=timeout,
+        retries=retries, backoff=backoff, latency_file=latency_file
+    )
+
+    if latency_file and os.path.exists(latency_file):
+        with open(latency_file) as f:
+            _latency.update(json.load(f))
+
+    return
+
+
+def get_lfn(path):
+    '''
+    Logical file name of an input file, None if it has none of the
+    configured prefixes.
+    '''
+    for p in _config['prefixes']:
+        if path.startswith(p):
+            return '/' + path[len(p):].lstrip('/')
+
+    return None
+
+
+def ordered_prefixes():
+    '''
+    Prefixes by their smoothed latency, prefixes without measurement are
+    ranked as if they took the latency budget.
+    '''
+    prefixes = _config['prefixes']
+
+    return sorted(
+        prefixes,
+        key=lambda p: (_latency.get(p, _config['budget']), prefixes.index(p))
+    )
+
+
+def record_latency(prefix, seconds, weight=0.3):
+    _latency[prefix] = seconds if prefix not in _latency\
+        else (1 - weight) * _latency[prefix] + weight * seconds
+
+    return
+
+
+def save_latencies():
+    path = _config['latency_file']
+    if not path:
+        return
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(_latency, f, indent=4)
+    os.replace(tmp, path)
+
+    return
+
+
+def root_start(url):
+    '''
+    Start an asynchronous open, local files are opened when polled.
+    '''
+    import ROOT
+    return ROOT.TFile.AsyncOpen(url)
+
+
+def root_poll(handle):
+    '''
+    State of an open: None while in progress, True if the file could be
+    opened, False if not. Finished opens are collected, opened files are
+    kept for take_open_file, so that they are not opened a second time.
+    '''
+    import ROOT
+
+    status = ROOT.TFile.GetAsyncOpenStatus(handle)
+    if status == ROOT.TFile.kAOSInProgress:
+        return None
+    url = handle.GetName()
+    f = ROOT.TFile.Open(handle)
+    if status == ROOT.TFile.kAOSFailure or not f or f.IsZombie():
+        if f:
+            f.Close()
+        return False
+
+    _open_files[url] = f
+
+    return True
+
+
+def root_cancel(handle):
+    '''
+    Release an open that was not polled to the end: the file of an open
+    in progress is closed, finished opens are collected and closed.
+    '''
+    import ROOT
+
+    if ROOT.TFile.GetAsyncOpenStatus(handle) == ROOT.TFile.kAOSInProgress:
+        f = handle.GetFile()
+    else:
+        f = ROOT.TFile.Open(handle)
+    if f:
+        f.Close()
+
+    return
+
+
+def take_open_file(url):
+    '''
+    The file opened for url while it was resolved, None if there is none.
+    The caller owns the file afterwards.
+    '''
+    return _open_files.pop(url, None)
+
+
+def open_round(lfn, prefixes, start, poll, cancel, interval=0.05):
+    '''
+    One round of hedged opens over the given prefixes. The opens still in
+    progress when one succeeded or the round timed out are cancelled.
+
+    Returns:
+    str: url of the first successful open, None if all failed.
+    '''
+    pending = []
+    waiting = list(prefixes)
+    started = time.monotonic()
+    last_start = None
+
+    while pending or waiting:
+        now = time.monotonic()
+
+        # start the next prefix at the beginning, when all running opens
+        # failed, or when the latest one exceeded the budget
+        hedge = _config['budget'] > 0 and last_start is not None\
+            and now - last_start > _config['budget']
+        if waiting and (not pending or hedge):
+            p = waiting.pop(0)
+            if pending:
+                logger.info(
+                    f"Open of {lfn} is slow, also trying {p}."
+                )
+            pending.append((p, start(p + lfn), now))
+            last_start = now
+
+        for item in list(pending):
+            p, handle, t0 = item
+            ok = poll(handle)
+            if ok is None:
+                continue
+            pending.remove(item)
+            record_latency(p, time.monotonic() - t0)
+            if ok:
+                # opens that lost the race took at least as long
+                for q, lost, t1 in pending:
+                    record_latency(q, time.monotonic() - t1)
+                    cancel(lost)
+                return p + lfn
+            logger.warning(f"Could not open {p + lfn}.")
+
+        if now - started > _config['timeout']:
+            for p, handle, _ in pending:
+                logger.warning(f"Open of {p + lfn} timed out.")
+                record_latency(p, _config['timeout'])
+                cancel(handle)
+            return None
+
+        time.sleep(interval)
+
+    return None
+
+
+def resolve(path, start=root_start, poll=root_poll, cancel=root_cancel):
+    '''
+    Url under which an input file can be opened. Files without one of the
+    configured prefixes are returned unchanged.
+
+    Args:
+    path (str): Input file as in inputs/nanoAODs/{year}.json.
+    start (function): Starts an open of a url and returns a handle.
+    poll (function): State of an open (see root_poll).
+    cancel (function): Releases an open that is not used.
+
+    Returns:
+    str: url of the file.
+    '''
+    lfn = get_lfn(path)
+    if lfn is None:
+        return path
+
+    for attempt in range(_config['retries']):
+        if attempt > 0:
+            wait = _config['backoff'] * 2**(attempt - 1)
+            logger.warning(
+                f"All sources of {lfn} failed, retrying in {wait:.0f} s."
+            )
+            time.sleep(wait)
+
+        url = open_round(lfn, ordered_prefixes(), start, poll, cancel)
+        save_latencies()
+        if url is not None:
+            return url
+
+    raise OSError(
+        f"Could not open {lfn} via {', '.join(_config['prefixes'])}."
+    )
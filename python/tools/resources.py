@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cgroup_cpu_limit():
+    '''
+    Read the cpu quota of the current cgroup (v2 or v1).
+
+    Returns:
+    float: number of cpus granted by the quota, None if unlimited.
+    '''
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1: quota of -1 means unlimited
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus():
+    '''
+    Number of cpus usable by this process, taking into account the cpu
+    affinity mask and cgroup quotas (e.g. in condor slots or containers).
+    '''
+    try:
+        ncpu = len(os.sched_getaffinity(0))
+    except AttributeError:
+        ncpu = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        ncpu = min(ncpu, max(1, int(limit)))
+
+    return ncpu
+
+
+def available_memory_mb():
+    '''
+    Memory usable by this process in MB: the cgroup limit (v2 or v1), if
+    any, or the total memory of the host. None if unknown.
+    '''
+    limits = []
+    for path in [
+        '/sys/fs/cgroup/memory.max',
+        '/sys/fs/cgroup/memory/memory.limit_in_bytes'
+    ]:
+        try:
+            with open(path) as f:
+                limits.append(int(f.read()) / 1024.**2)
+        except (OSError, ValueError):
+            # "max" means unlimited
+            pass
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    limits.append(int(line.split()[1]) / 1024.)
+    except (OSError, ValueError):
+        pass
+
+    return min(limits) if limits else None
+
+
+def get_resources(jobs, threads, condor_no=-1):
+    '''
+    Determine process and thread counts for all steps of the correction.
+
+    Args:
+    jobs (int): Requested parallelism (-j). For the snapshot step this is
+        the number of worker processes, 0 means submission to condor.
+    threads (int): Number of implicit MT threads per snapshot worker.
+    condor_no (int): Condor job number (-1 for local execution).
+
+    Returns:
+    dict: per step a dictionary with 'workers' and 'threads'.
+    '''
+    ncpu = available_cpus()
+    threads = max(threads, 1)
+
+    if condor_no >= 0:
+        snap_workers = 1
+    else:
+        snap_workers = min(jobs, max(ncpu // threads, 1))
+        if snap_workers < jobs:
+            logger.warning(
+                f"Requested {jobs} workers with {threads} threads each, "
+                f"but only {ncpu} cpus are available. "
+                f"Using {snap_workers} workers."
+            )
+
+    imt_threads = min(jobs, ncpu)
+
+    res = {
+        'ncpu': ncpu,
+        'prep': {'workers': 1, 'threads': 0},
+        'snapshot': {'workers': snap_workers, 'threads': threads},
+        'compact': {'workers': max(imt_threads, 1), 'threads': 0},
+        'hists': {'workers': 1, 'threads': imt_threads},
+        'corr': {'workers': 1, 'threads': 0},
+        'convert': {'workers': 1, 'threads': 0},
+        'validate': {'workers': 1, 'threads': imt_threads},
+    }
+
+    logger.debug(f"Resources on {ncpu} available cpus: {res}")
+
+    return res
+
+
+def enable_threads(nthreads):
+    '''
+    Set the size of the ROOT implicit MT pool of the current process.
+    This is the only place in the framework where implicit MT is touched.
+
+    Args:
+    nthreads (int): Number of threads. Values below 2 disable implicit MT.
+    '''
+    # avoid loading ROOT for steps that do not need it
+    if nthreads < 2 and 'ROOT' not in sys.modules:
+        return
+
+    import ROOT
+
+    if nthreads < 2:
+        if ROOT.IsImplicitMTEnabled():
+            ROOT.DisableImplicitMT()
+        return
+
+    if ROOT.IsImplicitMTEnabled():
+        if ROOT.GetThreadPoolSize() == nthreads:
+            return
+        logger.warning(
+            f"Implicit MT already running with {ROOT.GetThreadPoolSize()} "
+            f"threads. The pool size can not be changed to {nthreads}."
+        )
+        return
+
+    ROOT.EnableImplicitMT(nthreads)
+    logger.debug(f"Enabled implicit MT with {nthreads} threads.")
+
+    return
+
+
+def candidate_splits(ncpu):
+    '''
+    Workers x threads splits filling the available cpus.
+    '''
+    splits = []
+    threads = 1
+    while threads <= ncpu:
+        splits.append((ncpu // threads, threads))
+        threads *= 2
+
+    return splits
+
+
+def get_tune_file(tune_dir, step):
+    '''
+    Path of the autotune cache for a step on the current host.
+    '''
+    return f'{tune_dir}{socket.gethostname()}_{step}.json'
+
+
+def autotune(run, ncpu, tune_file):
+    '''
+    Time a short workload for several workers x threads splits and pick
+    the one with the highest event throughput. The result is cached per
+    host and cpu count so the measurement is done only once.
+
+    Args:
+    run (callable): run(workers, threads) processes a test workload and
+        returns the number of processed events.
+    ncpu (int): Number of available cpus.
+    tune_file (str): Cache file for the autotune result.
+
+    Returns:
+    tuple: (workers, threads) of the fastest split.
+    '''
+    if os.path.exists(tune_file):
+        with open(tune_file) as f:
+            tuned = json.load(f)
+        if tuned['ncpu'] == ncpu:
+            logger.info(
+                f"Using cached autotune result from {tune_file}: "
+                f"{tuned['workers']} workers x {tuned['threads']} threads."
+            )
+            return tuned['workers'], tuned['threads']
+
+    logger.info(f"Autotuning workers x threads split for {ncpu} cpus.")
+
+    rates = {}
+    for workers, threads in candidate_splits(ncpu):
+        start = time.perf_counter()
+        nevents = run(workers, threads)
+        wall = time.perf_counter() - start
+
+        rates[f'{workers}x{threads}'] = nevents / wall
+        logger.info(
+            f"{workers} workers x {threads} threads: "
+            f"{nevents / wall:.0f} events/s."
+        )
+
+    best = max(rates, key=rates.get)
+    workers, threads = [int(n) for n in best.split('x')]
+
+    tuned = {
+        'host': socket.gethostname(),
+        'ncpu': ncpu,
+        'workers': workers,
+        'threads': threads,
+        'rates': rates,
+    }
+    with open(tune_file, 'w') as f:
+        json.dump(tuned, f, indent=4)
+
+    logger.info(
+        f"Autotune selected {workers} workers x {threads} threads. "
+        f"Result saved in {tune_file}."
+    )
+
+    return workers, threads
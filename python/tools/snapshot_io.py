@@ -0,0 +1,191 @@
+import os
+import json
+import logging
+from glob import glob
+
+from inputs.config.snapshot import get_snapshot_config
+
+logger = logging.getLogger(__name__)
+
+
+def require_ttree(feature):
+    '''
+    Raise a ValueError if the snapshots are not written as TTree, for the
+    features that cannot read RNTuples.
+    '''
+    fmt = get_snapshot_config()['format']
+    if fmt != 'TTree':
+        raise ValueError(
+            f"{feature} only supported for TTree snapshots, but the snapshots "
+            f"are written as {fmt} (inputs/config/snapshot.py)."
+        )
+
+
+def get_manifest_path(snap_dir, dtmc):
+    return os.path.join(snap_dir, dtmc, 'manifest.json')
+
+
+def get_snapshot_files(snap_dir, dtmc):
+    '''
+    Snapshot files of a dataset. If the snapshots have been compacted, the
+    files listed in the manifest are used, otherwise all file_*.root.
+
+    Args:
+    snap_dir (str): Directory of snapshots.
+    dtmc (str): 'DATA' or 'MC'.
+
+    Returns:
+    list: paths of the snapshot files.
+    '''
+    manifest = get_manifest_path(snap_dir, dtmc)
+
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            files = json.load(f)['files']
+        logger.debug(f"Reading {len(files)} {dtmc} snapshots from {manifest}")
+        return files
+
+    return sorted(glob(os.path.join(snap_dir, dtmc, 'file_*.root')))
+
+
+def remove_manifest(snap_dir, dtmc):
+    '''
+    Remove the manifest and the compacted files of a dataset, e.g. when
+    new snapshots are produced.
+    '''
+    manifest = get_manifest_path(snap_dir, dtmc)
+
+    if os.path.exists(manifest):
+        logger.info(f"Removing outdated manifest {manifest}")
+        os.remove(manifest)
+
+    compacted = glob(os.path.join(snap_dir, dtmc, 'compact_*.root'))\
+        + glob(os.path.join(snap_dir, dtmc, 'compact_*.json'))
+    if compacted:
+        logger.info(f"Removing {len(compacted)} outdated compacted files")
+    for path in compacted:
+        os.remove(path)
+
+    return
+
+
+def snapshot_options(lazy=False, fmt=None, cluster_mb=0):
+    '''
+    Snapshot options for the format set in inputs/config/snapshot.py.
+    RNTuple snapshots are read transparently by RDataFrame, so the
+    following steps do not depend on the format.
+
+    Args:
+    lazy (bool): Book the snapshot lazily.
+    fmt (str): 'TTree' or 'RNTuple', default from the config.
+    cluster_mb (float): Size of the TTree clusters in MB (auto flush),
+        default are the ROOT settings.
+
+    Returns:
+    ROOT.RDF.RSnapshotOptions
+    '''
+    import ROOT
+
+    fmt = fmt or get_snapshot_config()['format']
+
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fLazy = lazy
+
+    if fmt == 'RNTuple':
+        if ROOT.gROOT.GetVersionInt() < 63400:
+            raise RuntimeError(
+                "RNTuple snapshots need ROOT 6.34 or newer, "
+                f"found {ROOT.gROOT.GetVersion()}."
+            )
+        opts.fOutputFormat = ROOT.RDF.ESnapshotOutputFormat.kRNTuple
+
+    elif fmt != 'TTree':
+        raise ValueError(f"Unknown snapshot format {fmt}.")
+
+    elif cluster_mb > 0:
+        # negative values are bytes instead of entries
+        opts.fAutoFlush = -int(cluster_mb * 1024**2)
+
+    return opts
+
+
+def get_entries(obj, path, name='Events'):
+    '''
+    Number of entries of a snapshot.
+
+    Args:
+    obj: TTree or RNTuple read from the file.
+    path (str): Path to the file.
+    name (str): Name of the tree or ntuple.
+
+    Returns:
+    int
+    '''
+    import ROOT
+
+    if isinstance(obj, ROOT.TTree):
+        return obj.GetEntries()
+
+    reader = getattr(ROOT, 'RNTupleReader', None)\
+        or ROOT.Experimental.RNTupleReader
+
+    return reader.Open(name, path).GetNEntries()
+
+
+def count_entries(files):
+    '''
+    Number of entries in the 'Events' trees or ntuples of the given files.
+    '''
+    import ROOT
+
+    entries = 0
+    for f in files:
+        tf = ROOT.TFile.Open(f)
+        tree = tf.Get("Events")
+        if tree:
+            entries += get_entries(tree, f)
+        tf.Close()
+
+    return entries
+
+
+def get_friend_path(path):
+    '''
+    Friend tree with columns added to a snapshot after its production,
+    in friends/ next to the snapshot.
+    '''
+    return os.path.join(os.path.dirname(path), 'friends', os.path.basename(path))
+
+
+def get_friend_files(files):
+    '''
+    Friend trees of the given snapshots. Friends are only valid if they
+    were written after their snapshot; snapshots rewritten afterwards
+    (e.g. by dedup) need to be augmented again.
+
+    Args:
+    files (list): snapshot files.
+
+    Returns:
+    list: friend files in the order of the snapshots, None if no snapshot
+        has been augmented.
+    '''
+    friends = [get_friend_path(f) for f in files]
+    exists = [os.path.exists(f) for f in friends]
+
+    if not any(exists):
+        return None
+
+    stale = [
+        f for f, friend, e in zip(files, friends, exists)
+        if not e or os.path.getmtime(friend) < os.path.getmtime(f)
+    ]
+    if stale:
+        raise RuntimeError(
+            f"{len(stale)} snapshots, e.g. {stale[0]}, have no or outdated "
+            "friend trees. Please run --augment again."
+        )
+
+    logger.debug(f"Reading {len(friends)} friend trees, e.g. {friends[0]}")
+
+    return friends
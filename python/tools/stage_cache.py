@@ -0,0 +1,125 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path, chunk=1 << 20, max_size=64 << 20):
+    '''
+    Content hash of a file. Files larger than max_size are hashed by their
+    size and their first and last chunk only.
+
+    Args:
+    path (str): path to the file.
+    chunk (int): read size in bytes.
+    max_size (int): largest file size in bytes that is hashed completely.
+
+    Returns:
+    str: hex digest, 'missing' if the file does not exist.
+    '''
+    if not os.path.exists(path):
+        return 'missing'
+
+    h = hashlib.sha256()
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        if size <= max_size:
+            for block in iter(lambda: f.read(chunk), b''):
+                h.update(block)
+        else:
+            h.update(str(size).encode())
+            h.update(f.read(chunk))
+            f.seek(-chunk, os.SEEK_END)
+            h.update(f.read(chunk))
+
+    return h.hexdigest()
+
+
+def listing_digest(pattern):
+    '''
+    Hash of names, sizes and modification times of all files matching a
+    pattern. Used for large outputs of earlier steps, e.g. snapshots.
+    '''
+    h = hashlib.sha256()
+    for path in sorted(glob.glob(pattern)):
+        stat = os.stat(path)
+        h.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+
+    return h.hexdigest()
+
+
+def fingerprint(files=(), listings=(), configs=None, code=()):
+    '''
+    Fingerprint of the inputs of a step.
+
+    Args:
+    files (list): input files, hashed by content.
+    listings (list): glob patterns of input files, hashed by metadata.
+    configs (dict): configuration and command line options.
+    code (list): source files of the step.
+
+    Returns:
+    str: hex digest.
+    '''
+    h = hashlib.sha256()
+
+    for path in list(files) + list(code):
+        h.update(f'{path}:{file_digest(path)}'.encode())
+
+    for pattern in listings:
+        h.update(f'{pattern}:{listing_digest(pattern)}'.encode())
+
+    h.update(json.dumps(configs, sort_keys=True, default=str).encode())
+
+    return h.hexdigest()
+
+
+def is_up_to_date(stamp_file, fprint, outputs):
+    '''
+    Check whether a step has already been run with the same inputs and
+    whether its outputs still exist.
+
+    Args:
+    stamp_file (str): stamp of the last run of the step.
+    fprint (str): fingerprint of the current inputs.
+    outputs (list): glob patterns of the outputs of the step.
+
+    Returns:
+    bool
+    '''
+    if not os.path.exists(stamp_file):
+        return False
+
+    with open(stamp_file) as f:
+        stamp = json.load(f)
+
+    if stamp['fingerprint'] != fprint:
+        return False
+
+    missing = [o for o in outputs if not glob.glob(o)]
+    if missing:
+        logger.debug(f"Outputs {missing} of {stamp_file} are missing.")
+        return False
+
+    return True
+
+
+def write_stamp(stamp_file, fprint, outputs):
+    '''
+    Record the fingerprint of a successful run of a step.
+    '''
+    os.makedirs(os.path.dirname(stamp_file), exist_ok=True)
+
+    with open(stamp_file, 'w') as f:
+        json.dump({
+            'fingerprint': fprint,
+            'outputs': outputs,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }, f, indent=4)
+
+    return
@@ -0,0 +1,182 @@
+import os
+import sys
+import zlib
+import shutil
+import logging
+import subprocess
+from multiprocessing import util
+
+from inputs.config.snapshot import get_snapshot_config
+
+logger = logging.getLogger(__name__)
+
+repo_dir = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+# publish processes of this process that were not waited for yet
+_pending = []
+
+# processes that wait for their pending publishes and remove their scratch
+# directory when they exit
+_finalizer = set()
+
+
+def get_scratch_dir():
+    '''
+    Node-local directory for snapshots before they are published. Taken
+    from inputs/config/snapshot.py, otherwise the condor scratch directory,
+    $TMPDIR or /tmp.
+    '''
+    scratch = get_snapshot_config().get('scratch_dir')\
+        or os.environ.get('_CONDOR_SCRATCH_DIR')\
+        or os.environ.get('TMPDIR')\
+        or '/tmp'
+
+    scratch_dir = os.path.join(scratch, f'xycorr_{os.getpid()}', '')
+    os.makedirs(scratch_dir, exist_ok=True)
+
+    # forked workers do not inherit the finalizers of their parent
+    if os.getpid() not in _finalizer:
+        util.Finalize(
+            None, cleanup_scratch, args=(scratch_dir,), exitpriority=10
+        )
+        _finalizer.add(os.getpid())
+
+    return scratch_dir
+
+
+def cleanup_scratch(scratch_dir):
+    '''
+    Wait for the pending publishes of this process and remove its scratch
+    directory, when the process exits.
+    '''
+    try:
+        wait_published()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return
+
+
+def is_enabled():
+    return get_snapshot_config().get('staging', True)
+
+
+def stage_path(path):
+    '''
+    Path on scratch for an output that is published to path later.
+    '''
+    if not is_enabled():
+        return path
+
+    return os.path.join(get_scratch_dir(), os.path.basename(path))
+
+
+def file_checksum(path, blocksize=16 * 1024**2):
+    '''
+    adler32 checksum of a file, as used by EOS.
+    '''
+    checksum = 1
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            checksum = zlib.adler32(block, checksum)
+
+    return f'{checksum:08x}'
+
+
+def copy_and_replace(src, dst, checksum):
+    '''
+    Copy src next to dst, verify the checksum of the copy and move it to
+    dst in one rename, so dst is either missing or complete. src is
+    removed afterwards.
+
+    Args:
+    src (str): File on scratch.
+    dst (str): Final path, must be on a file system with atomic rename
+        (local disk, EOS fuse mount).
+    checksum (str): adler32 checksum of src.
+    '''
+    part = f'{dst}.part'
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+
+    with open(src, 'rb') as fin, open(part, 'wb') as fout:
+        shutil.copyfileobj(fin, fout, 16 * 1024**2)
+
+    copied = file_checksum(part)
+    if copied != checksum:
+        os.remove(part)
+        raise RuntimeError(
+            f"Checksum of {part} is {copied}, expected {checksum} from {src}."
+        )
+
+    os.replace(part, dst)
+    os.remove(src)
+
+    return
+
+
+def publish(src, dst, entries=None, expected=None):
+    '''
+    Publish a staged output in the background. The number of entries is
+    verified first, then the copy runs in a separate process, so that it
+    overlaps with the event loop of the next work unit. At most one
+    publish per process is in flight, the previous one is waited for.
+
+    Args:
+    src (str): File on scratch.
+    dst (str): Final path.
+    entries (int): Number of entries in src.
+    expected (int): Expected number of entries, e.g. from the event loop.
+    '''
+    if src == dst:
+        return
+
+    if expected is not None and entries != expected:
+        os.remove(src)
+        raise RuntimeError(
+            f"{src} contains {entries} entries, expected {expected}. "
+            "Not publishing it."
+        )
+
+    wait_published()
+
+    checksum = file_checksum(src)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'python.tools.staging', src, dst, checksum],
+        cwd=repo_dir
+    )
+    _pending.append((proc, dst))
+    logger.debug(f"Publishing {src} to {dst} (adler32 {checksum})")
+
+    return
+
+
+def wait_published():
+    '''
+    Wait for all publishes of this process.
+    '''
+    failed = []
+    while _pending:
+        proc, dst = _pending.pop(0)
+        if proc.wait() != 0:
+            failed.append(dst)
+
+    if failed:
+        raise RuntimeError(f"Publishing {', '.join(failed)} failed.")
+
+    return
+
+
+def main():
+    src, dst, checksum = sys.argv[1:4]
+    copy_and_replace(src, dst, checksum)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
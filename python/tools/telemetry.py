@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import glob
+import socket
+import logging
+from argparse import ArgumentParser
+
+from python.tools.logger_setup import setup_logger
+
+logger = logging.getLogger(__name__)
+
+header = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cpp', 'Heartbeat.h'
+)
+
+# sink directory and heartbeat interval of this run
+_config = {'sink_dir': None, 'interval': 30.}
+
+# heartbeat instance per process, workers create their own after fork
+_heartbeats = {}
+_declared = []
+
+
+def setup_telemetry(sink_dir, interval=30., clear=False):
+    '''
+    Enable heartbeats of the workers and condor jobs. Every process appends
+    json lines to {sink_dir}{host}_{pid}.jsonl, which can be followed with
+    the aggregator (--monitor).
+
+    Args:
+    sink_dir (str): Shared directory of the heartbeats.
+    interval (float): Seconds between heartbeats, 0 disables them.
+    clear (bool): Remove the heartbeats of earlier runs.
+    '''
+    if interval <= 0:
+        return
+
+    _config['sink_dir'] = sink_dir
+    _config['interval'] = interval
+    os.makedirs(sink_dir, exist_ok=True)
+
+    if clear:
+        for path in glob.glob(f'{sink_dir}*.jsonl'):
+            os.remove(path)
+
+    return
+
+
+def get_heartbeat():
+    '''
+    Heartbeat of the current process, None if telemetry is disabled.
+    '''
+    if _config['sink_dir'] is None:
+        return None
+
+    pid = os.getpid()
+    if pid not in _heartbeats:
+        import ROOT
+
+        if not _declared:
+            ROOT.gInterpreter.Declare(f'#include "{header}"')
+            _declared.append(header)
+
+        host = socket.gethostname()
+        name = f'xycorr_heartbeat_{pid}'
+        ROOT.gInterpreter.Declare(
+            f'Heartbeat {name}("{_config["sink_dir"]}{host}_{pid}.jsonl", '
+            f'"{host}", {_config["interval"]});'
+        )
+        _heartbeats[pid] = {'hb': getattr(ROOT, name), 'tracked': []}
+
+    return _heartbeats[pid]
+
+
+def track(rdf, unit, every=1000):
+    '''
+    Count the events of a dataframe into the heartbeat of this process
+    during its event loop. Does nothing if telemetry is disabled or the
+    graph runs on a distributed backend.
+
+    Args:
+    rdf (ROOT.RDataFrame): dataframe of the input events.
+    unit (str): work unit, e.g. the input file.
+    every (int): entries per slot between counter updates.
+
+    Returns:
+    RResultPtr: lazy number of events, None if telemetry is disabled.
+    '''
+    import python.tools.backends as backends
+    if backends.is_distributed():
+        return None
+
+    beat = get_heartbeat()
+    if beat is None:
+        return None
+
+    import ROOT
+
+    beat['hb'].Start(str(unit))
+    count = ROOT.TrackEvents(ROOT.RDF.AsRNode(rdf), beat['hb'], every)
+    # keep the result alive until the unit is finished
+    beat['tracked'] = [count]
+
+    return count
+
+
+def finish(count):
+    '''
+    Write the final heartbeat of a work unit with its exact event count.
+    '''
+    beat = get_heartbeat()
+    if beat is None or count is None:
+        return
+
+    beat['hb'].Finish(count.GetValue())
+    beat['tracked'] = []
+
+    return
+
+
+def read_heartbeats(sink_dir):
+    '''
+    All heartbeats in the sink, lines that are still being written are
+    skipped.
+    '''
+    beats = []
+    for path in glob.glob(f'{sink_dir}*.jsonl'):
+        with open(path) as f:
+            for line in f:
+                try:
+                    beats.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+    return beats
+
+
+def summarise_heartbeats(beats, nunits, interval, now=None):
+    '''
+    Throughput, ETA and stragglers of a run from its heartbeats.
+
+    Args:
+    beats (list): heartbeats (see read_heartbeats).
+    nunits (int): total number of work units (input files) of the run.
+    interval (float): heartbeat interval in seconds.
+    now (float): current time, default is time.time().
+
+    Returns:
+    dict
+    '''
+    now = now or time.time()
+
+    latest = {}
+    done = {}
+    for b in sorted(beats, key=lambda b: b['time']):
+        latest[(b['host'], b['pid'])] = b
+        if b['state'] == 'done':
+            done[b['unit']] = b
+
+    # processes with a recent heartbeat and an unfinished unit
+    live = [
+        b for b in latest.values()
+        if b['state'] != 'done' and now - b['time'] < 3 * interval
+    ]
+    stale = [
+        b for b in latest.values()
+        if b['state'] != 'done' and now - b['time'] >= 3 * interval
+    ]
+
+    durations = sorted(b['time'] - b['unit_start'] for b in done.values())
+    median = durations[len(durations) // 2] if durations else None
+
+    stragglers = [
+        b for b in live
+        if median is not None and now - b['unit_start'] > 3 * median
+    ]
+
+    first = min((b['time'] for b in beats), default=now)
+    elapsed = max(now - first, 1e-9)
+    events = sum(b['unit_events'] for b in done.values())\
+        + sum(b['unit_events'] for b in live)
+
+    eta = None
+    if done and nunits:
+        eta = (nunits - len(done)) * elapsed / len(done)
+
+    return {
+        'units_done': len(done),
+        'units_total': nunits,
+        'processes': len(live),
+        'events': events,
+        'rate': sum(b['rate'] for b in live),
+        'mean_rate': events / elapsed,
+        'bytes_read': sum(b['bytes_read'] for b in latest.values()),
+        'rss_mb': sum(b['rss_mb'] for b in live),
+        'eta': eta,
+        'stragglers': [(b['host'], b['pid'], b['unit']) for b in stragglers],
+        'stale': [(b['host'], b['pid'], b['unit']) for b in stale],
+    }
+
+
+def monitor(sink_dir, nunits, interval=30., once=False):
+    '''
+    Print throughput, ETA and stragglers of a running production until all
+    units are done.
+
+    Args:
+    sink_dir (str): Directory of the heartbeats.
+    nunits (int): Total number of work units (input files).
+    interval (float): Heartbeat interval of the run in seconds.
+    once (bool): Print the summary only once.
+    '''
+    while True:
+        s = summarise_heartbeats(read_heartbeats(sink_dir), nunits, interval)
+
+        eta = f"{s['eta'] / 60:.0f} min" if s['eta'] is not None else 'n/a'
+        logger.info(
+            f"{s['units_done']}/{s['units_total']} files done, "
+            f"{s['processes']} processes running, {s['events']} events, "
+            f"{s['rate']:.0f} events/s now ({s['mean_rate']:.0f} on average), "
+            f"{s['bytes_read'] / 1024**3:.1f} GB read, "
+            f"{s['rss_mb'] / 1024:.1f} GB rss, ETA {eta}"
+        )
+        for host, pid, unit in s['stragglers']:
+            logger.warning(f"Straggler {host}:{pid} still processing {unit}")
+        for host, pid, unit in s['stale']:
+            logger.warning(f"No heartbeat from {host}:{pid} ({unit})")
+
+        if once or (nunits and s['units_done'] >= nunits):
+            return s
+
+        time.sleep(interval)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Follow the heartbeats of a running production."
+    )
+    parser.add_argument("sink_dir", help="Directory of the heartbeats")
+    parser.add_argument("--nunits", default=0, type=int)
+    parser.add_argument("--interval", default=30., type=float)
+    parser.add_argument("--once", action='store_true')
+    args = parser.parse_args()
+
+    setup_logger('monitor.log')
+    monitor(args.sink_dir, args.nunits, args.interval, args.once)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import queue
+import logging
+import traceback
+import multiprocessing
+
+import python.tools.profiling as profiling
+import python.tools.resources as resources
+
+logger = logging.getLogger(__name__)
+
+# tasks after which a worker is replaced and rss ceiling per worker in MB,
+# 0 means no limit (max_tasks) or automatic (max_rss_mb), negative disables
+_config = {
+    'max_tasks': 0,
+    'max_rss_mb': 0.,
+}
+
+
+def setup_workers(max_tasks=0, max_rss_mb=0.):
+    '''
+    Configure the recycling of the worker processes of the snapshot and
+    streaming steps. Every input file adds jitted code and RDataFrame
+    state to the interpreter of a worker, so long-lived workers grow. A
+    worker is replaced by a fresh one after max_tasks files or as soon as
+    its rss exceeds the ceiling after a file.
+
+    Args:
+    max_tasks (int): Files per worker, 0 means no limit.
+    max_rss_mb (float): Rss ceiling per worker in MB. 0 uses 80% of the
+        available memory shared by the workers, negative values disable
+        the ceiling.
+    '''
+    _config.update(max_tasks=max_tasks, max_rss_mb=max_rss_mb)
+
+    return
+
+
+def get_rss_ceiling(nworkers):
+    '''
+    Rss ceiling per worker in MB, None if disabled.
+    '''
+    ceiling = _config['max_rss_mb']
+    if ceiling < 0:
+        return None
+    if ceiling == 0:
+        memory = resources.available_memory_mb()
+        if memory is None:
+            return None
+        ceiling = 0.8 * memory / max(nworkers, 1)
+
+    return ceiling
+
+
+def worker_loop(wid, func, tasks, results, current, initializer, initargs,
+                max_tasks, max_rss_mb):
+    '''
+    Process tasks until the queue is closed or the worker has to be
+    recycled. Exits normally, so that finalizers (e.g. pending publishes
+    of snapshots) still run. The index of the running task is kept in
+    shared memory, so it is known even if the worker is killed.
+    '''
+    if initializer is not None:
+        initializer(*initargs)
+
+    done = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        i, args = task
+        current.value = i
+        try:
+            results.put(('done', wid, i, func(args)))
+        except Exception:
+            results.put(('error', wid, i, traceback.format_exc()))
+        done += 1
+        current.value = -1
+
+        rss = profiling.current_rss_mb()
+        results.put(('rss', wid, i, rss))
+
+        if max_tasks and done >= max_tasks:
+            reason = f'{done} tasks'
+        elif max_rss_mb and rss > max_rss_mb:
+            reason = f'rss of {rss:.0f} MB'
+        else:
+            continue
+        results.put(('exit', wid, None, reason))
+        break
+
+    return
+
+
+def imap_unordered(func, arguments, nworkers, initializer=None, initargs=()):
+    '''
+    Like Pool.imap_unordered, but workers are recycled as configured with
+    setup_workers and the memory of every worker is tracked. Workers that
+    die (e.g. killed by the OOM killer) raise an error instead of leaving
+    the pool waiting. The memory per worker is logged at the end and added
+    to the profile of the current step.
+
+    Args:
+    func (function): Called with one element of arguments.
+    arguments (list): Task arguments, must be picklable. The first element
+        of each task (the input file) is named in errors.
+    nworkers (int): Number of worker processes.
+    initializer (function): Called with initargs in every new worker.
+    initargs (tuple): Arguments of the initializer.
+
+    Yields:
+    results of func in the order of completion.
+    '''
+    max_tasks = max(_config['max_tasks'], 0)
+    max_rss_mb = get_rss_ceiling(nworkers)
+    logger.debug(
+        f"Workers recycled after {max_tasks or 'unlimited'} tasks and at "
+        f"{max_rss_mb or 'unlimited'} MB rss."
+    )
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for i, args in enumerate(arguments):
+        tasks.put((i, args))
+
+    procs = {}
+    running = {}
+    stats = []
+
+    def spawn():
+        wid = len(stats)
+        running[wid] = multiprocessing.Value('i', -1, lock=False)
+        p = multiprocessing.Process(
+            target=worker_loop,
+            args=(wid, func, tasks, results, running[wid], initializer,
+                  initargs, max_tasks, max_rss_mb),
+            daemon=True
+        )
+        p.start()
+        procs[wid] = p
+        stats.append({
+            'pid': p.pid, 'tasks': 0, 'first_rss_mb': None,
+            'last_rss_mb': None, 'peak_rss_mb': 0., 'exit': None
+        })
+
+    pending = len(arguments)
+    try:
+        for _ in range(min(nworkers, pending)):
+            spawn()
+
+        while pending:
+            try:
+                kind, wid, i, value = results.get(timeout=1.)
+            except queue.Empty:
+                # messages of a dead worker arrive before it is seen dead
+                for wid, p in list(procs.items()):
+                    if p.is_alive():
+                        continue
+                    task = running[wid].value
+                    raise RuntimeError(
+                        f"Worker {p.pid} died with exit code {p.exitcode}"
+                        + (f" while processing {arguments[task][0]}."
+                           if task >= 0 else ".")
+                    )
+                continue
+
+            s = stats[wid]
+            if kind == 'done':
+                pending -= 1
+                yield value
+            elif kind == 'error':
+                raise RuntimeError(
+                    f"Processing {arguments[i][0]} failed in worker "
+                    f"{s['pid']}:\n{value}"
+                )
+            elif kind == 'rss':
+                s['tasks'] += 1
+                if s['first_rss_mb'] is None:
+                    s['first_rss_mb'] = value
+                s['last_rss_mb'] = value
+                s['peak_rss_mb'] = max(s['peak_rss_mb'], value)
+            elif kind == 'exit':
+                s['exit'] = value
+                procs.pop(wid).join()
+                logger.debug(f"Recycling worker {s['pid']} after {value}.")
+                # replace the worker while tasks are left
+                if pending > len(procs):
+                    spawn()
+
+        for _ in procs:
+            tasks.put(None)
+        for p in procs.values():
+            p.join()
+
+    finally:
+        # tasks left over after an error must not block the exit
+        tasks.cancel_join_thread()
+        for p in procs.values():
+            if p.is_alive():
+                p.terminate()
+
+    log_workers(stats)
+
+    return
+
+
+def log_workers(stats):
+    '''
+    Log the memory per worker and add it to the profile of the current
+    step.
+    '''
+    stats = [s for s in stats if s['tasks']]
+    if not stats:
+        return
+
+    lines = [
+        f"{'pid':>8} {'tasks':>6} {'first/MB':>9} {'last/MB':>9} "
+        f"{'peak/MB':>9} {'recycled after':>16}"
+    ]
+    for s in stats:
+        lines.append(
+            f"{s['pid']:>8} {s['tasks']:>6} {s['first_rss_mb']:>9.0f} "
+            f"{s['last_rss_mb']:>9.0f} {s['peak_rss_mb']:>9.0f} "
+            f"{s['exit'] or '-':>16}"
+        )
+    logger.info("Memory of the workers:\n" + "\n".join(lines))
+
+    profiling.update_record(
+        workers=len(stats),
+        workers_recycled=sum(s['exit'] is not None for s in stats),
+        worker_peak_rss_mb=max(s['peak_rss_mb'] for s in stats),
+    )
+
+    return